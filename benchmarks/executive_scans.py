@@ -0,0 +1,116 @@
+"""Compare the executive page's separate breakdown queries with the single grouping-sets pass.
+
+Counts how many times each approach reads the sessions table (from EXPLAIN
+QUERY PLAN) and times both against the current warehouse:
+
+    python benchmarks/executive_scans.py [--repeat 5]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "streamlit_app"))
+
+from database import connect_readonly  # noqa: E402
+from grouping_sets import EXECUTIVE_BREAKDOWNS_SQL  # noqa: E402
+
+# Unfiltered, as the page runs it with no global filters selected.
+BREAKDOWNS_SQL = EXECUTIVE_BREAKDOWNS_SQL.format(sessions="sessions", where="1 = 1")
+
+# The breakdowns as the executive page issued them before the grouping-sets
+# engine: each one re-joins sessions to listeners.
+SEPARATE_QUERIES = {
+    "kpis": """
+SELECT
+    COUNT(DISTINCT s.listener_id) AS active_listeners,
+    SUM(s.listen_minutes) AS total_minutes,
+    AVG(s.completion_percent) AS avg_completion,
+    SUM(CASE WHEN l.subscription_type = 'premium' THEN 1 ELSE 0 END) AS premium_sessions,
+    COUNT(*) AS total_sessions
+FROM sessions s
+JOIN listeners l ON s.listener_id = l.listener_id
+""",
+    "geo": """
+SELECT l.country, SUM(s.listen_minutes) AS minutes
+FROM sessions s
+JOIN listeners l ON s.listener_id = l.listener_id
+GROUP BY l.country
+""",
+    "platform": """
+SELECT
+    s.platform,
+    COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN s.listener_id END) AS premium_listeners,
+    COUNT(DISTINCT s.listener_id) AS all_listeners
+FROM sessions s
+JOIN listeners l ON s.listener_id = l.listener_id
+GROUP BY s.platform
+""",
+    "category": """
+SELECT
+    p.category,
+    COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN s.listener_id END) AS premium_listeners,
+    COUNT(DISTINCT s.listener_id) AS all_listeners
+FROM sessions s
+JOIN listeners l ON s.listener_id = l.listener_id
+JOIN episodes e ON s.episode_id = e.episode_id
+JOIN podcasts p ON e.podcast_id = p.podcast_id
+GROUP BY p.category
+""",
+    "episodes": """
+SELECT
+    e.episode_title,
+    p.category,
+    COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN s.listener_id END) AS premium_listeners,
+    SUM(s.listen_minutes) AS listen_minutes
+FROM sessions s
+JOIN listeners l ON s.listener_id = l.listener_id
+JOIN episodes e ON s.episode_id = e.episode_id
+JOIN podcasts p ON e.podcast_id = p.podcast_id
+GROUP BY e.episode_id, e.episode_title, p.category
+ORDER BY premium_listeners DESC, listen_minutes DESC
+LIMIT 10
+""",
+}
+
+# A plan step that reads sessions: the "s" alias, or a monthly partition of
+# the sessions view. Each approach reads every partition once per pass.
+_SESSIONS_ACCESS = re.compile(r"^(SCAN|SEARCH) (s|sessions(_\d{4}_\d{2})?)\b")
+
+
+def sessions_scans(conn, sql):
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return sum(1 for row in plan if _SESSIONS_ACCESS.match(row[3]))
+
+
+def median_seconds(conn, sqls, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for sql in sqls:
+            conn.execute(sql).fetchall()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions per approach.")
+    args = parser.parse_args()
+
+    conn = connect_readonly()
+    separate_scans = sum(sessions_scans(conn, sql) for sql in SEPARATE_QUERIES.values())
+    engine_scans = sessions_scans(conn, BREAKDOWNS_SQL)
+    separate_time = median_seconds(conn, SEPARATE_QUERIES.values(), args.repeat)
+    engine_time = median_seconds(conn, [BREAKDOWNS_SQL], args.repeat)
+
+    print(f"{'approach':<16} {'queries':>8} {'sessions scans':>15} {'median':>10}")
+    print(f"{'separate':<16} {len(SEPARATE_QUERIES):>8} {separate_scans:>15} {separate_time * 1000:>8.1f}ms")
+    print(f"{'grouping sets':<16} {1:>8} {engine_scans:>15} {engine_time * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
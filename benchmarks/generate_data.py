@@ -0,0 +1,167 @@
+"""Synthetic source CSVs in the layout of data/, at any scale.
+
+Everything is drawn with vectorised numpy in fixed-size chunks, so 100M
+sessions need no more memory than 1M. Popularity is skewed the way real
+listening is: a Zipf-like head of podcasts and episodes, heavy listeners
+with a long tail, a premium minority and seasonal months.
+
+    python benchmarks/generate_data.py --sessions 10000000 --out /tmp/podcast_10m
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+CATEGORIES = (["Comedy", "True Crime", "Technology", "Business", "Health", "Education"], [0.24, 0.22, 0.17, 0.15, 0.12, 0.10])
+LANGUAGES = (["English", "Hindi", "Spanish"], [0.6, 0.25, 0.15])
+GUEST_TYPES = (["solo", "expert", "celebrity"], [0.5, 0.35, 0.15])
+COUNTRIES = (["USA", "India", "UK", "Canada", "Germany", "Australia"], [0.32, 0.24, 0.14, 0.11, 0.10, 0.09])
+AGE_GROUPS = (["18-24", "25-34", "35-44", "45+"], [0.22, 0.36, 0.25, 0.17])
+GENDERS = (["Male", "Female", "Other"], [0.48, 0.48, 0.04])
+DEVICES = (["Mobile", "Desktop", "Tablet"], [0.62, 0.25, 0.13])
+PLATFORMS = (["iOS", "Android", "Web"], [0.38, 0.40, 0.22])
+PREMIUM_SHARE = 0.3
+# Relative listening volume per month of the session year.
+MONTH_WEIGHTS = np.array([1.0, 0.92, 0.98, 0.95, 1.02, 1.05, 1.12, 1.08, 1.0, 0.97, 0.94, 1.03])
+
+CHUNK_ROWS = 1_000_000
+
+
+def _choice(rng, options, size):
+    values, weights = options
+    return np.asarray(values)[rng.choice(len(values), size=size, p=weights)]
+
+
+def _zipf_weights(size, exponent, rng):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def _dates(rng, start, end, size):
+    start, end = np.datetime64(start), np.datetime64(end)
+    days = rng.integers(0, (end - start).astype(int) + 1, size=size)
+    return (start + days.astype("timedelta64[D]")).astype(str)
+
+
+def _listen_times(rng, size, year):
+    months = rng.choice(12, size=size, p=MONTH_WEIGHTS / MONTH_WEIGHTS.sum())
+    month_start = np.array([np.datetime64(f"{year}-{month + 1:02d}-01") for month in range(12)])
+    month_days = np.diff(np.append(month_start, np.datetime64(f"{year + 1}-01-01"))).astype(int)
+    minutes = (rng.random(size) * month_days[months] * 24 * 60).astype(int)
+    stamps = month_start[months].astype("datetime64[m]") + minutes.astype("timedelta64[m]")
+    return pd.Series(stamps).dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy()
+
+
+def generate(out_dir, sessions, listeners=None, podcasts=None, episodes_per_podcast=8, year=2024, seed=42):
+    rng = np.random.default_rng(seed)
+    listeners = listeners or max(sessions // 10, 100)
+    podcasts = podcasts or max(sessions // 1000, 50)
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {}
+
+    podcast_ids = np.arange(1, podcasts + 1)
+    pd.DataFrame(
+        {
+            "podcast_id": podcast_ids,
+            "podcast_name": [f"Podcast_{i}" for i in podcast_ids],
+            "category": _choice(rng, CATEGORIES, podcasts),
+            "language": _choice(rng, LANGUAGES, podcasts),
+            "launch_date": _dates(rng, f"{year - 4}-01-01", f"{year - 1}-12-31", podcasts),
+        }
+    ).to_csv(os.path.join(out_dir, "podcasts.csv"), index=False)
+    counts["podcasts"] = podcasts
+
+    # Bigger shows publish more episodes.
+    per_podcast = np.maximum(1, rng.poisson(episodes_per_podcast * podcasts * _zipf_weights(podcasts, 0.6, rng)))
+    episodes = int(per_podcast.sum())
+    episode_ids = np.arange(1, episodes + 1)
+    durations = np.clip(rng.gamma(4.0, 12.0, size=episodes), 15, 120).astype(int)
+    pd.DataFrame(
+        {
+            "episode_id": episode_ids,
+            "podcast_id": np.repeat(podcast_ids, per_podcast),
+            "episode_title": [f"Episode_{i}" for i in episode_ids],
+            "publish_date": _dates(rng, f"{year - 1}-01-01", f"{year}-12-31", episodes),
+            "duration_minutes": durations,
+            "guest_type": _choice(rng, GUEST_TYPES, episodes),
+        }
+    ).to_csv(os.path.join(out_dir, "episodes.csv"), index=False)
+    counts["episodes"] = episodes
+
+    listener_ids = np.arange(1, listeners + 1)
+    pd.DataFrame(
+        {
+            "listener_id": listener_ids,
+            "country": _choice(rng, COUNTRIES, listeners),
+            "age_group": _choice(rng, AGE_GROUPS, listeners),
+            "gender": _choice(rng, GENDERS, listeners),
+            "subscription_type": np.where(rng.random(listeners) < PREMIUM_SHARE, "premium", "free"),
+            "signup_date": _dates(rng, f"{year - 3}-01-01", f"{year}-12-31", listeners),
+        }
+    ).to_csv(os.path.join(out_dir, "listeners.csv"), index=False)
+    counts["listeners"] = listeners
+
+    episode_weights = _zipf_weights(episodes, 1.05, rng)
+    # Lognormal activity: most listeners are light, a few are very heavy.
+    listener_weights = rng.lognormal(0.0, 1.0, size=listeners)
+    listener_weights /= listener_weights.sum()
+
+    sessions_path = os.path.join(out_dir, "listening_sessions.csv")
+    episode_plays = np.zeros(episodes, dtype=np.int64)
+    written = 0
+    while written < sessions:
+        size = min(CHUNK_ROWS, sessions - written)
+        episode_index = rng.choice(episodes, size=size, p=episode_weights)
+        completion = np.clip(np.round(rng.beta(3.0, 1.6, size=size) * 100), 5, 100).astype(int)
+        minutes = np.clip(np.round(durations[episode_index] * completion / 100), 1, 90).astype(int)
+        pd.DataFrame(
+            {
+                "session_id": np.arange(written + 1, written + size + 1),
+                "listener_id": rng.choice(listeners, size=size, p=listener_weights) + 1,
+                "episode_id": episode_index + 1,
+                "listen_start_time": _listen_times(rng, size, year),
+                "listen_minutes": minutes,
+                "completion_percent": completion,
+                "device": _choice(rng, DEVICES, size),
+                "platform": _choice(rng, PLATFORMS, size),
+            }
+        ).to_csv(sessions_path, mode="w" if written == 0 else "a", header=written == 0, index=False)
+        episode_plays += np.bincount(episode_index, minlength=episodes)
+        written += size
+    counts["sessions"] = sessions
+
+    ads_shown = rng.poisson(episode_plays * 0.8 + 50)
+    ads_clicked = rng.binomial(ads_shown, rng.uniform(0.02, 0.12, size=episodes))
+    pd.DataFrame(
+        {
+            "episode_id": episode_ids,
+            "ads_shown": ads_shown,
+            "ads_clicked": ads_clicked,
+            "revenue_generated": ads_clicked * rng.uniform(0.8, 3.5, size=episodes),
+        }
+    ).to_csv(os.path.join(out_dir, "revenue.csv"), index=False)
+    counts["revenue"] = episodes
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic podcast source data.")
+    parser.add_argument("--out", required=True, help="Directory to write the CSV files to")
+    parser.add_argument("--sessions", type=int, default=1_000_000)
+    parser.add_argument("--listeners", type=int, help="Defaults to sessions / 10")
+    parser.add_argument("--podcasts", type=int, help="Defaults to sessions / 1000, at least 50")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.out, args.sessions, args.listeners, args.podcasts, seed=args.seed)
+    summary = ", ".join(f"{table} {rows:,}" for table, rows in counts.items())
+    print(f"Generated {summary} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""End-to-end timings at a chosen scale, written as a JSON report.
+
+Generates synthetic source data (or reuses --data-dir), then times a full
+ingest, a segmentation fit, and every query the four pages and the SQL
+Explorer starter templates run. Queries go straight to a read-only connection,
+bypassing the result cache, and each reports its median over --repeat runs.
+
+    python benchmarks/scale_suite.py --sessions 10000000 --output bench-10m.json
+
+Compare two reports with any JSON diff, or load them into pandas.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "streamlit_app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import setup_database  # noqa: E402
+from generate_data import generate  # noqa: E402
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def page_queries():
+    """Every query the app issues, keyed by (page, name), as (sql, params)."""
+    # The page modules read PODCAST_BI_DB when imported, so this runs after
+    # the environment points at the benchmark database.
+    from audience_dashboard import AUDIENCE_QUERY
+    from data_storytelling import STORY_QUERIES
+    from executive_dashboard import EXACT_QUERIES, EXECUTIVE_QUERIES, approximate_queries, reach_dimensions
+    from filters import Filters, bind_queries
+    from leaderboards import ALL_CATEGORIES, ALL_TIME, LEADERBOARD_SQL
+    from retention_page import RETENTION_QUERIES
+    from sql_page import CATALOG_COLUMNS_QUERY, CATALOG_TABLES_QUERY, QUERY_TEMPLATES
+
+    # The filtered pages run once unfiltered and once for the last 30 days;
+    # the executive page with both its exact and its sketch-based queries.
+    last_30_days = _last_30_days()
+    executive = dict(EXECUTIVE_QUERIES, **EXACT_QUERIES, **approximate_queries(reach_dimensions()))
+    queries = {}
+    pages = (("executive", executive), ("storytelling", STORY_QUERIES), ("retention", RETENTION_QUERIES))
+    for page, page_queries in pages:
+        for name, bound in bind_queries(page_queries, Filters()).items():
+            queries[(page, name)] = bound
+        for name, bound in bind_queries(page_queries, last_30_days).items():
+            queries[(page, f"{name} (last 30 days)")] = bound
+    for entity, sql in LEADERBOARD_SQL.items():
+        params = {"metric": "premium_listeners", "category": ALL_CATEGORIES, "period": ALL_TIME, "limit": 10}
+        queries[("executive", f"{entity} leaderboard")] = (sql, params)
+    queries[("audience", "audience")] = (AUDIENCE_QUERY, None)
+    queries[("sql_explorer", "catalog_tables")] = (CATALOG_TABLES_QUERY, None)
+    queries[("sql_explorer", "catalog_columns")] = (CATALOG_COLUMNS_QUERY, None)
+    for name, sql in QUERY_TEMPLATES.items():
+        queries[("sql_explorer", name)] = (sql, None)
+    return queries
+
+
+def _last_30_days():
+    from database import connect_readonly
+    from filters import Filters
+
+    conn = connect_readonly()
+    try:
+        last_day = conn.execute("SELECT MAX(day) FROM rollup_daily_listening").fetchone()[0]
+    finally:
+        conn.close()
+    end = date.fromisoformat(last_day)
+    return Filters(end - timedelta(days=29), end)
+
+
+def time_queries(queries, repeat):
+    from database import connect_readonly
+
+    conn = connect_readonly()
+    results = []
+    try:
+        for (page, name), (sql, params) in queries.items():
+            timings = []
+            rows = 0
+            for _ in range(repeat):
+                seconds, fetched = _timed(lambda: conn.execute(sql, params or ()).fetchall())
+                timings.append(seconds)
+                rows = len(fetched)
+            results.append(
+                {
+                    "page": page,
+                    "query": name,
+                    "median_s": statistics.median(timings),
+                    "min_s": min(timings),
+                    "rows": rows,
+                }
+            )
+            print(f"  {page:<14}{name[:44]:<46}{statistics.median(timings) * 1000:>10.1f}ms")
+    finally:
+        conn.close()
+    return results
+
+
+def _load_segmentation():
+    path = os.path.join(REPO_ROOT, "notebooks", "segementation.py")
+    spec = importlib.util.spec_from_file_location("segementation", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_suite(sessions, data_dir=None, work_dir=None, repeat=3, seed=42):
+    work_dir = work_dir or tempfile.mkdtemp(prefix="podcast-bench-")
+    report = {
+        "revision": _git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "data_dir": data_dir,
+    }
+
+    if data_dir is None:
+        data_dir = os.path.join(work_dir, "data")
+        print(f"Generating {sessions:,} sessions into {data_dir}")
+        seconds, counts = _timed(generate, data_dir, sessions, seed=seed)
+        report["generate"] = {"seconds": seconds, "rows": counts}
+
+    db_path = os.path.join(work_dir, "podcast.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    print("Ingest")
+    seconds, changes = _timed(setup_database.build_database, db_path, data_dir)
+    rows = sum(changes.values())
+    report["ingest"] = {"seconds": seconds, "rows": changes, "rows_per_s": rows / seconds if seconds else None}
+    report["database_bytes"] = os.path.getsize(db_path)
+
+    # Segmentation runs before the queries because the audience page reads
+    # the listener_segments table it writes.
+    print("Segmentation")
+    segmentation = _load_segmentation()
+    model_path = os.path.join(work_dir, "segmentation.joblib")
+    seconds, assigned = _timed(segmentation.run, db_path, model_path, retrain=True, export_path=None)
+    report["segmentation"] = {"seconds": seconds, "listeners": assigned}
+
+    os.environ["PODCAST_BI_DB"] = db_path
+    print("Queries")
+    report["queries"] = time_queries(page_queries(), repeat)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time ingest, page queries and segmentation at scale.")
+    parser.add_argument("--sessions", type=int, default=1_000_000, help="Sessions to generate")
+    parser.add_argument("--data-dir", help="Use existing source CSVs instead of generating them")
+    parser.add_argument("--work-dir", help="Where generated data and the database go (default: a temp dir)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per query; the median is reported")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    report = run_suite(args.sessions, args.data_dir, args.work_dir, args.repeat, args.seed)
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(payload + "\n")
+        print(f"Report written to {args.output}")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
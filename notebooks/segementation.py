@@ -1,29 +1,307 @@
-import pandas as pd
-from sqlalchemy import create_engine
-from sklearn.cluster import KMeans
+"""Listener segmentation with a persisted, incrementally updated MiniBatchKMeans.
 
-engine = create_engine("sqlite:///database/podcast.db")
+Features come from the listener_features table that ingest keeps up to date,
+streamed in chunks, so the job never aggregates or loads raw sessions. The
+first run (or --retrain) fits a StandardScaler and MiniBatchKMeans over all
+listeners with partial_fit and saves both. Later runs only look at listeners
+whose features absorbed sessions past the last run's high-water mark: the
+model takes a partial_fit step on them and only they are re-assigned.
 
-sessions=pd.read_sql("SELECT * FROM sessions",engine)
+Each chunk holds only the feature columns, with integer columns downcast
+and the model input in float32. --profile-memory prints the peak resident
+memory of every stage, for sizing the machine the job runs on.
 
-agg=sessions.groupby("listener_id").agg({
+    python notebooks/segementation.py [--db database/podcast.db] [--retrain] [--profile-memory]
+"""
 
-"listen_minutes":"sum",
-"completion_percent":"mean",
-"session_id":"count"
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager, nullcontext
 
-}).reset_index()
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
 
-agg.columns=["listener_id","total_minutes","avg_completion","sessions"]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
-model=KMeans(n_clusters=3,random_state=42)
+from warehouse import catalog, listener_features, schema  # noqa: E402
 
-agg["segment"]=model.fit_predict(
+DB_PATH = "database/podcast.db"
+MODEL_PATH = "models/segmentation.joblib"
+EXPORT_PATH = "data/listener_segments.csv"
 
-agg[["total_minutes","avg_completion","sessions"]]
+FEATURES = ["total_minutes", "avg_completion", "sessions"]
+N_SEGMENTS = 3
+CHUNK_LISTENERS = 50_000
+TRAIN_EPOCHS = 5
+WATERMARK_KEY = "segmentation_max_session_id"
+# The listener_features generation the segments were computed from.
+GENERATION_KEY = "segmentation_features_generation"
+# The scaler and model work in float32, half the memory of float64.
+MODEL_DTYPE = np.float32
 
+SEGMENTS_DDL = """
+CREATE TABLE IF NOT EXISTS listener_segments (
+    listener_id INTEGER PRIMARY KEY REFERENCES listeners (listener_id),
+    total_minutes INTEGER NOT NULL,
+    avg_completion REAL NOT NULL,
+    sessions INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
 )
+"""
+
+FEATURES_SQL = """
+SELECT
+    listener_id,
+    listen_minutes AS total_minutes,
+    1.0 * completion_sum / sessions AS avg_completion,
+    sessions
+FROM listener_features
+{where}
+ORDER BY listener_id
+"""
+
+UPSERT_SQL = """
+INSERT INTO listener_segments (listener_id, total_minutes, avg_completion, sessions, segment, updated_at)
+VALUES (?, ?, ?, ?, ?, datetime('now'))
+ON CONFLICT (listener_id) DO UPDATE SET
+    total_minutes = excluded.total_minutes,
+    avg_completion = excluded.avg_completion,
+    sessions = excluded.sessions,
+    segment = excluded.segment,
+    updated_at = excluded.updated_at
+"""
+
+
+def _compact(chunk):
+    # Counts and minutes are downcast to the smallest integer type that holds
+    # them. avg_completion stays float64: it is written back to
+    # listener_segments, and only the model input is float32.
+    for column in ["listener_id", "total_minutes"]:
+        chunk[column] = pd.to_numeric(chunk[column], downcast="integer")
+    chunk["sessions"] = pd.to_numeric(chunk["sessions"], downcast="unsigned")
+    return chunk
+
+
+def feature_chunks(conn, since=None):
+    if since is None:
+        chunks = pd.read_sql(FEATURES_SQL.format(where=""), conn, chunksize=CHUNK_LISTENERS)
+    else:
+        # idx_listener_features_session finds the changed listeners directly.
+        sql = FEATURES_SQL.format(where="WHERE last_session_id > ?")
+        chunks = pd.read_sql(sql, conn, params=(since,), chunksize=CHUNK_LISTENERS)
+    for chunk in chunks:
+        yield _compact(chunk)
+
+
+def _matrix(chunk):
+    return chunk[FEATURES].to_numpy(dtype=MODEL_DTYPE)
+
+
+def _no_stage(name):
+    return nullcontext()
+
+
+def fit(conn, stage=_no_stage):
+    scaler = StandardScaler()
+    with stage("fit scaler"):
+        for chunk in feature_chunks(conn):
+            scaler.partial_fit(_matrix(chunk))
+
+    model = MiniBatchKMeans(n_clusters=N_SEGMENTS, random_state=42, n_init=3)
+    with stage("train model"):
+        for _ in range(TRAIN_EPOCHS):
+            for chunk in feature_chunks(conn):
+                if len(chunk) >= N_SEGMENTS:
+                    model.partial_fit(scaler.transform(_matrix(chunk)))
+    return scaler, model
+
+
+def update(conn, scaler, model, since):
+    # The scaler stays fixed so existing assignments keep their meaning; only
+    # the centroids move towards the changed listeners.
+    for chunk in feature_chunks(conn, since):
+        if len(chunk) >= N_SEGMENTS:
+            model.partial_fit(scaler.transform(_matrix(chunk)))
+
+
+def assign(conn, scaler, model, since=None):
+    assigned = 0
+    for chunk in feature_chunks(conn, since):
+        segments = model.predict(scaler.transform(_matrix(chunk)))
+        rows = zip(
+            chunk["listener_id"].tolist(),
+            chunk["total_minutes"].tolist(),
+            chunk["avg_completion"].tolist(),
+            chunk["sessions"].tolist(),
+            segments.tolist(),
+        )
+        conn.executemany(UPSERT_SQL, rows)
+        assigned += len(chunk)
+    return assigned
+
+
+def _peak_rss():
+    """Peak resident set size in bytes since the last _reset_peak_rss."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _reset_peak_rss():
+    # Writing 5 to clear_refs resets the high-water mark on Linux. Elsewhere
+    # the peak cannot be reset and each stage reports the process peak so far.
+    try:
+        with open("/proc/self/clear_refs", "w") as refs:
+            refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class MemoryProfile:
+    """Peak RSS and wall time of each stage of a run."""
+
+    def __init__(self):
+        self.stages = []
+        self.per_stage = True
+
+    @contextmanager
+    def stage(self, name):
+        self.per_stage = _reset_peak_rss() and self.per_stage
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, _peak_rss(), time.perf_counter() - started))
+
+    def report(self):
+        scope = "per stage" if self.per_stage else "process peak so far; per-stage reset needs Linux"
+        print(f"Peak RSS ({scope}):")
+        for name, peak, seconds in self.stages:
+            print(f"  {name:<16} {peak / (1024 * 1024):>9.1f} MB {seconds:>8.2f}s")
+
+
+def _read_meta(conn, key):
+    row = conn.execute("SELECT value FROM warehouse_meta WHERE key = ?", (key,)).fetchone()
+    return int(row[0]) if row else None
+
+
+def _write_meta(conn, key, value):
+    conn.execute(
+        "INSERT INTO warehouse_meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        (key, str(value)),
+    )
+
+
+def export_csv(conn, path=EXPORT_PATH):
+    segments = pd.read_sql(
+        "SELECT listener_id, total_minutes, avg_completion, sessions, segment "
+        "FROM listener_segments ORDER BY listener_id",
+        conn,
+    )
+    segments.to_csv(path, index=False)
+
+
+def run(db_path=DB_PATH, model_path=MODEL_PATH, retrain=False, export_path=EXPORT_PATH, profile_memory=False):
+    started = time.perf_counter()
+    profile = MemoryProfile() if profile_memory else None
+    stage = profile.stage if profile else _no_stage
+    conn = sqlite3.connect(db_path)
+    try:
+        with stage("startup"):
+            conn.execute(SEGMENTS_DDL)
+            conn.execute(schema.META_DDL)
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'listener_features'").fetchone():
+                raise SystemExit("listener_features is missing; run setup_database.py first.")
+            max_session_id = conn.execute(
+                "SELECT COALESCE(MAX(last_session_id), 0) FROM listener_features"
+            ).fetchone()[0]
+            watermark = _read_meta(conn, WATERMARK_KEY)
+            generation = _read_meta(conn, listener_features.GENERATION_KEY)
+
+            # A new features generation or a watermark past the current data
+            # means the sessions were reloaded, possibly under the same ids.
+            incremental = (
+                not retrain
+                and os.path.exists(model_path)
+                and watermark is not None
+                and watermark <= max_session_id
+                and _read_meta(conn, GENERATION_KEY) == generation
+            )
+            if incremental and max_session_id != watermark:
+                scaler, model = joblib.load(model_path)
+                # Models saved before the float32 features are refit once.
+                incremental = model.cluster_centers_.dtype == MODEL_DTYPE
+        if incremental:
+            if max_session_id == watermark:
+                print("Segments up to date")
+                if profile:
+                    profile.report()
+                return 0
+            with stage("update model"):
+                update(conn, scaler, model, since=watermark)
+            with stage("assign segments"):
+                assigned = assign(conn, scaler, model, since=watermark)
+        else:
+            scaler, model = fit(conn, stage)
+            with stage("assign segments"):
+                conn.execute("DELETE FROM listener_segments")
+                assigned = assign(conn, scaler, model)
+
+        os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+        joblib.dump((scaler, model), model_path)
+
+        _write_meta(conn, WATERMARK_KEY, max_session_id)
+        if generation is not None:
+            _write_meta(conn, GENERATION_KEY, generation)
+        # Ingest only profiles the tables it writes.
+        catalog.ensure_tables(conn)
+        catalog.profile_table(conn, "listener_segments")
+        schema.bump_data_version(conn)
+        conn.commit()
+        if export_path:
+            with stage("export csv"):
+                export_csv(conn, export_path)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    mode = "updated" if incremental else "trained"
+    print(f"Segmentation {mode}: {assigned:,} listeners assigned in {time.perf_counter() - started:.2f}s")
+    if profile:
+        profile.report()
+    return assigned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment listeners by listening behaviour.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database to read features from and write segments to")
+    parser.add_argument("--model", default=MODEL_PATH, help="Where the fitted scaler and model are kept")
+    parser.add_argument("--retrain", action="store_true", help="Refit from scratch and re-assign every listener")
+    parser.add_argument("--export", default=EXPORT_PATH, help="CSV export of the segments; pass '' to skip it")
+    parser.add_argument("--profile-memory", action="store_true", help="Print the peak RSS of each stage")
+    args = parser.parse_args()
+    run(args.db, args.model, retrain=args.retrain, export_path=args.export, profile_memory=args.profile_memory)
 
-agg.to_csv("data/listener_segments.csv",index=False)
 
-print("Segmentation Saved")
+if __name__ == "__main__":
+    main()
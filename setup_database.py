@@ -1,18 +1,468 @@
+import argparse
+import os
+import sqlite3
+import time
+
 import pandas as pd
-from sqlalchemy import create_engine
 
-engine = create_engine("sqlite:///database/podcast.db")
+from warehouse import partitions, schema
+from warehouse.delta import IngestDelta, track_listener_changes
+from warehouse.refresh import refresh_derived
+
+DB_PATH = "database/podcast.db"
+DATA_DIR = "data"
+CHUNK_ROWS = 100_000
+
+# Load order matters: dimensions first, then facts that reference them.
+# Each column maps to the pandas dtype used while streaming the CSV; the SQL
+# types, keys and indexes live in warehouse/schema.py.
+TABLES = {
+    "podcasts": (
+        "podcasts.csv",
+        {
+            "podcast_id": "int32",
+            "podcast_name": "string",
+            "category": "string",
+            "language": "string",
+            "launch_date": "string",
+        },
+    ),
+    "episodes": (
+        "episodes.csv",
+        {
+            "episode_id": "int32",
+            "podcast_id": "int32",
+            "episode_title": "string",
+            "publish_date": "string",
+            "duration_minutes": "int16",
+            "guest_type": "string",
+        },
+    ),
+    "listeners": (
+        "listeners.csv",
+        {
+            "listener_id": "int32",
+            "country": "string",
+            "age_group": "string",
+            "gender": "string",
+            "subscription_type": "string",
+            "signup_date": "string",
+        },
+    ),
+    "sessions": (
+        "listening_sessions.csv",
+        {
+            "session_id": "int64",
+            "listener_id": "int32",
+            "episode_id": "int32",
+            "listen_start_time": "string",
+            "listen_minutes": "int16",
+            "completion_percent": "int8",
+            "device": "string",
+            "platform": "string",
+        },
+    ),
+    "revenue": (
+        "revenue.csv",
+        {
+            "episode_id": "int32",
+            "ads_shown": "int32",
+            "ads_clicked": "int32",
+            "revenue_generated": "float64",
+        },
+    ),
+}
+
+# Primary key of every table. Dimensions are upserted on it in incremental
+# mode; sessions are append-only and use it as the high-water mark.
+TABLE_KEYS = {
+    "podcasts": "podcast_id",
+    "episodes": "episode_id",
+    "listeners": "listener_id",
+    "sessions": "session_id",
+    "revenue": "episode_id",
+}
+APPEND_ONLY_TABLES = {"sessions"}
+
+# Bulk-load settings for the single writer connection. WAL lets the
+# dashboards' read-only connections keep reading their snapshot while the load
+# transaction is open, and the page cache is capped so memory stays flat.
+LOAD_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=30000",
+)
+
+WATERMARKS_DDL = """
+CREATE TABLE IF NOT EXISTS ingest_watermarks (
+    table_name TEXT PRIMARY KEY,
+    source_file TEXT NOT NULL,
+    source_size INTEGER NOT NULL,
+    source_mtime REAL NOT NULL,
+    byte_offset INTEGER NOT NULL,
+    max_key INTEGER,
+    max_event_time TEXT,
+    rows_loaded INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+)
+"""
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _rows(chunk):
+    # Series.tolist() yields plain Python scalars, which sqlite3 binds directly.
+    columns = []
+    for name in chunk.columns:
+        col = chunk[name]
+        if col.hasnans:
+            col = col.astype(object).where(col.notna(), None)
+        columns.append(col.tolist())
+    return zip(*columns)
+
+
+def _ensure_table(conn, table):
+    if table == partitions.PARENT:
+        partitions.ensure_parent(conn)
+    elif not schema.table_exists(conn, table):
+        schema.create_table(conn, table)
+        schema.create_indexes(conn, [table])
+
+
+def _insert_sql(table, columns):
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)})"
+    )
+
+
+def _upsert_sql(table, columns):
+    key = TABLE_KEYS[table]
+    others = [name for name in columns if name != key]
+    assignments = ", ".join(f"{name} = excluded.{name}" for name in others)
+    current = ", ".join(f"{table}.{name}" for name in others)
+    incoming = ", ".join(f"excluded.{name}" for name in others)
+    # The WHERE clause turns unchanged rows into no-ops, so only real changes
+    # are written (and counted by total_changes).
+    return (
+        f"{_insert_sql(table, columns)} "
+        f"ON CONFLICT ({key}) DO UPDATE SET {assignments} "
+        f"WHERE ({current}) IS NOT ({incoming})"
+    )
+
+
+def _insert_partitioned(conn, chunk, columns, indexed=True):
+    """Route a chunk of sessions to their monthly partitions.
+
+    Returns True if a partition had to be created, in which case the caller
+    rebuilds the sessions view.
+    """
+    created_any = False
+    months = chunk[partitions.TIME_COLUMN].str.slice(0, 7)
+    for month, part in chunk.groupby(months, sort=False):
+        table, created = partitions.ensure_partition(conn, month, indexed)
+        created_any = created_any or created
+        conn.executemany(_insert_sql(table, columns), _rows(part[list(columns)]))
+        keys = part[partitions.KEY]
+        times = part[partitions.TIME_COLUMN]
+        partitions.record_rows(conn, month, len(part), int(keys.min()), int(keys.max()), times.min(), times.max())
+    return created_any
+
+
+def _read_chunks(source, columns, chunksize, names=None):
+    dtypes = dict(columns)
+    if names is None:
+        return pd.read_csv(source, usecols=list(columns), dtype=dtypes, chunksize=chunksize)
+    return pd.read_csv(
+        source, header=None, names=names, usecols=list(columns), dtype=dtypes, chunksize=chunksize
+    )
+
+
+def _source_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return stat.st_size, stat.st_mtime
+
+
+def read_watermark(conn, table):
+    if not schema.table_exists(conn, "ingest_watermarks"):
+        return None
+    row = conn.execute(
+        "SELECT source_file, source_size, source_mtime, byte_offset, max_key, max_event_time "
+        "FROM ingest_watermarks WHERE table_name = ?",
+        (table,),
+    ).fetchone()
+    if row is None:
+        return None
+    keys = ("source_file", "source_size", "source_mtime", "byte_offset", "max_key", "max_event_time")
+    return dict(zip(keys, row))
+
+
+def _write_watermark(conn, table, csv_path, byte_offset, rows_loaded):
+    size, mtime = _source_fingerprint(csv_path)
+    key = TABLE_KEYS[table]
+    max_event_time = None
+    if table == partitions.PARENT:
+        # Read from the partition catalog; MAX() over the view scans every partition.
+        max_key = partitions.max_session_id(conn)
+        max_event_time = partitions.last_listen_at(conn)
+    else:
+        max_key = conn.execute(f"SELECT MAX({key}) FROM {table}").fetchone()[0]
+    conn.execute(
+        """
+INSERT INTO ingest_watermarks (
+    table_name, source_file, source_size, source_mtime, byte_offset,
+    max_key, max_event_time, rows_loaded, updated_at
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+ON CONFLICT (table_name) DO UPDATE SET
+    source_file = excluded.source_file,
+    source_size = excluded.source_size,
+    source_mtime = excluded.source_mtime,
+    byte_offset = excluded.byte_offset,
+    max_key = excluded.max_key,
+    max_event_time = excluded.max_event_time,
+    rows_loaded = excluded.rows_loaded,
+    updated_at = excluded.updated_at
+""",
+        (table, os.path.abspath(csv_path), size, mtime, byte_offset, max_key, max_event_time, rows_loaded),
+    )
+
+
+def load_table(conn, table, csv_path, columns, chunksize=CHUNK_ROWS):
+    if table == partitions.PARENT:
+        return load_partitioned(conn, table, csv_path, columns, chunksize)
+
+    insert_sql = _insert_sql(table, columns)
+
+    # Indexes are built once after the bulk insert rather than maintained per row.
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    schema.create_table(conn, table)
+
+    loaded = 0
+    for chunk in _read_chunks(csv_path, columns, chunksize):
+        conn.executemany(insert_sql, _rows(chunk[list(columns)]))
+        loaded += len(chunk)
+    schema.create_indexes(conn, [table])
+    _write_watermark(conn, table, csv_path, _source_fingerprint(csv_path)[0], loaded)
+    return loaded
+
+
+def load_partitioned(conn, table, csv_path, columns, chunksize=CHUNK_ROWS):
+    partitions.drop_all(conn)
+    loaded = 0
+    for chunk in _read_chunks(csv_path, columns, chunksize):
+        _insert_partitioned(conn, chunk, columns, indexed=False)
+        loaded += len(chunk)
+    for partition in partitions.partition_tables(conn):
+        partitions.create_indexes(conn, partition)
+    partitions.rebuild_view(conn)
+    _write_watermark(conn, table, csv_path, _source_fingerprint(csv_path)[0], loaded)
+    return loaded
+
+
+def upsert_table(conn, table, csv_path, columns, chunksize=CHUNK_ROWS):
+    watermark = read_watermark(conn, table)
+    size, mtime = _source_fingerprint(csv_path)
+    if watermark and (watermark["source_size"], watermark["source_mtime"]) == (size, mtime):
+        return 0
+
+    _ensure_table(conn, table)
+
+    upsert_sql = _upsert_sql(table, columns)
+    # rowcount counts the upserted rows only; total_changes would also count
+    # the rows the listener_changes trigger writes.
+    changed = 0
+    for chunk in _read_chunks(csv_path, columns, chunksize):
+        changed += conn.executemany(upsert_sql, _rows(chunk[list(columns)])).rowcount
+    _write_watermark(conn, table, csv_path, size, changed)
+    return changed
+
+
+def _header(csv_path):
+    with open(csv_path, "rb") as f:
+        return f.readline()
+
+
+def append_table(conn, table, csv_path, columns, chunksize=CHUNK_ROWS):
+    key = TABLE_KEYS[table]
+    _ensure_table(conn, table)
+
+    watermark = read_watermark(conn, table)
+    if table == partitions.PARENT:
+        max_key = partitions.max_session_id(conn)
+    else:
+        max_key = conn.execute(f"SELECT MAX({key}) FROM {table}").fetchone()[0]
+    size, _ = _source_fingerprint(csv_path)
+    header = _header(csv_path)
+    names = header.decode("utf-8").strip().split(",")
+
+    # The source is an append-only log: resume right after the bytes already
+    # loaded. If the file was rewritten or truncated, rescan it and rely on the
+    # key filter alone.
+    offset = len(header)
+    if (
+        watermark
+        and watermark["source_file"] == os.path.abspath(csv_path)
+        and len(header) <= watermark["byte_offset"] <= size
+    ):
+        offset = watermark["byte_offset"]
+
+    insert_sql = _insert_sql(table, columns)
+    loaded = 0
+    new_partitions = False
+    with open(csv_path, "rb") as f:
+        f.seek(offset)
+        if offset < size:
+            for chunk in _read_chunks(f, columns, chunksize, names=names):
+                if max_key is not None:
+                    chunk = chunk[chunk[key] > max_key]
+                if table == partitions.PARENT:
+                    new_partitions = _insert_partitioned(conn, chunk, columns) or new_partitions
+                else:
+                    conn.executemany(insert_sql, _rows(chunk[list(columns)]))
+                loaded += len(chunk)
+        end_offset = f.tell()
+    if new_partitions:
+        partitions.rebuild_view(conn)
+
+    _write_watermark(conn, table, csv_path, end_offset, loaded)
+    return loaded
+
+
+def build_database(db_path=DB_PATH, data_dir=DATA_DIR, chunksize=CHUNK_ROWS, incremental=False):
+    conn = connect(db_path)
+    started = time.perf_counter()
+    total_rows = 0
+    changes = {}
+
+    try:
+        conn.execute("BEGIN")
+        conn.execute(WATERMARKS_DDL)
+        previous_max_session_id = None
+        if incremental:
+            migrated = schema.migrate(conn)
+            if migrated:
+                print(f"Migrated to schema v{schema.SCHEMA_VERSION}: {', '.join(migrated)}")
+            previous_max_session_id = partitions.max_session_id(conn)
+            track_listener_changes(conn)
+        for table, (file_name, columns) in TABLES.items():
+            csv_path = os.path.join(data_dir, file_name)
+            table_started = time.perf_counter()
+            if not incremental:
+                rows = load_table(conn, table, csv_path, columns, chunksize)
+            elif table in APPEND_ONLY_TABLES:
+                rows = append_table(conn, table, csv_path, columns, chunksize)
+            else:
+                rows = upsert_table(conn, table, csv_path, columns, chunksize)
+            elapsed = time.perf_counter() - table_started
+            total_rows += rows
+            changes[table] = rows
+            print(f"{table:<10} {rows:>12,} rows  {elapsed:8.2f}s  {rows / max(elapsed, 1e-9):>12,.0f} rows/s")
+
+        derived_started = time.perf_counter()
+        refresh_derived(conn, IngestDelta(not incremental, changes, previous_max_session_id))
+        print(f"{'derived':<10} {'':>12}       {time.perf_counter() - derived_started:8.2f}s")
+
+        if incremental:
+            conn.execute("PRAGMA optimize")
+        else:
+            conn.execute("ANALYZE")
+            conn.execute(f"PRAGMA user_version = {schema.SCHEMA_VERSION}")
+        if not incremental or any(changes.values()):
+            schema.bump_data_version(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{'total':<10} {total_rows:>12,} rows  {elapsed:8.2f}s  {total_rows / max(elapsed, 1e-9):>12,.0f} rows/s")
+    return changes
+
+
+def migrate_database(db_path=DB_PATH):
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN")
+        migrated = schema.migrate(conn)
+        if migrated:
+            # Rebuild the derived tables the dashboards read, which the older
+            # schema may lack or hold in an older layout.
+            refresh_derived(conn, IngestDelta(True, {}))
+            conn.execute("PRAGMA optimize")
+            schema.bump_data_version(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return migrated
+
+
+def compact_database(db_path=DB_PATH, before_month=None):
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN")
+        compacted = partitions.compact(conn, before_month)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return compacted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the podcast CSV files into the SQLite warehouse.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file to build.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory holding the source CSV files.")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS, help="Rows read and inserted per batch.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Append new sessions past the stored watermark and upsert changed dimension rows "
+        "instead of rebuilding every table.",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Upgrade an existing database to the current schema in place without loading any CSVs.",
+    )
+    parser.add_argument(
+        "--compact-before",
+        metavar="YYYY-MM",
+        help="Rewrite the session partitions of months before this one into packed pages, "
+        "leaving recent partitions untouched, and exit.",
+    )
+    args = parser.parse_args()
+
+    if args.compact_before:
+        compacted = compact_database(args.db, args.compact_before)
+        print(f"Compacted {len(compacted)} session partitions{': ' + ', '.join(compacted) if compacted else ''}")
+        return
+
+    if args.migrate:
+        migrated = migrate_database(args.db)
+        print(f"Schema v{schema.SCHEMA_VERSION}: migrated {', '.join(migrated) if migrated else 'nothing'}")
+        return
 
-podcasts = pd.read_csv("data/podcasts.csv")
-episodes = pd.read_csv("data/episodes.csv")
-listeners = pd.read_csv("data/listeners.csv")
-sessions = pd.read_csv("data/listening_sessions.csv")
-revenue = pd.read_csv("data/revenue.csv")
+    build_database(args.db, args.data_dir, args.chunksize, incremental=args.incremental)
+    print("Database Updated Successfully" if args.incremental else "Database Created Successfully")
 
-podcasts.to_sql("podcasts",engine,if_exists="replace",index=False)
-episodes.to_sql("episodes",engine,if_exists="replace",index=False)
-listeners.to_sql("listeners",engine,if_exists="replace",index=False)
-sessions.to_sql("sessions",engine,if_exists="replace",index=False)
-revenue.to_sql("revenue",engine,if_exists="replace",index=False)
 
-print("Database Created Successfully")
+if __name__ == "__main__":
+    main()
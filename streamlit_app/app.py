@@ -3,7 +3,11 @@ import streamlit as st
 from executive_dashboard import executive_page
 from data_storytelling import data_storytelling_page
 from audience_dashboard import audience_page
+from retention_page import retention_page
 from sql_page import sql_explorer
+from performance_page import performance_page
+from query_log import page_context
+from filters import filter_bar, keep_filter_state
 
 st.set_page_config(layout="wide")
 
@@ -17,24 +21,39 @@ page=st.sidebar.radio(
 "Executive Dashboard",
 "Data Storytelling",
 "Audience Insights",
-"SQL Explorer"
+"Retention",
+"SQL Explorer",
+"Performance"
 
 ]
 
 )
 
-if page=="Executive Dashboard":
+keep_filter_state()
 
-    executive_page()
+# Queries run while a page renders are logged against it.
+with page_context(page):
 
-elif page=="Data Storytelling":
+    if page=="Executive Dashboard":
 
-    data_storytelling_page()
+        executive_page(filter_bar())
 
-elif page=="Audience Insights":
+    elif page=="Data Storytelling":
 
-    audience_page()
+        data_storytelling_page(filter_bar())
 
-elif page=="SQL Explorer":
+    elif page=="Audience Insights":
 
-    sql_explorer()
+        audience_page()
+
+    elif page=="Retention":
+
+        retention_page(filter_bar())
+
+    elif page=="SQL Explorer":
+
+        sql_explorer()
+
+    elif page=="Performance":
+
+        performance_page()
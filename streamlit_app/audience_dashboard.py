@@ -2,6 +2,105 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+from database import data_version, run_query
+from fragments import page_fragment
+
+# Behaviour features are maintained by ingest in listener_features; the
+# segment comes from the latest run of notebooks/segementation.py.
+AUDIENCE_QUERY = """
+SELECT
+    f.listener_id,
+    f.listen_minutes AS total_minutes,
+    1.0 * f.completion_sum / f.sessions AS avg_completion,
+    f.sessions,
+    g.segment,
+    l.country,
+    l.age_group,
+    l.gender,
+    l.subscription_type
+FROM listener_features f
+JOIN listener_segments g ON g.listener_id = f.listener_id
+LEFT JOIN listeners l ON l.listener_id = f.listener_id
+"""
+
+SEGMENTS_EXIST_QUERY = "SELECT COUNT(*) AS tables FROM sqlite_master WHERE type = 'table' AND name = 'listener_segments'"
+
+CATEGORICAL_COLUMNS = ["segment", "country", "age_group", "gender", "subscription_type"]
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_audience(version):
+    """One typed listener frame per data version, shared by every session.
+
+    Low-cardinality strings are categoricals and numerics are downcast, so
+    the frame is a fraction of its object/int64 size. It is shared, not
+    copied: callers must derive new frames rather than modify it.
+    """
+    frame = run_query(AUDIENCE_QUERY, use_cache=False)
+    frame["segment"] = frame["segment"].astype(str)
+    for column in CATEGORICAL_COLUMNS:
+        frame[column] = frame[column].astype("category")
+    for column in ["listener_id", "total_minutes", "sessions"]:
+        frame[column] = pd.to_numeric(frame[column], downcast="integer")
+    frame["avg_completion"] = pd.to_numeric(frame["avg_completion"], downcast="float")
+    return frame
+
+
+# Above this many listeners the scatter is drawn from a bounded set of marks
+# (density bins or a sample) instead of one point per listener.
+SCATTER_POINT_LIMIT = 5_000
+DENSITY_BINS = 60
+SCATTER_AXES = ["total_minutes", "avg_completion"]
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def density_points(version, bins=DENSITY_BINS):
+    """Listeners binned on a bins x bins grid per segment.
+
+    Each mark sits at the mean position of the listeners in its bin and is
+    sized by how many there are, so there are at most segments x bins^2 marks.
+    """
+    df = load_audience(version)
+    cells = df.assign(
+        x_bin=pd.cut(df["total_minutes"], bins, labels=False),
+        y_bin=pd.cut(df["avg_completion"], bins, labels=False),
+    )
+    return (
+        cells.groupby(["segment", "x_bin", "y_bin"], as_index=False, observed=True)
+        .agg(
+            total_minutes=("total_minutes", "mean"),
+            avg_completion=("avg_completion", "mean"),
+            sessions=("sessions", "mean"),
+            listeners=("listener_id", "count"),
+        )
+        .drop(columns=["x_bin", "y_bin"])
+    )
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def sampled_points(version, limit=SCATTER_POINT_LIMIT):
+    """A per-segment stratified sample of listeners that keeps the outliers.
+
+    Listeners outside the 0.5th-99.5th percentile of any plotted measure in
+    their segment are kept (the most extreme first, up to a quarter of the
+    budget); the rest of the budget is spread across segments by size.
+    """
+    df = load_audience(version)
+    measures = SCATTER_AXES + ["sessions"]
+    by_segment = df.groupby("segment", observed=True)[measures]
+    low = by_segment.transform(lambda values: values.quantile(0.005))
+    high = by_segment.transform(lambda values: values.quantile(0.995))
+    spread = by_segment.transform("std").replace(0, 1)
+    centre = by_segment.transform("mean")
+    extremeness = ((df[measures] - centre).abs() / spread).max(axis=1)
+    is_outlier = ((df[measures] < low) | (df[measures] > high)).any(axis=1)
+
+    outliers = df[is_outlier].loc[extremeness[is_outlier].sort_values(ascending=False).index[: limit // 4]]
+    rest = df.drop(index=outliers.index)
+    fraction = min(1.0, (limit - len(outliers)) / max(len(rest), 1))
+    sample = rest.groupby("segment", observed=True).sample(frac=fraction, random_state=42)
+    return pd.concat([outliers, sample])
+
 
 def _root_cause_for_risk_segment(seg_row, overall_completion, overall_sessions):
     completion = float(seg_row["avg_completion"])
@@ -46,41 +145,19 @@ def _root_cause_for_growth_segment(seg_row, overall_completion, overall_sessions
 def audience_page():
     st.title("Audience Segments")
 
-    df = pd.read_csv("data/listener_segments.csv")
+    if not run_query(SEGMENTS_EXIST_QUERY).tables.iloc[0]:
+        st.warning("Listener segments have not been computed yet; run notebooks/segementation.py.")
+        return
+    df = load_audience(data_version())
     if df.empty:
         st.warning("No audience segment data available.")
         return
 
-    df["segment"] = df["segment"].astype(str)
-
     overall_minutes = float(df["total_minutes"].mean())
     overall_completion = float(df["avg_completion"].mean())
     overall_sessions = float(df["sessions"].mean())
 
-    fig = px.scatter(
-        df,
-        x="total_minutes",
-        y="avg_completion",
-        color="segment",
-        size="sessions",
-        title="Audience Segments: Depth vs Retention",
-        hover_data=["listener_id", "sessions"],
-    )
-    fig.add_vline(
-        x=overall_minutes,
-        line_dash="dash",
-        line_color="gray",
-        annotation_text="Avg minutes",
-        annotation_position="top left",
-    )
-    fig.add_hline(
-        y=overall_completion,
-        line_dash="dash",
-        line_color="gray",
-        annotation_text="Avg completion",
-        annotation_position="top right",
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    segment_scatter(df, overall_minutes, overall_completion)
 
     with st.expander("How to read this chart"):
         st.markdown(
@@ -91,7 +168,7 @@ def audience_page():
         )
 
     segment_summary = (
-        df.groupby("segment", as_index=False)
+        df.groupby("segment", as_index=False, observed=True)
         .agg(
             listeners=("listener_id", "count"),
             total_minutes=("total_minutes", "mean"),
@@ -187,18 +264,88 @@ def audience_page():
 
     st.divider()
 
-    # ================= DEMOGRAPHIC INSIGHTS =================
+    demographic_insights(df)
+
+
+# Switching the rendering mode reruns only the chart.
+@page_fragment
+def segment_scatter(df, overall_minutes, overall_completion):
+    # Same segment order, hence the same colours, in every rendering mode.
+    segment_order = {"segment": sorted(df["segment"].cat.categories)}
+    title = "Audience Segments: Depth vs Retention"
+    rendering = "Every listener"
+    if len(df) > SCATTER_POINT_LIMIT:
+        rendering = st.radio(
+            f"{len(df):,} listeners; render as",
+            ["Density", "Sample"],
+            horizontal=True,
+            help="Density bins listeners per segment; Sample draws a stratified sample that keeps the outliers.",
+        )
+
+    if rendering == "Density":
+        points = density_points(data_version())
+        fig = px.scatter(
+            points,
+            x="total_minutes",
+            y="avg_completion",
+            color="segment",
+            size="listeners",
+            category_orders=segment_order,
+            title=f"{title} (listener density)",
+            hover_data={"listeners": True, "sessions": ":.1f"},
+        )
+    elif rendering == "Sample":
+        points = sampled_points(data_version())
+        fig = px.scatter(
+            points,
+            x="total_minutes",
+            y="avg_completion",
+            color="segment",
+            size="sessions",
+            category_orders=segment_order,
+            title=f"{title} (sample of {len(points):,} listeners)",
+            hover_data=["listener_id", "sessions"],
+        )
+    else:
+        fig = px.scatter(
+            df,
+            x="total_minutes",
+            y="avg_completion",
+            color="segment",
+            size="sessions",
+            category_orders=segment_order,
+            title=title,
+            hover_data=["listener_id", "sessions"],
+        )
+    fig.add_vline(
+        x=overall_minutes,
+        line_dash="dash",
+        line_color="gray",
+        annotation_text="Avg minutes",
+        annotation_position="top left",
+    )
+    fig.add_hline(
+        y=overall_completion,
+        line_dash="dash",
+        line_color="gray",
+        annotation_text="Avg completion",
+        annotation_position="top right",
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+
+# ================= DEMOGRAPHIC INSIGHTS =================
+@page_fragment
+def demographic_insights(df):
     st.header("Demographic Insights")
-    listeners = pd.read_csv("data/listeners.csv")
-    audience_demo = df.merge(listeners, on="listener_id", how="left")
-    audience_demo = audience_demo.dropna(subset=["age_group", "country", "gender", "subscription_type"])
+    audience_demo = df.dropna(subset=["age_group", "country", "gender", "subscription_type"])
 
     if audience_demo.empty:
         st.info("No demographic data available.")
         return
 
     age_stats = (
-        audience_demo.groupby("age_group", as_index=False)
+        audience_demo.groupby("age_group", as_index=False, observed=True)
         .agg(
             listeners=("listener_id", "count"),
             avg_minutes=("total_minutes", "mean"),
@@ -212,7 +359,7 @@ def audience_page():
     )
 
     country_stats = (
-        audience_demo.groupby("country", as_index=False)
+        audience_demo.groupby("country", as_index=False, observed=True)
         .agg(
             listeners=("listener_id", "count"),
             avg_minutes=("total_minutes", "mean"),
@@ -225,7 +372,7 @@ def audience_page():
     )
 
     gender_stats = (
-        audience_demo.groupby("gender", as_index=False)
+        audience_demo.groupby("gender", as_index=False, observed=True)
         .agg(
             listeners=("listener_id", "count"),
             avg_minutes=("total_minutes", "mean"),
@@ -2,71 +2,95 @@ import pandas as pd
 import plotly.express as px
 import streamlit as st
 
-from database import run_query
+from database import submit_queries
+from fragments import page_fragment
+from filters import ROLLUP_COLUMNS, UNKNOWN, FilteredQuery, bind_queries
 
-
-def data_storytelling_page():
-    st.title("Podcast Data Storytelling")
-    st.caption("Narrative-first view: what happened, why it happened, and what we should do next.")
-
-    trend_query = """
+STORY_QUERIES = {
+    "trend": FilteredQuery(
+        """
 SELECT
-    strftime('%Y-%m', s.listen_start_time) AS month,
-    SUM(s.listen_minutes) AS listen_minutes,
-    AVG(s.completion_percent) AS avg_completion
-FROM sessions s
+    month,
+    SUM(listen_minutes) AS listen_minutes,
+    1.0 * SUM(completion_sum) / NULLIF(SUM(sessions), 0) AS avg_completion
+FROM {rollup}
+WHERE {where}
 GROUP BY month
 ORDER BY month
-"""
-
-    category_query = """
+""",
+        ROLLUP_COLUMNS,
+        rollup=True,
+    ),
+    "category": FilteredQuery(
+        """
 SELECT
-    p.category,
-    SUM(s.listen_minutes) AS minutes,
-    AVG(s.completion_percent) AS completion
-FROM sessions s
-JOIN episodes e ON s.episode_id = e.episode_id
-JOIN podcasts p ON e.podcast_id = p.podcast_id
-GROUP BY p.category
+    category,
+    SUM(listen_minutes) AS minutes,
+    1.0 * SUM(completion_sum) / NULLIF(SUM(sessions), 0) AS completion
+FROM {rollup}
+WHERE {where}
+GROUP BY category
 ORDER BY minutes DESC
-"""
-
-    country_query = """
+""",
+        ROLLUP_COLUMNS,
+        rollup=True,
+    ),
+    "country": FilteredQuery(
+        """
 SELECT
-    l.country,
-    SUM(s.listen_minutes) AS minutes,
-    AVG(s.completion_percent) AS completion
-FROM sessions s
-JOIN listeners l ON s.listener_id = l.listener_id
-GROUP BY l.country
+    country,
+    SUM(listen_minutes) AS minutes,
+    1.0 * SUM(completion_sum) / NULLIF(SUM(sessions), 0) AS completion
+FROM {rollup}
+WHERE {where}
+GROUP BY country
 ORDER BY minutes DESC
-"""
-
-    platform_query = """
+""",
+        ROLLUP_COLUMNS,
+        rollup=True,
+    ),
+    "platform": FilteredQuery(
+        """
 SELECT
-    s.platform,
-    SUM(s.listen_minutes) AS minutes,
-    AVG(s.completion_percent) AS completion
-FROM sessions s
-GROUP BY s.platform
+    platform,
+    SUM(listen_minutes) AS minutes,
+    1.0 * SUM(completion_sum) / NULLIF(SUM(sessions), 0) AS completion
+FROM {rollup}
+WHERE {where}
+GROUP BY platform
 ORDER BY minutes DESC
-"""
-
-    revenue_query = """
+""",
+        ROLLUP_COLUMNS,
+        rollup=True,
+    ),
+    "revenue": FilteredQuery(
+        """
 SELECT
-    strftime('%Y-%m', s.listen_start_time) AS month,
-    SUM(r.revenue_generated) AS revenue
-FROM revenue r
-JOIN sessions s ON r.episode_id = s.episode_id
-GROUP BY month
-ORDER BY month
-"""
+    a.method,
+    a.month,
+    SUM(a.revenue) AS revenue
+FROM revenue_attribution a
+LEFT JOIN episodes e ON a.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE {where}
+GROUP BY a.method, a.month
+ORDER BY a.method, a.month
+""",
+        {"month": "a.month", "category": f"COALESCE(p.category, '{UNKNOWN}')"},
+    ),
+}
 
-    trend = run_query(trend_query)
-    category = run_query(category_query)
-    country = run_query(country_query)
-    platform = run_query(platform_query)
-    revenue = run_query(revenue_query)
+
+def data_storytelling_page(filters):
+    st.title("Podcast Data Storytelling")
+    st.caption("Narrative-first view: what happened, why it happened, and what we should do next.")
+    if filters.active:
+        st.caption(f"Filtered to {filters.describe()}. Revenue follows the date and category filters only.")
+
+    # All queries start at once; the KPIs wait only for the trend.
+    results = submit_queries(bind_queries(STORY_QUERIES, filters))
+    with st.spinner("Loading the listening trend..."):
+        trend = results["trend"]
 
     if trend.empty:
         st.warning("No storytelling data available yet.")
@@ -88,18 +112,23 @@ ORDER BY month
     total_minutes = int(trend["listen_minutes"].sum())
     latest_completion = float(trend.iloc[-1]["avg_completion"])
 
-    top_category = category.iloc[0] if not category.empty else None
-    weak_category = category.iloc[-1] if not category.empty else None
-    top_country = country.iloc[0] if not country.empty else None
-    weak_country = country.iloc[-1] if not country.empty else None
-    weak_platform = platform.sort_values("completion").iloc[0] if not platform.empty else None
-
     k1, k2, k3, k4 = st.columns(4)
     k1.metric("Total Listen Minutes", f"{total_minutes:,}")
     k2.metric("Peak Month", peak_month)
     k3.metric("Peak Volume", f"{peak_minutes:,}")
     k4.metric("Latest Avg Completion", f"{latest_completion:.1f}%")
 
+    with st.spinner("Loading story drivers..."):
+        category = results["category"]
+        country = results["country"]
+        platform = results["platform"]
+
+    top_category = category.iloc[0] if not category.empty else None
+    weak_category = category.iloc[-1] if not category.empty else None
+    top_country = country.iloc[0] if not country.empty else None
+    weak_country = country.iloc[-1] if not country.empty else None
+    weak_platform = platform.sort_values("completion").iloc[0] if not platform.empty else None
+
     st.subheader("Story Timeline")
     timeline = px.line(
         trend,
@@ -227,10 +256,25 @@ ORDER BY month
 
     st.dataframe(pd.DataFrame(actions), use_container_width=True, hide_index=True)
 
+    revenue_context(results)
+
+
+# The attribution switch reruns this section only.
+@page_fragment
+def revenue_context(results):
     st.subheader("Revenue Context")
+    with st.spinner("Loading revenue..."):
+        revenue = results["revenue"]
     if revenue.empty:
         st.info("No revenue trend available.")
     else:
+        attribution = st.radio(
+            "Attribute episode revenue by",
+            ["listening", "publish"],
+            format_func=lambda method: "Listening minutes" if method == "listening" else "Publish month",
+            horizontal=True,
+        )
+        revenue = revenue[revenue["method"] == attribution].copy()
         revenue["revenue"] = revenue["revenue"].fillna(0)
         revenue_fig = px.area(
             revenue,
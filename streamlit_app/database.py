@@ -1,8 +1,290 @@
+import contextvars
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
 from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
 import pandas as pd
 
-engine=create_engine("sqlite:///database/podcast.db")
+from query_log import QueryLog, format_plan
+
+DB_PATH = os.environ.get("PODCAST_BI_DB", "database/podcast.db")
+
+# Dashboard connections only ever read. Each one is opened read-only and tuned
+# for analytic scans; the database is in WAL mode (set by setup_database.py),
+# so readers keep querying their snapshot while an ingest run writes.
+READ_POOL_SIZE = int(os.environ.get("PODCAST_BI_READ_POOL", "8"))
+READ_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -32768",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+def connect_readonly():
+    uri = f"file:{quote(os.path.abspath(DB_PATH))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    for pragma in READ_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# Pooled so the page cache and mmap of a connection stay warm across reruns
+# instead of being rebuilt for every query.
+engine=create_engine(
+    "sqlite://",
+    creator=connect_readonly,
+    poolclass=QueuePool,
+    pool_size=READ_POOL_SIZE,
+    max_overflow=READ_POOL_SIZE,
+)
+
+# Memory budget for cached query results, in megabytes.
+CACHE_BUDGET_MB = float(os.environ.get("PODCAST_BI_CACHE_MB", "64"))
+
+_STRING_OR_SPACE = re.compile(r"('(?:[^']|'')*')|\s+")
+
+
+def normalize_sql(query):
+    # Collapse whitespace outside string literals so formatting differences
+    # share one cache entry, without conflating different literal values.
+    normalized = _STRING_OR_SPACE.sub(lambda m: m.group(1) or " ", query)
+    return normalized.strip().rstrip(";").strip()
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def _params_key(params):
+    if params is None:
+        return ()
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    return tuple(params)
+
+
+class QueryCache:
+    """LRU cache of query results bounded by their in-memory size."""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, frame, size):
+        if size > self.budget_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (frame, size)
+            self._bytes += size
+            while self._bytes > self.budget_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget_bytes,
+            }
+
+
+_cache = QueryCache(int(CACHE_BUDGET_MB * 1024 * 1024))
+query_log = QueryLog()
+
+
+def data_version():
+    # Bumped by setup_database.py on every load; part of every cache key so a
+    # refresh invalidates all cached results at once.
+    try:
+        version = pd.read_sql("SELECT value FROM warehouse_meta WHERE key = 'data_version'", engine)
+    except Exception:
+        return 0
+    return int(version.value.iloc[0]) if not version.empty else 0
+
+
+def explain(query, params=None):
+    plan = pd.read_sql(f"EXPLAIN QUERY PLAN {query}", engine, params=params)
+    return format_plan(plan.itertuples(index=False))
+
+
+def _read(query, params):
+    started = time.perf_counter()
+    frame = pd.read_sql(query, engine, params=params)
+    return frame, time.perf_counter() - started
+
+
+def _log(query, params, frame, size, seconds, cache):
+    plan = None
+    if query_log.is_slow(seconds):
+        try:
+            plan = explain(query, params)
+        except Exception as exc:
+            plan = f"EXPLAIN QUERY PLAN failed: {exc}"
+    query_log.record(normalize_sql(query), seconds, len(frame), size, cache, params=params, plan=plan)
+
+
+def run_query(query, params=None, use_cache=True):
+    if not use_cache:
+        frame, seconds = _read(query, params)
+        _log(query, params, frame, frame_bytes(frame), seconds, "bypass")
+        return frame
+
+    started = time.perf_counter()
+    key = (data_version(), normalize_sql(query), _params_key(params))
+    entry = _cache.get(key)
+    if entry is None:
+        frame, _ = _read(query, params)
+        size = frame_bytes(frame)
+        _cache.put(key, frame, size)
+        cache = "miss"
+    else:
+        frame, size = entry
+        cache = "hit"
+    # Pages add derived columns in place; keep the cached copy pristine.
+    result = frame.copy()
+    _log(query, params, result, size, time.perf_counter() - started, cache)
+    return result
+
+
+# Sessions are stored in monthly partitions behind the "sessions" view (see
+# warehouse/partitions.py). A date-bounded query can name just the partitions
+# its range overlaps instead of the view over all of them.
+PARTITIONS_QUERY = "SELECT month, table_name FROM session_partitions ORDER BY month"
+
+
+def session_partitions():
+    try:
+        return run_query(PARTITIONS_QUERY)
+    except Exception:
+        # Databases written before partitioning have a plain sessions table.
+        return None
+
+
+def sessions_source(start_day=None, end_day=None):
+    """FROM-clause source for the sessions listened in [start_day, end_day).
+
+    Both bounds are ISO dates and either may be None. Returns the view when
+    the range is unbounded or the database is unpartitioned, the partition
+    table itself when one month is needed, and otherwise a UNION ALL of only
+    the overlapping partitions.
+    """
+    catalog = session_partitions() if start_day or end_day else None
+    if catalog is None:
+        return "sessions"
+    needed = catalog
+    if start_day:
+        needed = needed[needed.month >= start_day[:7]]
+    if end_day:
+        needed = needed[needed.month + "-01" < end_day]
+    tables = needed.table_name.tolist()
+    if not tables:
+        return "(SELECT * FROM sessions LIMIT 0)"
+    if len(tables) == 1:
+        return tables[0]
+    return "(" + " UNION ALL ".join(f"SELECT * FROM {table}" for table in tables) + ")"
+
+
+# Independent page queries run side by side on separate pooled connections;
+# sqlite3 releases the GIL while a statement executes.
+QUERY_WORKERS = int(os.environ.get("PODCAST_BI_QUERY_WORKERS", "4"))
+_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="podcast-query")
+
+
+def _query_call(spec):
+    if isinstance(spec, str):
+        return spec, None
+    return spec
+
+
+class PendingResults(Mapping):
+    """{name: DataFrame} for queries that may still be running.
+
+    Reading a name waits for that query alone, so a page can draw each
+    section as soon as its own results arrive while the rest keep running.
+    """
+
+    def __init__(self, futures):
+        self._futures = futures
+
+    def __getitem__(self, name):
+        return self._futures[name].result()
+
+    def __contains__(self, name):
+        return name in self._futures
+
+    def __iter__(self):
+        return iter(self._futures)
+
+    def __len__(self):
+        return len(self._futures)
+
+
+def submit_queries(queries):
+    """Start a dict of named queries concurrently and return them as PendingResults.
+
+    Each value is either a SQL string or a (sql, params) tuple.
+    """
+    # Each worker runs in a copy of the caller's context so its queries are
+    # logged against the calling page.
+    futures = {
+        name: _executor.submit(contextvars.copy_context().run, run_query, *_query_call(spec))
+        for name, spec in queries.items()
+    }
+    return PendingResults(futures)
+
+
+def run_queries(queries):
+    """Run a dict of named queries concurrently and return {name: DataFrame}.
+
+    Page latency approaches that of the slowest query rather than the sum of
+    all of them.
+    """
+    return dict(submit_queries(queries))
+
+
+def cache_stats():
+    return _cache.stats()
 
-def run_query(query):
 
-    return pd.read_sql(query,engine)
+def clear_cache():
+    _cache.clear()
@@ -1,37 +1,314 @@
 import streamlit as st
 import plotly.express as px
+import pandas as pd
 
-from database import run_query
+from database import run_queries, run_query, submit_queries
+from fragments import page_fragment
+from filters import OPTION_QUERIES, ROLLUP_COLUMNS, UNKNOWN, FilteredQuery, bind_queries
+from grouping_sets import (
+    EXECUTIVE_BREAKDOWNS_SQL,
+    EXECUTIVE_GROUPING_SETS,
+    EXECUTIVE_SUMMARY_SETS,
+    EXECUTIVE_SUMMARY_SQL,
+    split_grouping_sets,
+)
+from leaderboards import METRIC_LABELS, leaderboard_slice, read_leaderboard
+from reach import (
+    DISTINCT_MODE,
+    EPISODE_REACH_SQL,
+    ReachQuery,
+    build_reach_sql,
+    episode_reach,
+    relative_error,
+    sketch_precision,
+    split_reach,
+)
 
+# Filterable columns of the session grain, matched to the rollups' labels.
+GRAIN_COLUMNS = {
+    "day": "s.listen_start_time",
+    "category": f"COALESCE(p.category, '{UNKNOWN}')",
+    "country": f"COALESCE(l.country, '{UNKNOWN}')",
+    "platform": f"COALESCE(s.platform, '{UNKNOWN}')",
+    "subscription_type": f"COALESCE(l.subscription_type, '{UNKNOWN}')",
+}
+# Listener queries filter on signup date; listeners have no platform or category.
+LISTENER_COLUMNS = {"day": "signup_date", "country": "country", "subscription_type": "subscription_type"}
+# Revenue is attributed to listening months and episodes, so it follows the
+# date and category filters only.
+REVENUE_COLUMNS = {"month": "a.month", "category": f"COALESCE(p.category, '{UNKNOWN}')"}
 
-def executive_page():
-    st.title("Podcast Executive Command Center")
+# Exact counts: all breakdowns of sessions joined to listeners (KPIs, country,
+# platform, category and episode premium reach) come from one grouping-sets
+# pass over the session grain.
+EXACT_QUERIES = {
+    "breakdowns": FilteredQuery(EXECUTIVE_BREAKDOWNS_SQL, GRAIN_COLUMNS, sessions=True),
+}
+# The same without the top episodes, when a leaderboard answers the filters.
+EXACT_SUMMARY_QUERIES = {
+    "breakdowns": FilteredQuery(EXECUTIVE_SUMMARY_SQL, GRAIN_COLUMNS, sessions=True),
+}
 
-    # ================= KPI SECTION =================
-    kpi_query = """
+# Breakdowns whose listener reach comes from the sketches in one pass.
+REACH_DIMENSIONS = ("platform", "category")
+
+# Estimated counts: listener reach merged from the HyperLogLog sketches and
+# the additive measures from the rollups. The reach queries themselves depend
+# on the dimension values, see approximate_queries.
+APPROX_QUERIES = {
+    "episode_reach": ReachQuery(EPISODE_REACH_SQL, ("episode_id", "subscription_type")),
+    "totals": FilteredQuery(
+        """
+SELECT
+    SUM(listen_minutes) AS total_minutes,
+    1.0 * SUM(completion_sum) / NULLIF(SUM(sessions), 0) AS avg_completion,
+    SUM(CASE WHEN subscription_type = 'premium' THEN sessions ELSE 0 END) AS premium_sessions,
+    SUM(sessions) AS total_sessions
+FROM {rollup}
+WHERE {where}
+""",
+        ROLLUP_COLUMNS,
+        rollup=True,
+    ),
+    "geo": FilteredQuery(
+        """
+SELECT
+    country,
+    SUM(listen_minutes) AS minutes
+FROM {rollup}
+WHERE {where}
+GROUP BY country
+ORDER BY minutes DESC
+""",
+        ROLLUP_COLUMNS,
+        rollup=True,
+    ),
+}
+
+# Titles and minutes of the episodes the sketches rank highest: keyed
+# lookups on each partition's episode index rather than a pass over every
+# session. The ids are a literal list; SQLite only pushes a literal IN list,
+# not a subquery, down into the partitions of the sessions view.
+EPISODE_MINUTES_SQL = """
 SELECT
-    COUNT(DISTINCT s.listener_id) AS active_listeners,
-    SUM(s.listen_minutes) AS total_minutes,
-    AVG(s.completion_percent) AS avg_completion,
-    SUM(CASE WHEN l.subscription_type = 'premium' THEN 1 ELSE 0 END) AS premium_sessions,
-    COUNT(*) AS total_sessions
-FROM sessions s
+    s.episode_id,
+    e.episode_title,
+    p.category,
+    SUM(s.listen_minutes) AS listen_minutes
+FROM {sessions} s
 JOIN listeners l ON s.listener_id = l.listener_id
+LEFT JOIN episodes e ON s.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE s.episode_id IN ({episode_ids}) AND {where}
+GROUP BY s.episode_id
 """
+EPISODE_BREAKDOWN_COLUMNS = ["episode_id", "episode_title", "category", "premium_listeners", "listen_minutes"]
+
+LEADERBOARD_ENTITIES = {"Episodes": ("episode", "episode_title"), "Podcasts": ("podcast", "podcast_name")}
 
-    kpis = run_query(kpi_query)
-    active_listeners = int(kpis.active_listeners.iloc[0] or 0)
-    total_minutes = int(kpis.total_minutes.iloc[0] or 0)
-    avg_completion = float(kpis.avg_completion.iloc[0] or 0)
-    premium_sessions = int(kpis.premium_sessions.iloc[0] or 0)
-    total_sessions = int(kpis.total_sessions.iloc[0] or 0)
+# Queries both modes need; each batch runs in parallel.
+EXECUTIVE_QUERIES = {
+    "revenue": FilteredQuery(
+        """
+SELECT SUM(a.revenue) AS revenue
+FROM revenue_attribution a
+LEFT JOIN episodes e ON a.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE a.method = 'listening' AND {where}
+""",
+        REVENUE_COLUMNS,
+    ),
+    "trend": FilteredQuery(
+        """
+SELECT
+    month,
+    SUM(listen_minutes) AS minutes
+FROM {rollup}
+WHERE {where}
+GROUP BY month
+ORDER BY month
+""",
+        ROLLUP_COLUMNS,
+        rollup=True,
+    ),
+    "cat": FilteredQuery(
+        """
+SELECT
+    category,
+    SUM(listen_minutes) AS minutes
+FROM {rollup}
+WHERE {where}
+GROUP BY category
+ORDER BY minutes DESC
+""",
+        ROLLUP_COLUMNS,
+        rollup=True,
+    ),
+    "sub_mix": FilteredQuery(
+        """
+SELECT
+    subscription_type,
+    COUNT(*) AS listeners
+FROM listeners
+WHERE {where}
+GROUP BY subscription_type
+ORDER BY listeners DESC
+""",
+        LISTENER_COLUMNS,
+    ),
+    "sub_trend": FilteredQuery(
+        """
+SELECT
+    strftime('%Y-%m', signup_date) AS month,
+    subscription_type,
+    COUNT(*) AS signups
+FROM listeners
+WHERE {where}
+GROUP BY month, subscription_type
+ORDER BY month, subscription_type
+""",
+        LISTENER_COLUMNS,
+    ),
+    "sub_country": FilteredQuery(
+        """
+SELECT
+    l.country,
+    COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN l.listener_id END) AS premium_listeners,
+    COUNT(DISTINCT l.listener_id) AS total_listeners,
+    ROUND(
+        100.0 * COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN l.listener_id END)
+        / NULLIF(COUNT(DISTINCT l.listener_id), 0),
+        2
+    ) AS premium_penetration_pct
+FROM listeners l
+WHERE {where}
+GROUP BY l.country
+ORDER BY premium_penetration_pct DESC
+""",
+        {"day": "l.signup_date", "country": "l.country", "subscription_type": "l.subscription_type"},
+    ),
+}
+
+
+def reach_dimensions():
+    options = run_queries({dimension: OPTION_QUERIES[dimension] for dimension in REACH_DIMENSIONS})
+    return {dimension: options[dimension].value.tolist() for dimension in REACH_DIMENSIONS}
+
+
+def approximate_queries(dimensions):
+    # The total and each breakdown are separate queries, so each reads the
+    # coarsest sketch grain with its own column, and they run side by side.
+    queries = dict(APPROX_QUERIES, reach=ReachQuery(build_reach_sql({}), ("subscription_type",)))
+    for dimension, values in dimensions.items():
+        queries[f"reach_{dimension}"] = ReachQuery(
+            build_reach_sql({dimension: values}), ("subscription_type", dimension)
+        )
+    return queries
+
+
+def _top_episodes(results, filters, precision):
+    reach = episode_reach(results["episode_reach"], precision)
+    reach = reach.sort_values("premium_listeners", ascending=False)
+    if reach.empty:
+        return pd.DataFrame(columns=EPISODE_BREAKDOWN_COLUMNS)
+    # Everything tied with the tenth episode, so minutes can break the tie.
+    cutoff = reach.premium_listeners.iloc[min(len(reach), 10) - 1]
+    candidates = reach[reach.premium_listeners >= cutoff]
+
+    names = [f"episode_{position}" for position in range(len(candidates))]
+    sql = EPISODE_MINUTES_SQL.format(
+        episode_ids=", ".join(f":{name}" for name in names), sessions="{sessions}", where="{where}"
+    )
+    sql, params = FilteredQuery(sql, GRAIN_COLUMNS, sessions=True).bind(filters)
+    params = dict(params or {}, **dict(zip(names, candidates.episode_id.tolist())))
+    episodes = run_query(sql, params=params).merge(candidates, on="episode_id")
+    episodes = episodes[EPISODE_BREAKDOWN_COLUMNS]
+    return episodes.sort_values(["premium_listeners", "listen_minutes"], ascending=False).head(10).reset_index(drop=True)
+
+
+def leaderboard_episodes(filters):
+    """Top episodes by premium listeners from the leaderboards, or None if none answers the filters."""
+    board = leaderboard_slice(filters)
+    if board is None:
+        return None
+    episodes = read_leaderboard("episode", "premium_listeners", board)
+    if episodes is None:
+        return None
+    return episodes.rename(columns={"value": "premium_listeners"})[EPISODE_BREAKDOWN_COLUMNS].astype(
+        {"premium_listeners": int}
+    )
+
+
+def approximate_breakdowns(results, dimensions, precision):
+    """The grouping-sets breakdowns, with listener counts from the sketches."""
+    total = split_reach(results["reach"], {}, precision)["total"]
+
+    kpis = results["totals"].copy()
+    kpis.insert(0, "active_listeners", total.all_listeners.to_numpy())
+
+    breakdowns = {"kpis": kpis, "geo": results["geo"]}
+    for dimension, sort_by in (("platform", "premium_share_pct"), ("category", "premium_listeners")):
+        reach = split_reach(results[f"reach_{dimension}"], {dimension: dimensions[dimension]}, precision)
+        part = reach[dimension][[dimension, "premium_listeners", "all_listeners"]].copy()
+        part["premium_share_pct"] = (100.0 * part.premium_listeners / part.all_listeners).round(2)
+        breakdowns[dimension] = part.sort_values(sort_by, ascending=False).reset_index(drop=True)
+    # The top episodes need a follow-up query; business_questions ranks them.
+    return breakdowns
+
+
+def executive_page(filters):
+    st.title("Podcast Executive Command Center")
+    if filters.active:
+        st.caption(f"Filtered to {filters.describe()}. Revenue follows the date and category filters only.")
+
+    # Sketches are missing until the first ingest that builds them.
+    precision = sketch_precision()
+    exact = True
+    if precision is not None:
+        exact = st.toggle(
+            "Exact listener counts",
+            value=DISTINCT_MODE == "exact",
+            help=(
+                f"Off: listener counts are HyperLogLog estimates (about ±{relative_error(precision):.1%}) "
+                "merged from pre-built sketches. On: counted exactly from sessions, which is slower."
+            ),
+        )
+
+    # Exact top episodes come from the leaderboards when one answers the
+    # filters, so the queries below only rank episodes otherwise.
+    top_episodes = leaderboard_episodes(filters)
+    # Every query starts here and each section waits only for the results it
+    # draws, so the KPIs paint while the heavier sections are still loading.
+    if exact:
+        grouping_sets = EXECUTIVE_GROUPING_SETS if top_episodes is None else EXECUTIVE_SUMMARY_SETS
+        exact_queries = EXACT_QUERIES if top_episodes is None else EXACT_SUMMARY_QUERIES
+        results = submit_queries(bind_queries(dict(EXECUTIVE_QUERIES, **exact_queries), filters))
+    else:
+        dimensions = reach_dimensions()
+        queries = approximate_queries(dimensions)
+        if top_episodes is not None:
+            del queries["episode_reach"]
+        results = submit_queries(bind_queries(dict(EXECUTIVE_QUERIES, **queries), filters))
+
+    # ================= KPI SECTION =================
+    with st.spinner("Loading KPIs..."):
+        if exact:
+            breakdowns = split_grouping_sets(results["breakdowns"], grouping_sets)
+        else:
+            breakdowns = approximate_breakdowns(results, dimensions, precision)
+        revenue = results["revenue"]
+    if top_episodes is not None:
+        breakdowns["episodes"] = top_episodes
+
+    # Sums over no sessions are NULL.
+    kpis = breakdowns["kpis"].fillna(0)
+    active_listeners = int(kpis.active_listeners.iloc[0])
+    total_minutes = int(kpis.total_minutes.iloc[0])
+    avg_completion = float(kpis.avg_completion.iloc[0])
+    premium_sessions = int(kpis.premium_sessions.iloc[0])
+    total_sessions = int(kpis.total_sessions.iloc[0])
     premium_session_share = (premium_sessions / total_sessions * 100) if total_sessions else 0.0
 
-    revenue_query = """
-SELECT SUM(revenue_generated) AS revenue
-FROM revenue
-"""
-    revenue = run_query(revenue_query)
     total_revenue = float(revenue.revenue.iloc[0] or 0)
 
     k1, k2, k3, k4, k5 = st.columns(5)
@@ -42,17 +319,21 @@ FROM revenue
     k5.metric("Total Revenue", f"{total_revenue:,.0f}")
 
     st.divider()
+    core_performance(results, breakdowns)
+    st.divider()
+    subscription_analysis(results, breakdowns)
+    st.divider()
+    business_questions(results, breakdowns, filters, precision)
+    leaderboards_section(filters)
 
-    # ================= CORE PERFORMANCE =================
-    trend_query = """
-SELECT
-    strftime('%Y-%m', listen_start_time) AS month,
-    SUM(listen_minutes) AS minutes
-FROM sessions
-GROUP BY month
-ORDER BY month
-"""
-    trend = run_query(trend_query)
+
+# ================= CORE PERFORMANCE =================
+@page_fragment
+def core_performance(results, breakdowns):
+    with st.spinner("Loading listening trends..."):
+        trend = results["trend"]
+        cat = results["cat"]
+    geo = breakdowns["geo"]
 
     if trend.empty:
         st.warning("No listening trend data available.")
@@ -63,29 +344,6 @@ ORDER BY month
         use_container_width=True,
     )
 
-    cat_query = """
-SELECT
-    p.category,
-    SUM(s.listen_minutes) AS minutes
-FROM sessions s
-JOIN episodes e ON s.episode_id = e.episode_id
-JOIN podcasts p ON e.podcast_id = p.podcast_id
-GROUP BY p.category
-ORDER BY minutes DESC
-"""
-    cat = run_query(cat_query)
-
-    geo_query = """
-SELECT
-    l.country,
-    SUM(s.listen_minutes) AS minutes
-FROM sessions s
-JOIN listeners l ON s.listener_id = l.listener_id
-GROUP BY l.country
-ORDER BY minutes DESC
-"""
-    geo = run_query(geo_query)
-
     left, right = st.columns(2)
     with left:
         st.subheader("Category Engagement")
@@ -101,64 +359,17 @@ ORDER BY minutes DESC
         else:
             st.plotly_chart(px.bar(geo, x="country", y="minutes"), use_container_width=True)
 
-    st.divider()
 
-    # ================= SUBSCRIPTION ANALYSIS =================
+# ================= SUBSCRIPTION ANALYSIS =================
+@page_fragment
+def subscription_analysis(results, breakdowns):
     st.header("Subscription Analysis")
 
-    sub_mix_query = """
-SELECT
-    subscription_type,
-    COUNT(*) AS listeners
-FROM listeners
-GROUP BY subscription_type
-ORDER BY listeners DESC
-"""
-    sub_mix = run_query(sub_mix_query)
-
-    sub_trend_query = """
-SELECT
-    strftime('%Y-%m', signup_date) AS month,
-    subscription_type,
-    COUNT(*) AS signups
-FROM listeners
-GROUP BY month, subscription_type
-ORDER BY month, subscription_type
-"""
-    sub_trend = run_query(sub_trend_query)
-
-    sub_country_query = """
-SELECT
-    l.country,
-    COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN l.listener_id END) AS premium_listeners,
-    COUNT(DISTINCT l.listener_id) AS total_listeners,
-    ROUND(
-        100.0 * COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN l.listener_id END)
-        / NULLIF(COUNT(DISTINCT l.listener_id), 0),
-        2
-    ) AS premium_penetration_pct
-FROM listeners l
-GROUP BY l.country
-ORDER BY premium_penetration_pct DESC
-"""
-    sub_country = run_query(sub_country_query)
-
-    sub_platform_query = """
-SELECT
-    s.platform,
-    COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN s.listener_id END) AS premium_listeners,
-    COUNT(DISTINCT s.listener_id) AS all_listeners,
-    ROUND(
-        100.0 * COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN s.listener_id END)
-        / NULLIF(COUNT(DISTINCT s.listener_id), 0),
-        2
-    ) AS premium_share_pct
-FROM sessions s
-JOIN listeners l ON s.listener_id = l.listener_id
-GROUP BY s.platform
-ORDER BY premium_share_pct DESC
-"""
-    sub_platform = run_query(sub_platform_query)
+    with st.spinner("Loading subscription analysis..."):
+        sub_mix = results["sub_mix"]
+        sub_trend = results["sub_trend"]
+        sub_country = results["sub_country"]
+    sub_platform = breakdowns["platform"]
 
     c1, c2 = st.columns(2)
     with c1:
@@ -203,45 +414,18 @@ ORDER BY premium_share_pct DESC
         )
         st.dataframe(sub_platform, use_container_width=True, hide_index=True)
 
-    st.divider()
 
-    # ================= BUSINESS QUESTIONS =================
+# ================= BUSINESS QUESTIONS =================
+@page_fragment
+def business_questions(results, breakdowns, filters, precision):
     st.header("Executive Business Questions")
 
-    category_sub_query = """
-SELECT
-    p.category,
-    COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN s.listener_id END) AS premium_listeners,
-    COUNT(DISTINCT s.listener_id) AS all_listeners,
-    ROUND(
-        100.0 * COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN s.listener_id END)
-        / NULLIF(COUNT(DISTINCT s.listener_id), 0),
-        2
-    ) AS premium_share_pct
-FROM sessions s
-JOIN listeners l ON s.listener_id = l.listener_id
-JOIN episodes e ON s.episode_id = e.episode_id
-JOIN podcasts p ON e.podcast_id = p.podcast_id
-GROUP BY p.category
-ORDER BY premium_listeners DESC
-"""
-    category_sub = run_query(category_sub_query)
-
-    episode_sub_query = """
-SELECT
-    e.episode_title,
-    p.category,
-    COUNT(DISTINCT CASE WHEN l.subscription_type = 'premium' THEN s.listener_id END) AS premium_listeners,
-    SUM(s.listen_minutes) AS listen_minutes
-FROM sessions s
-JOIN listeners l ON s.listener_id = l.listener_id
-JOIN episodes e ON s.episode_id = e.episode_id
-JOIN podcasts p ON e.podcast_id = p.podcast_id
-GROUP BY e.episode_id, e.episode_title, p.category
-ORDER BY premium_listeners DESC, listen_minutes DESC
-LIMIT 10
-"""
-    episode_sub = run_query(episode_sub_query)
+    category_sub = breakdowns["category"]
+    episode_sub = breakdowns.get("episodes")
+    if episode_sub is None:
+        with st.spinner("Ranking episodes..."):
+            episode_sub = _top_episodes(results, filters, precision)
+    episode_sub = episode_sub.drop(columns="episode_id")
 
     if not category_sub.empty:
         top_category = category_sub.iloc[0]
@@ -275,3 +459,34 @@ LIMIT 10
         st.dataframe(episode_sub, use_container_width=True, hide_index=True)
     else:
         st.info("No episode subscription data available.")
+
+
+# ================= LEADERBOARDS =================
+@page_fragment
+def leaderboards_section(filters):
+    st.header("Leaderboards")
+    board = leaderboard_slice(filters)
+    if board is None:
+        st.info(
+            "Leaderboards cover all time or one calendar month, for all categories or one, "
+            "without country, platform or subscription filters."
+        )
+        return
+
+    left, right = st.columns(2)
+    entity_label = left.radio("Rank", list(LEADERBOARD_ENTITIES), horizontal=True)
+    metric = right.selectbox("By", list(METRIC_LABELS), format_func=METRIC_LABELS.get)
+    entity, name_column = LEADERBOARD_ENTITIES[entity_label]
+    leaders = read_leaderboard(entity, metric, board)
+    if leaders is None or leaders.empty:
+        st.info("No leaderboard data available; run setup_database.py to build it.")
+        return
+    # Values are stored as REAL; counts read better as integers.
+    leaders["value"] = leaders.value.round(2) if metric in ("revenue", "completion") else leaders.value.astype(int)
+    leaders = leaders.rename(columns={"value": METRIC_LABELS[metric]})
+    st.plotly_chart(
+        px.bar(leaders, x=METRIC_LABELS[metric], y=name_column, orientation="h", color="category")
+        .update_yaxes(categoryorder="total ascending"),
+        use_container_width=True,
+    )
+    st.dataframe(leaders.drop(columns=f"{entity}_id"), use_container_width=True, hide_index=True)
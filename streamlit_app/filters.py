@@ -0,0 +1,197 @@
+"""Global dashboard filters, bound into each page query as SQL parameters.
+
+Queries are templates with a ``{where}`` slot, plus a ``{rollup}`` slot when
+they read the listening rollups and a ``{sessions}`` slot when they read
+sessions. ``FilteredQuery.bind`` fills the slots with predicates on the
+columns that query can filter on and returns the matching named parameters,
+so the database only reads the selected slice: a date range picks only the
+session partitions it overlaps and becomes a range seek on
+``listen_start_time`` within them, or on the daily rollup's primary key.
+"""
+
+from datetime import date, timedelta
+
+import streamlit as st
+
+from database import run_queries, sessions_source
+
+UNKNOWN = "Unknown"
+DIMENSIONS = ("category", "country", "platform", "subscription_type")
+DIMENSION_LABELS = {
+    "category": "Category",
+    "country": "Country",
+    "platform": "Platform",
+    "subscription_type": "Subscription",
+}
+
+# Relative ranges end at the latest day in the warehouse, not today.
+DATE_PRESETS = {
+    "All time": None,
+    "Last 30 days": 30,
+    "Last 90 days": 90,
+    "Last 365 days": 365,
+    "Custom range": None,
+}
+
+# Column map for queries over either listening rollup.
+ROLLUP_COLUMNS = {dimension: dimension for dimension in DIMENSIONS}
+
+FILTER_KEYS = ["filter_date_preset", "filter_dates"] + [f"filter_{dimension}" for dimension in DIMENSIONS]
+
+MONTHLY_ROLLUP = "rollup_monthly_listening"
+
+# The daily rollup rolled up to months on the fly, for date-filtered reads.
+DAILY_ROLLUP = """(
+    SELECT
+        substr(day, 1, 7) AS month,
+        category,
+        country,
+        platform,
+        subscription_type,
+        sessions,
+        listen_minutes,
+        completion_sum
+    FROM rollup_daily_listening
+    WHERE {where}
+)"""
+
+OPTION_QUERIES = {
+    dimension: f"SELECT DISTINCT {dimension} AS value FROM rollup_monthly_listening ORDER BY value"
+    for dimension in DIMENSIONS
+}
+OPTION_QUERIES["bounds"] = "SELECT MIN(day) AS first_day, MAX(day) AS last_day FROM rollup_daily_listening"
+
+
+class Filters:
+    def __init__(self, start=None, end=None, **values):
+        # Both ends are inclusive dates; empty selections mean "everything".
+        self.start = start
+        self.end = end
+        self.values = {dimension: tuple(values.get(dimension) or ()) for dimension in DIMENSIONS}
+
+    @property
+    def has_dates(self):
+        return self.start is not None or self.end is not None
+
+    @property
+    def active(self):
+        return self.has_dates or any(self.values.values())
+
+    def day_bounds(self):
+        # Half-open [start, end) ISO dates, so timestamps on the last day match.
+        start = self.start.isoformat() if self.start is not None else None
+        end = (self.end + timedelta(days=1)).isoformat() if self.end is not None else None
+        return start, end
+
+    def conditions(self, columns):
+        """Predicates and named parameters for the columns a query exposes.
+
+        ``columns`` maps "day" (a date or timestamp column), "month" (a
+        YYYY-MM column) or a dimension name to the SQL expression to filter.
+        """
+        predicates = []
+        params = {}
+        start_day, end_day = self.day_bounds()
+        for key, expr in columns.items():
+            if key == "day":
+                if start_day is not None:
+                    predicates.append(f"{expr} >= :start_day")
+                    params["start_day"] = start_day
+                if end_day is not None:
+                    predicates.append(f"{expr} < :end_day")
+                    params["end_day"] = end_day
+            elif key == "month":
+                if self.start is not None:
+                    predicates.append(f"{expr} >= :start_month")
+                    params["start_month"] = self.start.isoformat()[:7]
+                if self.end is not None:
+                    predicates.append(f"{expr} <= :end_month")
+                    params["end_month"] = self.end.isoformat()[:7]
+            elif self.values[key]:
+                names = [f"{key}_{position}" for position in range(len(self.values[key]))]
+                predicates.append(f"{expr} IN ({', '.join(':' + name for name in names)})")
+                params.update(zip(names, self.values[key]))
+        return predicates, params
+
+    def describe(self):
+        parts = []
+        if self.has_dates:
+            parts.append(f"{self.start or '…'} to {self.end or '…'}")
+        for dimension, values in self.values.items():
+            if values:
+                parts.append(f"{DIMENSION_LABELS[dimension]}: {', '.join(values)}")
+        return " · ".join(parts)
+
+
+def _where(predicates):
+    return " AND ".join(predicates) or "1 = 1"
+
+
+class FilteredQuery:
+    def __init__(self, sql, columns=None, rollup=False, sessions=False):
+        self.sql = sql
+        self.columns = dict(columns or {})
+        self.rollup = rollup
+        self.sessions = sessions
+
+    def bind(self, filters):
+        predicates, params = filters.conditions(self.columns)
+        slots = {"where": _where(predicates)}
+        if self.rollup:
+            # Monthly rows cannot be cut at a day boundary, so date-filtered
+            # reads come from the daily rollup instead.
+            if filters.has_dates:
+                day_predicates, day_params = filters.conditions({"day": "day"})
+                slots["rollup"] = DAILY_ROLLUP.format(where=_where(day_predicates))
+                params.update(day_params)
+            else:
+                slots["rollup"] = MONTHLY_ROLLUP
+        if self.sessions:
+            slots["sessions"] = sessions_source(*filters.day_bounds())
+        return self.sql.format(**slots), params or None
+
+
+def bind_queries(queries, filters):
+    """{name: FilteredQuery} -> {name: (sql, params)} for run_queries."""
+    return {name: query.bind(filters) for name, query in queries.items()}
+
+
+def keep_filter_state():
+    # Streamlit drops a widget's state on runs where it is not rendered;
+    # re-assigning keeps the selections while other pages are open.
+    for key in FILTER_KEYS:
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+
+
+def filter_bar():
+    options = run_queries(OPTION_QUERIES)
+    bounds = options["bounds"]
+    if bounds.empty or bounds.first_day.iloc[0] is None:
+        return Filters()
+    first_day = date.fromisoformat(bounds.first_day.iloc[0])
+    last_day = date.fromisoformat(bounds.last_day.iloc[0])
+
+    st.sidebar.subheader("Filters")
+    preset = st.sidebar.selectbox("Date range", list(DATE_PRESETS), key="filter_date_preset")
+    start = end = None
+    if preset == "Custom range":
+        # Seeded through session state: keep_filter_state re-assigns the key,
+        # which cannot be combined with a value= default.
+        st.session_state.setdefault("filter_dates", (first_day, last_day))
+        picked = st.sidebar.date_input("Dates", min_value=first_day, max_value=last_day, key="filter_dates")
+        # While only the first date of the range is picked it is a 1-tuple.
+        start, end = (picked[0], picked[-1]) if picked else (None, None)
+    elif DATE_PRESETS[preset]:
+        end = last_day
+        start = max(first_day, last_day - timedelta(days=DATE_PRESETS[preset] - 1))
+
+    values = {
+        dimension: st.sidebar.multiselect(
+            DIMENSION_LABELS[dimension], options[dimension].value.tolist(), key=f"filter_{dimension}"
+        )
+        for dimension in DIMENSIONS
+    }
+    if preset != "All time":
+        st.sidebar.caption(f"Data runs to {last_day}.")
+    return Filters(start, end, **values)
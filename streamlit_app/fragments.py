@@ -0,0 +1,28 @@
+"""Page sections that load and rerun on their own.
+
+``page_fragment`` turns a section function into an ``st.fragment``: a
+widget inside it reruns only that section, not the page around it. Fragment
+reruns happen outside the app's ``page_context`` block, so the section
+re-enters it to keep its queries logged against the page that drew it.
+"""
+
+import functools
+
+import streamlit as st
+
+from query_log import current_page, page_context
+
+
+def page_fragment(func):
+    @functools.wraps(func)
+    def section(page, *args, **kwargs):
+        with page_context(page):
+            return func(*args, **kwargs)
+
+    fragment = st.fragment(section)
+
+    @functools.wraps(func)
+    def draw(*args, **kwargs):
+        return fragment(current_page(), *args, **kwargs)
+
+    return draw
@@ -0,0 +1,166 @@
+"""GROUPING SETS-style aggregation in a single pass over the session facts.
+
+SQLite has no GROUPING SETS, so the joined facts are first reduced to a fine
+grain in one materialized CTE. Every requested breakdown is then a GROUP BY
+over that CTE, and the breakdowns come back together as one UNION ALL. The
+sessions join is evaluated once no matter how many breakdowns a page needs.
+"""
+
+
+class GroupingSet:
+    def __init__(self, keys, columns, sort_by=None, ascending=False, limit=None):
+        self.keys = tuple(keys)
+        # Output column -> measure name; lets each breakdown keep the column
+        # names its page already uses.
+        self.columns = dict(columns)
+        self.sort_by = list(sort_by or [])
+        self.ascending = ascending
+        self.limit = limit
+
+
+# One row per episode x listener x platform: the coarsest grain that still
+# answers distinct-listener questions for every breakdown below. Within one
+# session partition the GROUP BY follows idx_sessions_episode_listener, so the
+# grain streams without a sort. {sessions} is the view or the partitions a
+# date filter routes to, and {where} the page's filter predicate (see
+# filters.FilteredQuery).
+EXECUTIVE_GRAIN_SQL = """
+SELECT
+    s.episode_id,
+    s.listener_id,
+    s.platform,
+    l.country,
+    l.subscription_type,
+    p.category,
+    e.episode_title,
+    COUNT(*) AS sessions,
+    SUM(s.listen_minutes) AS listen_minutes,
+    SUM(s.completion_percent) AS completion_sum
+FROM {sessions} s
+JOIN listeners l ON s.listener_id = l.listener_id
+LEFT JOIN episodes e ON s.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE {where}
+GROUP BY s.episode_id, s.listener_id, s.platform
+"""
+
+EXECUTIVE_MEASURES = {
+    "active_listeners": "COUNT(DISTINCT listener_id)",
+    "premium_listeners": "COUNT(DISTINCT CASE WHEN subscription_type = 'premium' THEN listener_id END)",
+    "total_sessions": "SUM(sessions)",
+    "premium_sessions": "SUM(CASE WHEN subscription_type = 'premium' THEN sessions ELSE 0 END)",
+    "total_minutes": "SUM(listen_minutes)",
+    "avg_completion": "1.0 * SUM(completion_sum) / NULLIF(SUM(sessions), 0)",
+    "premium_share_pct": (
+        "ROUND(100.0 * COUNT(DISTINCT CASE WHEN subscription_type = 'premium' THEN listener_id END)"
+        " / NULLIF(COUNT(DISTINCT listener_id), 0), 2)"
+    ),
+}
+
+# Whole-number keys and measures. Other arms pad them with NULL, so pandas
+# reads the union as floats; split_grouping_sets casts them back.
+EXECUTIVE_INTEGERS = {
+    "episode_id",
+    "active_listeners",
+    "premium_listeners",
+    "total_sessions",
+    "premium_sessions",
+    "total_minutes",
+}
+
+EXECUTIVE_GROUPING_SETS = {
+    "kpis": GroupingSet(
+        keys=(),
+        columns={
+            "active_listeners": "active_listeners",
+            "total_minutes": "total_minutes",
+            "avg_completion": "avg_completion",
+            "premium_sessions": "premium_sessions",
+            "total_sessions": "total_sessions",
+        },
+    ),
+    "geo": GroupingSet(
+        keys=("country",),
+        columns={"minutes": "total_minutes"},
+        sort_by=["minutes"],
+    ),
+    "platform": GroupingSet(
+        keys=("platform",),
+        columns={
+            "premium_listeners": "premium_listeners",
+            "all_listeners": "active_listeners",
+            "premium_share_pct": "premium_share_pct",
+        },
+        sort_by=["premium_share_pct"],
+    ),
+    "category": GroupingSet(
+        keys=("category",),
+        columns={
+            "premium_listeners": "premium_listeners",
+            "all_listeners": "active_listeners",
+            "premium_share_pct": "premium_share_pct",
+        },
+        sort_by=["premium_listeners"],
+    ),
+    "episodes": GroupingSet(
+        keys=("episode_id", "episode_title", "category"),
+        columns={"premium_listeners": "premium_listeners", "listen_minutes": "total_minutes"},
+        sort_by=["premium_listeners", "listen_minutes"],
+        limit=10,
+    ),
+}
+
+
+def build_grouping_sets_sql(grain_sql, measures, grouping_sets):
+    all_keys = []
+    for grouping_set in grouping_sets.values():
+        all_keys.extend(key for key in grouping_set.keys if key not in all_keys)
+
+    arms = []
+    for name, grouping_set in grouping_sets.items():
+        # Arms only aggregate the measures they expose; distinct counts are the
+        # expensive part and most breakdowns need at most one or two.
+        used = set(grouping_set.columns.values())
+        select_sql = ",\n    ".join(
+            [f"'{name}' AS grouping_set"]
+            + [key if key in grouping_set.keys else f"NULL AS {key}" for key in all_keys]
+            + [f"{expr if measure in used else 'NULL'} AS {measure}" for measure, expr in measures.items()]
+        )
+        group_by = f"\nGROUP BY {', '.join(grouping_set.keys)}" if grouping_set.keys else ""
+        arms.append(f"SELECT\n    {select_sql}\nFROM grain{group_by}")
+
+    union = "\nUNION ALL\n".join(arms)
+    return f"WITH grain AS MATERIALIZED (\n{grain_sql.strip()}\n)\n{union}\n"
+
+
+def split_grouping_sets(frame, grouping_sets, integers=EXECUTIVE_INTEGERS):
+    """Split the UNION ALL result into one DataFrame per grouping set.
+
+    Columns named in ``integers`` come back as nullable integers, as the
+    separate queries returned them.
+    """
+    breakdowns = {}
+    for name, grouping_set in grouping_sets.items():
+        part = frame[frame["grouping_set"] == name]
+        sources = list(grouping_set.keys) + list(grouping_set.columns.values())
+        part = part[sources]
+        part.columns = list(grouping_set.keys) + list(grouping_set.columns)
+        part = part.astype({column: "Int64" for column, source in zip(part.columns, sources) if source in integers})
+        if grouping_set.sort_by:
+            part = part.sort_values(grouping_set.sort_by, ascending=grouping_set.ascending)
+        if grouping_set.limit is not None:
+            part = part.head(grouping_set.limit)
+        breakdowns[name] = part.reset_index(drop=True)
+    return breakdowns
+
+
+EXECUTIVE_BREAKDOWNS_SQL = build_grouping_sets_sql(
+    EXECUTIVE_GRAIN_SQL, EXECUTIVE_MEASURES, EXECUTIVE_GROUPING_SETS
+)
+
+# The breakdowns without the top episodes, for when the leaderboards
+# (streamlit_app/leaderboards.py) already hold them.
+EXECUTIVE_SUMMARY_SETS = {
+    name: grouping_set for name, grouping_set in EXECUTIVE_GROUPING_SETS.items() if name != "episodes"
+}
+EXECUTIVE_SUMMARY_SQL = build_grouping_sets_sql(EXECUTIVE_GRAIN_SQL, EXECUTIVE_MEASURES, EXECUTIVE_SUMMARY_SETS)
@@ -0,0 +1,241 @@
+"""Budgeted execution for ad-hoc SQL typed into the SQL Explorer.
+
+Each query runs on its own read-only connection in a small dedicated pool,
+so a runaway statement never holds a dashboard connection or query worker.
+A progress handler enforces the wall-clock budget and lets the page cancel
+the query, an authorizer rejects anything but reads, and rows are fetched in
+batches until the row or byte cap of the whole result is hit.
+
+Results are paged: the first page is fetched when the query runs and later
+pages only when the user asks for them. The connection is closed as soon as a
+page is read, so a session that is abandoned mid-result never holds a read
+transaction (and with it the WAL snapshot) open. Later pages, and pages that
+fell out of the handful a job keeps in memory, are read by re-running the
+query and skipping ahead.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from database import connect_readonly
+
+TIMEOUT_SECONDS = float(os.environ.get("PODCAST_BI_SQL_TIMEOUT", "10"))
+MAX_ROWS = int(os.environ.get("PODCAST_BI_SQL_MAX_ROWS", "10000"))
+MAX_BYTES = int(float(os.environ.get("PODCAST_BI_SQL_MAX_MB", "32")) * 1024 * 1024)
+PAGE_ROWS = int(os.environ.get("PODCAST_BI_SQL_PAGE_ROWS", "500"))
+PAGES_IN_MEMORY = 3
+
+# SQLite VM instructions between progress-handler calls: frequent enough to
+# stop within milliseconds, rare enough to cost nothing measurable.
+PROGRESS_INTERVAL = 10_000
+
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("PODCAST_BI_SQL_WORKERS", "2")),
+    thread_name_prefix="podcast-adhoc",
+)
+
+
+class QueryRejected(Exception):
+    pass
+
+
+def _authorize(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _row_bytes(row):
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row)
+
+
+class QueryJob:
+    """One ad-hoc query running in the background, read one page at a time.
+
+    ``status`` moves from "running" to one of "done", "timeout", "cancelled"
+    or "error". Once done, ``page(n)`` returns the n-th page of rows as a
+    DataFrame (or None past the end) and ``truncated`` is set when a cap
+    stopped the stream early. The time budget applies to the initial run and
+    to each later page fetch.
+    """
+
+    def __init__(
+        self,
+        query,
+        timeout=TIMEOUT_SECONDS,
+        max_rows=MAX_ROWS,
+        max_bytes=MAX_BYTES,
+        page_rows=PAGE_ROWS,
+    ):
+        self.query = query
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.page_rows = page_rows
+        self.status = "running"
+        self.columns = []
+        self.error = None
+        self.truncated = None
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._deadline = self.started + timeout
+        self._lock = threading.Lock()
+        self._conn = None
+        self._cursor = None
+        self._rows_read = 0
+        self._bytes_read = 0
+        self._next_page = 0
+        self._last_page = None
+        self._pages = OrderedDict()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _should_stop(self):
+        return self._cancelled.is_set() or time.monotonic() > self._deadline
+
+    def _open(self):
+        self.close()
+        self._conn = connect_readonly()
+        self._conn.set_authorizer(_authorize)
+        self._conn.set_progress_handler(lambda: 1 if self._should_stop() else 0, PROGRESS_INTERVAL)
+        self._cursor = self._conn.execute(self.query)
+        if self._cursor.description is None:
+            raise QueryRejected("Only SELECT queries can be run here.")
+        self.columns = [column[0] for column in self._cursor.description]
+        self.truncated = None
+        self._rows_read = 0
+        self._bytes_read = 0
+        self._next_page = 0
+
+    def _read_page(self):
+        rows = []
+        while len(rows) < self.page_rows and not self.truncated:
+            wanted = min(self.page_rows - len(rows), self.max_rows - self._rows_read)
+            if wanted <= 0:
+                self.truncated = f"stopped at the {self.max_rows:,}-row cap"
+                break
+            batch = self._cursor.fetchmany(wanted)
+            if not batch:
+                break
+            for row in batch:
+                self._bytes_read += _row_bytes(row)
+                if self._bytes_read > self.max_bytes:
+                    self.truncated = f"stopped at the {self.max_bytes / (1024 * 1024):g} MB cap"
+                    break
+                rows.append(row)
+                self._rows_read += 1
+
+        if len(rows) < self.page_rows:
+            # Reached the end of the stream or a cap; nothing more to read.
+            self._last_page = self._next_page if rows or self._next_page == 0 else self._next_page - 1
+        elif not self.truncated:
+            # Peek one row to learn whether another page exists.
+            if not self._cursor.fetchmany(1):
+                self._last_page = self._next_page
+            elif self._rows_read >= self.max_rows:
+                self.truncated = f"stopped at the {self.max_rows:,}-row cap"
+                self._last_page = self._next_page
+        else:
+            self._last_page = self._next_page
+        self.close()
+        page = self._next_page
+        self._next_page += 1
+        if rows or page == 0:
+            self._pages[page] = pd.DataFrame.from_records(rows, columns=self.columns)
+            while len(self._pages) > PAGES_IN_MEMORY:
+                self._pages.popitem(last=False)
+
+    def _fail(self, exc):
+        if self._cancelled.is_set():
+            self.status = "cancelled"
+        elif self._should_stop():
+            self.status = "timeout"
+        elif isinstance(exc, sqlite3.DatabaseError) and "not authorized" in str(exc):
+            self.status = "error"
+            self.error = "Only read queries can be run here."
+        else:
+            self.status = "error"
+            self.error = str(exc)
+        self._pages.clear()
+        self.close()
+
+    def run(self):
+        # The budget starts when a worker picks the job up, not while it waits
+        # in the queue.
+        self.started = time.monotonic()
+        self._deadline = self.started + self.timeout
+        try:
+            with self._lock:
+                self._open()
+                self._read_page()
+            self.status = "done"
+        except Exception as exc:
+            self._fail(exc)
+        finally:
+            self.elapsed = time.monotonic() - self.started
+            self._finished.set()
+        return self
+
+    def has_page(self, number):
+        return number >= 0 and (self._last_page is None or number <= self._last_page)
+
+    def page(self, number):
+        if self.status != "done" or not self.has_page(number):
+            return None
+        with self._lock:
+            if number in self._pages:
+                self._pages.move_to_end(number)
+                return self._pages[number]
+            self._deadline = time.monotonic() + self.timeout
+            try:
+                if self._cursor is None or number < self._next_page:
+                    # The connection is closed after every page: re-run the
+                    # query and skip the rows before this one.
+                    self._open()
+                    skip = number * self.page_rows
+                    while self._rows_read < skip:
+                        batch = self._cursor.fetchmany(min(skip - self._rows_read, self.page_rows))
+                        if not batch:
+                            break
+                        self._rows_read += len(batch)
+                        self._bytes_read += sum(_row_bytes(row) for row in batch)
+                    self._next_page = number
+                while self._next_page <= number and self._cursor is not None:
+                    self._read_page()
+            except Exception as exc:
+                self._fail(exc)
+                return None
+            return self._pages.get(number)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._cursor = None
+
+
+def start_query(query, **limits):
+    """Start ``query`` in the background and return its QueryJob."""
+    job = QueryJob(query, **limits)
+    _executor.submit(job.run)
+    return job
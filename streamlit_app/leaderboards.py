@@ -0,0 +1,82 @@
+"""Top episodes and podcasts read from the ingest-time leaderboards.
+
+``leaderboards`` (warehouse/leaderboards.py) keeps the best entries per
+entity, metric, category and period, where a period is one calendar month or
+all time. When the page filters name at most one category and cover all time
+or exactly one calendar month, a top-10 view is a primary-key range read of
+ten rows instead of a ranking of every episode's sessions.
+"""
+
+from datetime import timedelta
+
+from database import run_query
+
+ALL_CATEGORIES = "All"
+ALL_TIME = "all"
+
+METRIC_LABELS = {
+    "premium_listeners": "Premium listeners",
+    "listen_minutes": "Listening minutes",
+    "revenue": "Revenue",
+    "completion": "Avg completion %",
+}
+
+LEADERBOARD_SQL = {
+    "episode": """
+SELECT
+    b.position,
+    b.entity_id AS episode_id,
+    e.episode_title,
+    p.category,
+    b.value,
+    b.listen_minutes
+FROM leaderboards b
+LEFT JOIN episodes e ON b.entity_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE b.entity = 'episode' AND b.metric = :metric AND b.category = :category AND b.period = :period
+  AND b.position <= :limit
+ORDER BY b.position
+""",
+    "podcast": """
+SELECT
+    b.position,
+    b.entity_id AS podcast_id,
+    p.podcast_name,
+    p.category,
+    b.value,
+    b.listen_minutes
+FROM leaderboards b
+LEFT JOIN podcasts p ON b.entity_id = p.podcast_id
+WHERE b.entity = 'podcast' AND b.metric = :metric AND b.category = :category AND b.period = :period
+  AND b.position <= :limit
+ORDER BY b.position
+""",
+}
+
+
+def leaderboard_slice(filters):
+    """(category, period) of the board that answers ``filters``, or None."""
+    if any(filters.values[dimension] for dimension in ("country", "platform", "subscription_type")):
+        return None
+    categories = filters.values["category"]
+    if len(categories) > 1:
+        return None
+    category = categories[0] if categories else ALL_CATEGORIES
+    if not filters.has_dates:
+        return category, ALL_TIME
+    start, end = filters.start, filters.end
+    if start is None or end is None or start.day != 1 or (end + timedelta(days=1)).day != 1:
+        return None
+    if start.strftime("%Y-%m") != end.strftime("%Y-%m"):
+        return None
+    return category, start.strftime("%Y-%m")
+
+
+def read_leaderboard(entity, metric, board, limit=10):
+    """The top ``limit`` rows of one board, or None before the first ingest builds them."""
+    category, period = board
+    params = {"metric": metric, "category": category, "period": period, "limit": limit}
+    try:
+        return run_query(LEADERBOARD_SQL[entity], params=params)
+    except Exception:
+        return None
@@ -0,0 +1,80 @@
+"""Keyset pagination over warehouse tables for the SQL Explorer preview.
+
+Pages are read in primary-key order with ``WHERE key > last key`` instead of
+OFFSET, so every page costs one index seek no matter how deep the user has
+paged. A pager remembers the boundary key of each page it has visited and
+keeps only the most recent few pages in memory.
+"""
+
+from collections import OrderedDict
+
+from database import run_query
+
+PAGES_IN_MEMORY = 3
+
+
+def key_columns(table):
+    keys = run_query(
+        "SELECT name FROM pragma_table_info(?) WHERE pk > 0 ORDER BY pk",
+        params=(table,),
+    )
+    if keys.empty:
+        # Views (the partitioned sessions) have no key of their own; the
+        # ingest-time catalog records the key of the tables behind them.
+        keys = run_query(
+            "SELECT column_name AS name FROM catalog_columns "
+            "WHERE table_name = ? AND key_type = 'primary' ORDER BY position",
+            params=(table,),
+        )
+    return list(keys.name) or ["rowid"]
+
+
+class TablePager:
+    def __init__(self, table, page_rows):
+        self.table = table
+        self.page_rows = page_rows
+        self.keys = key_columns(table)
+        # _boundaries[n] is the last key of page n - 1; page 0 starts at the top.
+        self._boundaries = [None]
+        self._last_page = None
+        self._pages = OrderedDict()
+
+    def _page_sql(self, after):
+        order_by = ", ".join(self.keys)
+        select = "*" if self.keys != ["rowid"] else "rowid, *"
+        where = ""
+        if after is not None:
+            where = f"WHERE ({order_by}) > ({', '.join('?' for _ in self.keys)}) "
+        return f"SELECT {select} FROM {self.table} {where}ORDER BY {order_by} LIMIT ?"
+
+    def _fetch(self, number):
+        after = self._boundaries[number]
+        params = (after or ()) + (self.page_rows,)
+        frame = run_query(self._page_sql(after), params=params, use_cache=False)
+        if len(frame) < self.page_rows:
+            self._last_page = number if len(frame) or number == 0 else number - 1
+        if len(frame) and len(self._boundaries) == number + 1:
+            # Series.tolist() hands back Python scalars, which sqlite3 can bind.
+            self._boundaries.append(tuple(frame[key].tail(1).tolist()[0] for key in self.keys))
+        return frame
+
+    def has_page(self, number):
+        if number < 0 or number >= len(self._boundaries):
+            # Only pages whose start key is known can be reached: one past
+            # the furthest page visited so far.
+            return False
+        return self._last_page is None or number <= self._last_page
+
+    def page(self, number):
+        if not self.has_page(number):
+            return None
+        if number in self._pages:
+            self._pages.move_to_end(number)
+            return self._pages[number]
+        frame = self._fetch(number)
+        if not len(frame) and number > 0:
+            return None
+        self._pages[number] = frame
+        while len(self._pages) > PAGES_IN_MEMORY:
+            self._pages.popitem(last=False)
+        return frame
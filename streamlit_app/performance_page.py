@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import streamlit as st
+import plotly.express as px
+
+from database import cache_stats, query_log
+from query_log import latency_percentiles
+
+
+def performance_page():
+    st.title("Performance")
+    st.caption(
+        "Queries run by the dashboards since this app process started, with result-cache status. "
+        f"Queries slower than {query_log.slow_ms:,.0f} ms keep their query plan."
+    )
+
+    entries = query_log.entries()
+    if entries.empty:
+        st.info("No queries recorded yet. Open a dashboard page and come back.")
+        return
+
+    # ===== SUMMARY =====
+    ms = entries["seconds"] * 1000
+    cache = cache_stats()
+    k1, k2, k3, k4, k5 = st.columns(5)
+    k1.metric("Queries", f"{len(entries):,}")
+    k2.metric("p50 Latency", f"{ms.quantile(0.5):,.1f} ms")
+    k3.metric("p95 Latency", f"{ms.quantile(0.95):,.1f} ms")
+    k4.metric("p99 Latency", f"{ms.quantile(0.99):,.1f} ms")
+    k5.metric("Cache Hit Rate", f"{cache['hit_rate']:.0%}")
+
+    # ===== LATENCY BY PAGE =====
+    st.subheader("Latency by Page")
+    by_page = latency_percentiles(entries, by=["page"])
+    st.plotly_chart(
+        px.bar(
+            by_page,
+            x="page",
+            y=["p50_ms", "p95_ms", "p99_ms"],
+            barmode="group",
+            labels={"value": "ms", "variable": "percentile"},
+        ),
+        use_container_width=True,
+    )
+
+    # ===== LATENCY BY QUERY =====
+    st.subheader("Latency by Query")
+    st.dataframe(
+        latency_percentiles(entries),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "sql": st.column_config.TextColumn("sql", width="large"),
+            "cache_hits": st.column_config.NumberColumn("cache hits", format="percent"),
+        },
+    )
+
+    # ===== SLOW QUERY LOG =====
+    st.subheader("Slow Query Log")
+    slow = query_log.slow_queries()
+    if not slow:
+        st.success(f"No query has taken longer than {query_log.slow_ms:,.0f} ms.")
+    for entry in slow:
+        at = datetime.fromtimestamp(entry["at"]).strftime("%Y-%m-%d %H:%M:%S")
+        label = f"{at} · {entry['page']} · {entry['seconds'] * 1000:,.0f} ms · {entry['rows']:,} rows"
+        with st.expander(label):
+            st.code(entry["sql"], language="sql")
+            if entry["params"]:
+                st.caption(f"Parameters: {entry['params']}")
+            st.text("Query plan")
+            st.code(entry["plan"] or "(not captured)", language="text")
+
+    if st.button("Clear query log"):
+        query_log.clear()
+        st.rerun()
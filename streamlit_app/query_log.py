@@ -0,0 +1,102 @@
+"""In-process record of the queries the dashboards run.
+
+``run_query`` adds one entry per call: wall time, rows, the bytes of the
+materialized frame, whether the result cache served it, and the page that
+asked for it. Queries slower than ``SLOW_QUERY_MS`` also keep their
+``EXPLAIN QUERY PLAN``. Like the result cache, the log is shared by every
+session of the app process and bounded in size; the Performance page reads it.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+LOG_SIZE = int(os.environ.get("PODCAST_BI_QUERY_LOG_SIZE", "5000"))
+SLOW_QUERY_MS = float(os.environ.get("PODCAST_BI_SLOW_QUERY_MS", "500"))
+SLOW_LOG_SIZE = 200
+
+_current_page = contextvars.ContextVar("podcast_bi_page", default=None)
+
+
+@contextmanager
+def page_context(page):
+    """Attribute the queries run inside the block to ``page``."""
+    token = _current_page.set(page)
+    try:
+        yield
+    finally:
+        _current_page.reset(token)
+
+
+def current_page():
+    return _current_page.get()
+
+
+def format_plan(plan):
+    # EXPLAIN QUERY PLAN rows are (id, parent, notused, detail); indent each
+    # step under its parent the way the sqlite3 shell does.
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in plan:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node] + detail)
+    return "\n".join(lines)
+
+
+class QueryLog:
+    def __init__(self, size=LOG_SIZE, slow_ms=SLOW_QUERY_MS, slow_size=SLOW_LOG_SIZE):
+        self.slow_ms = slow_ms
+        self._entries = deque(maxlen=size)
+        self._slow = deque(maxlen=slow_size)
+        self._lock = threading.Lock()
+
+    def is_slow(self, seconds):
+        return seconds * 1000 >= self.slow_ms
+
+    def record(self, sql, seconds, rows, size, cache, params=None, plan=None):
+        entry = {
+            "at": time.time(),
+            "page": current_page() or "other",
+            "sql": sql,
+            "seconds": seconds,
+            "rows": rows,
+            "bytes": size,
+            "cache": cache,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            if self.is_slow(seconds):
+                self._slow.append(dict(entry, params=params, plan=plan))
+
+    def entries(self):
+        with self._lock:
+            return pd.DataFrame(list(self._entries), columns=["at", "page", "sql", "seconds", "rows", "bytes", "cache"])
+
+    def slow_queries(self):
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._slow.clear()
+
+
+def latency_percentiles(entries, by=("page", "sql")):
+    """p50/p95/p99 latency, in milliseconds, per group of logged queries."""
+    if entries.empty:
+        return pd.DataFrame()
+    grouped = entries.assign(ms=entries["seconds"] * 1000).groupby(list(by))
+    summary = grouped["ms"].quantile([0.5, 0.95, 0.99]).unstack()
+    summary.columns = ["p50_ms", "p95_ms", "p99_ms"]
+    summary["max_ms"] = grouped["ms"].max()
+    summary["calls"] = grouped.size()
+    summary["cache_hits"] = grouped["cache"].apply(lambda values: (values == "hit").mean())
+    summary["avg_rows"] = grouped["rows"].mean()
+    summary["avg_bytes"] = grouped["bytes"].mean()
+    return summary.reset_index().sort_values("p95_ms", ascending=False)
@@ -0,0 +1,189 @@
+"""Distinct-listener reach estimated from the ingest-time HyperLogLog sketches.
+
+``reach_sketches`` (warehouse/sketches.py) keeps one sparse sketch per day x
+category x episode x country x platform x subscription cell, next to all-time
+grains with the same registers pre-merged. A reach query filters the cells,
+merges their registers with ``MAX(rank)`` and reduces each merged sketch to
+the two sums the HyperLogLog estimator needs, so listeners over any slice are
+counted without touching sessions or listeners. ``ReachQuery`` reads the
+coarsest grain that has every column the query and the filters use. Set
+``PODCAST_BI_DISTINCT=exact`` to default the pages to exact counts instead.
+"""
+
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from database import run_query
+from filters import DIMENSIONS, FilteredQuery
+
+DISTINCT_MODE = os.environ.get("PODCAST_BI_DISTINCT", "approx")
+
+# Sketch grains from the fewest rows to the most: table, whether it keeps
+# the day, and its cell columns. Mirrors warehouse.sketches.SKETCH_GRAINS.
+SKETCH_GRAINS = (
+    ("reach_sketches_audience", False, ("country", "subscription_type")),
+    ("reach_sketches_platform", False, ("country", "subscription_type", "platform")),
+    ("reach_sketches_category", False, ("country", "subscription_type", "category")),
+    ("reach_sketches", True, ("category", "episode_id", "country", "platform", "subscription_type")),
+)
+
+PRECISION_QUERY = "SELECT value FROM warehouse_meta WHERE key = 'sketch_precision'"
+
+# Premium reach per episode: merged registers of each episode's premium cells.
+EPISODE_REACH_SQL = """
+SELECT
+    episode_id,
+    COUNT(rank) AS registers,
+    SUM(1.0 / (1 << rank)) AS inverse_sum
+FROM (
+    SELECT episode_id, register, MAX(rank) AS rank
+    FROM {sketches}
+    WHERE subscription_type = 'premium' AND {where}
+    GROUP BY episode_id, register
+)
+GROUP BY episode_id
+"""
+
+
+def sketch_precision():
+    """Register-count exponent of the stored sketches, or None without sketches."""
+    try:
+        frame = run_query(PRECISION_QUERY)
+    except Exception:
+        return None
+    return int(frame.value.iloc[0]) if not frame.empty else None
+
+
+def relative_error(precision):
+    return 1.04 / math.sqrt(2**precision)
+
+
+class ReachQuery:
+    """A sketch query bound to the coarsest grain that answers it.
+
+    ``sql`` has ``{sketches}`` and ``{where}`` slots; ``columns`` are the
+    cell columns it reads besides the filtered ones. The coarser grains hold
+    all time, so date-filtered queries read the daily cells, whose primary
+    key starts with the day.
+    """
+
+    def __init__(self, sql, columns):
+        self.sql = sql
+        self.columns = set(columns)
+
+    def grain(self, filters):
+        needed = self.columns | {dimension for dimension, values in filters.values.items() if values}
+        for table, daily, cells in SKETCH_GRAINS:
+            if needed <= set(cells) and (daily or not filters.has_dates):
+                return table, daily, cells
+
+    def bind(self, filters):
+        table, daily, cells = self.grain(filters)
+        columns = {cell: cell for cell in cells if cell in DIMENSIONS}
+        if daily:
+            columns["day"] = "day"
+        return FilteredQuery(self.sql.format(sketches=table, where="{where}"), columns).bind(filters)
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _slices(dimensions):
+    # (column prefix, dimension, value, premium); the first two are the total.
+    slices = [("all", None, None, False), ("all_premium", None, None, True)]
+    for dimension, values in dimensions.items():
+        for position, value in enumerate(values):
+            slices.append((f"{dimension}_{position}", dimension, value, False))
+            slices.append((f"{dimension}_{position}_premium", dimension, value, True))
+    return slices
+
+
+def build_reach_sql(dimensions):
+    """Reach in total and per value of each {dimension: [values]}, in one pass.
+
+    The cells are grouped by register only, with one MAX per slice, so the
+    registers of every slice are merged in a single sort however many values
+    there are. Each slice then reduces to its non-empty register count and
+    2^-rank sum, all in one result row. Bind it with a ReachQuery on
+    ``subscription_type`` and the dimensions.
+    """
+    merged = []
+    sums = []
+    for prefix, dimension, value, premium in _slices(dimensions):
+        conditions = [f"{dimension} = {_quote(value)}"] if dimension else []
+        if premium:
+            conditions.append("subscription_type = 'premium'")
+        rank = f"CASE WHEN {' AND '.join(conditions)} THEN rank END" if conditions else "rank"
+        merged.append(f"MAX({rank}) AS {prefix}_rank")
+        sums.append(f"COUNT({prefix}_rank) AS {prefix}_registers")
+        sums.append(f"SUM(1.0 / (1 << {prefix}_rank)) AS {prefix}_inverse_sum")
+    merged_sql = ",\n        ".join(merged)
+    sums_sql = ",\n    ".join(sums)
+    return f"""
+SELECT
+    {sums_sql}
+FROM (
+    SELECT
+        register,
+        {merged_sql}
+    FROM {{sketches}}
+    WHERE {{where}}
+    GROUP BY register
+)
+"""
+
+
+def estimate(registers, inverse_sum, precision):
+    """HyperLogLog estimate from the non-zero register count and sum of 2^-rank.
+
+    Empty registers add 2^0 each to the harmonic sum. Small cardinalities,
+    where empty registers remain, use linear counting instead.
+    """
+    m = 2**precision
+    registers = np.asarray(registers, dtype=float)
+    empty = m - registers
+    harmonic = np.nan_to_num(np.asarray(inverse_sum, dtype=float)) + empty
+    raw = 0.7213 / (1 + 1.079 / m) * m * m / harmonic
+    linear = m * np.log(m / np.maximum(empty, 1))
+    return np.rint(np.where((raw <= 2.5 * m) & (empty > 0), linear, raw)).astype(int)
+
+
+def split_reach(frame, dimensions, precision):
+    """The build_reach_sql row as {"total": frame, dimension: frame}.
+
+    Frames hold all_listeners and premium_listeners; dimension frames keep
+    only the values with listeners in the filtered cells.
+    """
+    row = frame.iloc[0]
+
+    def listeners(prefix):
+        counts = estimate(
+            [row[f"{prefix}_registers"], row[f"{prefix}_premium_registers"]],
+            [row[f"{prefix}_inverse_sum"], row[f"{prefix}_premium_inverse_sum"]],
+            precision,
+        )
+        # Premium listeners are a subset; independent estimates can cross.
+        return {"all_listeners": int(counts[0]), "premium_listeners": int(min(counts))}
+
+    reach = {"total": pd.DataFrame([listeners("all")])}
+    for dimension, values in dimensions.items():
+        part = pd.DataFrame(
+            [{dimension: value, **listeners(f"{dimension}_{position}")} for position, value in enumerate(values)],
+            columns=[dimension, "all_listeners", "premium_listeners"],
+        )
+        reach[dimension] = part[part.all_listeners > 0].reset_index(drop=True)
+    return reach
+
+
+def episode_reach(frame, precision):
+    """EPISODE_REACH_SQL rows as episode_id and premium_listeners."""
+    return pd.DataFrame(
+        {
+            "episode_id": frame.episode_id.to_numpy(),
+            "premium_listeners": estimate(frame.registers, frame.inverse_sum, precision),
+        }
+    )
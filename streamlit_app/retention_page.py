@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+
+from database import run_queries
+from filters import FilteredQuery, bind_queries
+from fragments import page_fragment
+
+# The cohort tables are split by listener attributes only, so retention
+# follows the date (activity month), country and subscription filters.
+RETENTION_COLUMNS = {"month": "activity_month", "country": "country", "subscription_type": "subscription_type"}
+
+RETENTION_QUERIES = {
+    "cells": FilteredQuery(
+        """
+SELECT
+    cohort_month,
+    activity_month,
+    SUM(listeners) AS listeners
+FROM retention_cohorts
+WHERE {where}
+GROUP BY cohort_month, activity_month
+""",
+        RETENTION_COLUMNS,
+    ),
+    "sizes": FilteredQuery(
+        """
+SELECT
+    cohort_month,
+    SUM(listeners) AS cohort_size
+FROM retention_cohort_sizes
+WHERE {where}
+GROUP BY cohort_month
+""",
+        {"country": "country", "subscription_type": "subscription_type"},
+    ),
+}
+
+COLUMN_MODES = ("Months since signup", "Calendar month")
+VALUE_MODES = ("% of cohort", "Listeners")
+
+
+def month_number(months):
+    """YYYY-MM strings -> months since year 0, so month arithmetic is integer math."""
+    months = pd.Series(months, dtype="string")
+    return (months.str[:4].astype(int) * 12 + months.str[5:7].astype(int) - 1).to_numpy()
+
+
+def retention_matrix(cells, sizes, since_signup=True, share=True):
+    """Cohort x period matrix from (cohort_month, activity_month, listeners) cells.
+
+    Periods are months since signup or calendar months. Activity recorded
+    before a listener's signup month has no place on the since-signup axis
+    and is dropped there. Shares divide by the cohort size.
+    """
+    cells = cells.merge(sizes, on="cohort_month")
+    if since_signup:
+        period = month_number(cells.cohort_month.tolist())
+        period = month_number(cells.activity_month.tolist()) - period
+        keep = period >= 0
+        cells, period = cells[keep], period[keep]
+    else:
+        period = cells.activity_month.to_numpy()
+
+    rows, cohorts = pd.factorize(cells.cohort_month.to_numpy(), sort=True)
+    columns, periods = pd.factorize(period, sort=True)
+    values = cells.listeners.to_numpy(dtype=float)
+    if share:
+        values = 100.0 * values / cells.cohort_size.to_numpy(dtype=float)
+    matrix = np.full((len(cohorts), len(periods)), np.nan)
+    matrix[rows, columns] = values
+    return pd.DataFrame(matrix, index=pd.Index(cohorts, name="cohort"), columns=periods)
+
+
+def retention_curve(cells, sizes):
+    """Listener-weighted retention by months since signup.
+
+    Each period only counts the cohorts that can be observed there, i.e.
+    whose signup month plus the period falls inside the activity window.
+    """
+    active = retention_matrix(cells, sizes, share=False)
+    if active.empty:
+        return pd.DataFrame(columns=["months_since_signup", "retention_pct"])
+    cohort_size = sizes.set_index("cohort_month").cohort_size.reindex(active.index).to_numpy(dtype=float)
+    first, last = month_number([cells.activity_month.min(), cells.activity_month.max()])
+    start = month_number(active.index.tolist())
+    offsets = active.columns.to_numpy()
+    observed = (start[:, None] + offsets[None, :] >= first) & (start[:, None] + offsets[None, :] <= last)
+    retained = np.nansum(active.to_numpy(), axis=0)
+    exposed = (observed * cohort_size[:, None]).sum(axis=0)
+    return pd.DataFrame(
+        {"months_since_signup": offsets, "retention_pct": 100.0 * retained / np.where(exposed > 0, exposed, np.nan)}
+    )
+
+
+def retention_page(filters):
+    st.title("Listener Retention")
+    st.caption(
+        "Listeners grouped by signup month, and the share of each cohort that listened in later months. "
+        "Retention follows the date, country and subscription filters."
+    )
+
+    results = run_queries(bind_queries(RETENTION_QUERIES, filters))
+    cells = results["cells"]
+    sizes = results["sizes"]
+    if cells.empty or sizes.empty:
+        st.warning("No retention data available.")
+        return
+
+    # ================= KPI SECTION =================
+    latest_month = cells.activity_month.max()
+    active_latest = int(cells.loc[cells.activity_month == latest_month, "listeners"].sum())
+    total_listeners = int(sizes.cohort_size.sum())
+    curve = retention_curve(cells, sizes)
+    month_one = curve.loc[curve.months_since_signup == 1, "retention_pct"]
+
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Cohorts", f"{len(sizes):,}")
+    k2.metric("Cohort Listeners", f"{total_listeners:,}")
+    k3.metric(f"Active in {latest_month}", f"{100.0 * active_latest / total_listeners:.1f}%")
+    k4.metric(
+        "Month-1 Retention",
+        f"{month_one.iloc[0]:.1f}%" if not month_one.empty and pd.notna(month_one.iloc[0]) else "n/a",
+    )
+
+    st.divider()
+
+    cohort_matrix(cells, sizes)
+
+    # ================= RETENTION CURVE =================
+    st.subheader("Retention Curve")
+    st.plotly_chart(
+        px.line(
+            curve,
+            x="months_since_signup",
+            y="retention_pct",
+            markers=True,
+            title="Share of Listeners Active N Months After Signup",
+        ),
+        use_container_width=True,
+    )
+
+
+# ================= COHORT MATRIX =================
+# The axis and value switches rerun only the matrix.
+@page_fragment
+def cohort_matrix(cells, sizes):
+    left, right = st.columns(2)
+    column_mode = left.radio("Columns", COLUMN_MODES, horizontal=True)
+    value_mode = right.radio("Values", VALUE_MODES, horizontal=True)
+    share = value_mode == VALUE_MODES[0]
+    matrix = retention_matrix(cells, sizes, since_signup=column_mode == COLUMN_MODES[0], share=share)
+
+    st.subheader("Cohort Retention Matrix")
+    st.plotly_chart(
+        px.imshow(
+            matrix,
+            labels={"x": column_mode, "y": "Signup cohort", "color": value_mode},
+            aspect="auto",
+            color_continuous_scale="Blues",
+        ),
+        use_container_width=True,
+    )
+    st.dataframe(matrix.round(1) if share else matrix, use_container_width=True)
@@ -1,12 +1,24 @@
+import time
+
+import pandas as pd
 import streamlit as st
-from database import run_query
+from database import data_version, run_query
+from guarded_query import MAX_BYTES, MAX_ROWS, TIMEOUT_SECONDS, start_query
+from paging import TablePager
 
 TABLE_DESCRIPTIONS = {
     "podcasts": "Master list of shows and their metadata.",
     "episodes": "Episode-level metadata linked to podcasts.",
     "listeners": "User profile and subscription details.",
-    "sessions": "Listening events by listener and episode.",
+    "sessions": "Listening events by listener and episode; a view over one partition per month.",
     "revenue": "Monetization outcomes per episode.",
+    "rollup_monthly_listening": "Monthly sessions, minutes and completion by category, country, platform and subscription.",
+    "revenue_attribution": "Episode revenue split across months by listening minutes or publish month.",
+    "listener_features": "Running per-listener totals: sessions, minutes, completion, device/platform mix, first and last listen.",
+    "session_partitions": "The monthly session partitions behind the sessions view, with row counts and key and time bounds.",
+    "reach_sketches": "HyperLogLog registers of the listeners in each day, category, episode, country, platform and subscription.",
+    "leaderboards": "Top episodes and podcasts by premium listeners, minutes, revenue and completion, per category and month.",
+    "retention_cohorts": "Distinct listeners of each signup month active in each month, by country and subscription.",
 }
 
 SCHEMA = {
@@ -32,12 +44,71 @@ SCHEMA = {
         "listener_id",
         "episode_id",
         "listen_start_time",
+        "listen_month",
         "listen_minutes",
         "completion_percent",
         "device",
         "platform",
     ],
     "revenue": ["episode_id", "ads_shown", "ads_clicked", "revenue_generated"],
+    "rollup_monthly_listening": [
+        "month",
+        "category",
+        "country",
+        "platform",
+        "subscription_type",
+        "sessions",
+        "listen_minutes",
+        "completion_sum",
+    ],
+    "revenue_attribution": ["method", "month", "episode_id", "listen_minutes", "revenue"],
+    "listener_features": [
+        "listener_id",
+        "sessions",
+        "listen_minutes",
+        "completion_sum",
+        "mobile_sessions",
+        "tablet_sessions",
+        "desktop_sessions",
+        "web_sessions",
+        "ios_sessions",
+        "android_sessions",
+        "first_listen_at",
+        "last_listen_at",
+        "last_session_id",
+    ],
+    "session_partitions": [
+        "month",
+        "table_name",
+        "row_count",
+        "min_session_id",
+        "max_session_id",
+        "first_listen_at",
+        "last_listen_at",
+        "compacted_at",
+        "updated_at",
+    ],
+    "reach_sketches": [
+        "day",
+        "category",
+        "episode_id",
+        "country",
+        "platform",
+        "subscription_type",
+        "register",
+        "rank",
+    ],
+    "leaderboards": [
+        "entity",
+        "metric",
+        "category",
+        "period",
+        "position",
+        "entity_id",
+        "value",
+        "listen_minutes",
+    ],
+    "retention_cohorts": ["cohort_month", "activity_month", "country", "subscription_type", "listeners"],
 }
 
 QUERY_TEMPLATES = {
@@ -61,7 +132,7 @@ ORDER BY listeners DESC;
 """,
     "Monthly listening trend": """
 SELECT
-    strftime('%Y-%m', listen_start_time) AS month,
+    listen_month AS month,
     SUM(listen_minutes) AS minutes
 FROM sessions
 GROUP BY month
@@ -70,19 +141,79 @@ ORDER BY month;
     "Top 10 episodes by revenue": """
 SELECT
     e.episode_title,
-    SUM(r.revenue_generated) AS revenue
-FROM revenue r
-JOIN episodes e ON r.episode_id = e.episode_id
-GROUP BY e.episode_id, e.episode_title
-ORDER BY revenue DESC
-LIMIT 10;
+    b.value AS revenue
+FROM leaderboards b
+JOIN episodes e ON b.entity_id = e.episode_id
+WHERE b.entity = 'episode'
+  AND b.metric = 'revenue'
+  AND b.category = 'All'
+  AND b.period = 'all'
+  AND b.position <= 10
+ORDER BY b.position;
 """,
 }
 
 
-def _table_count(table_name):
-    count_df = run_query(f"SELECT COUNT(*) AS rows_count FROM {table_name}")
-    return int(count_df.rows_count.iloc[0] or 0)
+CATALOG_TABLES_QUERY = "SELECT table_name, row_count, profiled_row_count, refreshed_at FROM catalog_tables"
+
+CATALOG_COLUMNS_QUERY = """
+SELECT
+    table_name,
+    column_name AS "column",
+    data_type AS type,
+    key_type AS "key",
+    null_count AS nulls,
+    distinct_count AS "distinct",
+    CAST(min_value AS TEXT) AS min,
+    CAST(max_value AS TEXT) AS max
+FROM catalog_columns
+ORDER BY table_name, position
+"""
+
+
+def _catalog():
+    # Maintained by setup_database.py at ingest time; no table is scanned here.
+    try:
+        tables = run_query(CATALOG_TABLES_QUERY)
+        columns = run_query(CATALOG_COLUMNS_QUERY)
+    except Exception:
+        return {}, None
+    return tables.set_index("table_name").to_dict("index"), columns
+
+
+def _step_page(state_key, step):
+    st.session_state[state_key] = max(st.session_state.get(state_key, 0) + step, 0)
+
+
+def _show_page(state_key, pager):
+    """Render the current page of ``pager`` with Previous/Next controls.
+
+    Works with anything exposing ``page(n)``, ``has_page(n)`` and
+    ``page_rows``: the keyset TablePager or a QueryJob.
+    """
+    number = st.session_state.get(state_key, 0)
+    frame = pager.page(number)
+    while frame is None and number > 0:
+        number -= 1
+        frame = pager.page(number)
+    st.session_state[state_key] = number
+    if frame is None:
+        return
+
+    st.dataframe(frame, use_container_width=True)
+    first_row = number * pager.page_rows
+    prev_col, label_col, next_col = st.columns([1, 4, 1])
+    prev_col.button(
+        "Previous", key=f"{state_key}_prev", disabled=number == 0, on_click=_step_page, args=(state_key, -1)
+    )
+    label_col.caption(f"Page {number + 1} - rows {first_row + 1:,} to {first_row + len(frame):,}")
+    next_col.button(
+        "Next",
+        key=f"{state_key}_next",
+        disabled=not pager.has_page(number + 1),
+        on_click=_step_page,
+        args=(state_key, 1),
+    )
 
 
 def sql_explorer():
@@ -90,17 +221,35 @@ def sql_explorer():
     st.caption("Explore schema, preview tables, and run custom SQL to understand your podcast business data.")
 
     st.subheader("Data Dictionary")
+    table_stats, column_stats = _catalog()
     for table, cols in SCHEMA.items():
         with st.expander(f"{table}"):
             st.write(TABLE_DESCRIPTIONS.get(table, ""))
-            st.write(f"Columns: {', '.join(cols)}")
-            st.write(f"Row count: {_table_count(table):,}")
+            stats = table_stats.get(table)
+            if stats is None:
+                st.write(f"Columns: {', '.join(cols)}")
+                st.caption("No catalog statistics yet; run setup_database.py to collect them.")
+                continue
+            st.write(f"Row count: {int(stats['row_count']):,} (as of {stats['refreshed_at']} UTC)")
+            if pd.isna(stats["profiled_row_count"]):
+                st.caption("Distinct counts are estimated from per-partition sketches.")
+            elif stats["profiled_row_count"] != stats["row_count"]:
+                st.caption(f"Column statistics were measured at {int(stats['profiled_row_count']):,} rows.")
+            st.dataframe(
+                column_stats[column_stats.table_name == table].drop(columns="table_name"),
+                use_container_width=True,
+                hide_index=True,
+            )
 
     st.subheader("Table Preview")
     selected_table = st.selectbox("Select table", list(SCHEMA.keys()))
-    preview_limit = st.slider("Rows to preview", min_value=5, max_value=100, value=20, step=5)
-    preview_df = run_query(f"SELECT * FROM {selected_table} LIMIT {preview_limit}")
-    st.dataframe(preview_df, use_container_width=True)
+    page_rows = st.slider("Rows per page", min_value=5, max_value=100, value=20, step=5)
+    pager_key = (selected_table, page_rows, data_version())
+    if st.session_state.get("preview_pager_key") != pager_key:
+        st.session_state["preview_pager_key"] = pager_key
+        st.session_state["preview_pager"] = TablePager(selected_table, page_rows)
+        st.session_state["preview_page"] = 0
+    _show_page("preview_page", st.session_state["preview_pager"])
 
     st.subheader("Starter Queries")
     selected_template = st.selectbox("Choose a starter query", list(QUERY_TEMPLATES.keys()))
@@ -110,10 +259,40 @@ def sql_explorer():
     default_sql = QUERY_TEMPLATES[selected_template].strip()
     query = st.text_area("Write SQL query", value=default_sql, height=220)
 
+    st.caption(
+        f"Read-only. Queries stop after {TIMEOUT_SECONDS:g}s per page and return at most "
+        f"{MAX_ROWS:,} rows or {MAX_BYTES / (1024 * 1024):g} MB in total."
+    )
+
     if st.button("Run Query"):
-        try:
-            result = run_query(query)
-            st.success(f"Returned {len(result)} rows.")
-            st.dataframe(result, use_container_width=True)
-        except Exception as e:
-            st.error(f"Query failed: {e}")
+        previous = st.session_state.get("sql_job")
+        if previous is not None:
+            previous.cancel()
+        st.session_state["sql_job"] = start_query(query)
+        st.session_state["sql_page"] = 0
+
+    job = st.session_state.get("sql_job")
+    if job is None:
+        return
+
+    if not job.done():
+        # Clicking Cancel reruns the page, which interrupts the polling loop
+        # below and signals the job's progress handler to stop.
+        if st.button("Cancel query"):
+            job.cancel()
+        progress = st.empty()
+        while not job.wait(0.2):
+            progress.caption(f"Running... {time.monotonic() - job.started:.1f}s")
+        progress.empty()
+
+    if job.status == "done":
+        st.success(f"First page returned in {job.elapsed:.2f}s; later pages are fetched as you page through.")
+        _show_page("sql_page", job)
+        if job.truncated:
+            st.warning(f"Result truncated: {job.truncated}. Add a LIMIT or aggregate to see everything.")
+    elif job.status == "timeout":
+        st.error(f"Query stopped after {job.timeout:g}s. Narrow it with filters, LIMIT or aggregation.")
+    elif job.status == "cancelled":
+        st.info("Query cancelled.")
+    else:
+        st.error(f"Query failed: {job.error}")
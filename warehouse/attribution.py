@@ -0,0 +1,118 @@
+"""Episode revenue allocated across months, for the monetization trend.
+
+``revenue`` holds one total per episode with no date. Joining it to sessions
+repeats that total once per session, so the trend is rebuilt here instead:
+each episode's ``revenue_generated`` is split across months exactly once,
+either in proportion to the minutes listened in each month ("listening") or
+entirely in the episode's publish month ("publish"). Per method, the table
+sums back to the revenue total.
+"""
+
+from warehouse.rollups import UNKNOWN
+
+METHODS = ("listening", "publish")
+
+ATTRIBUTION_DDL = """
+CREATE TABLE IF NOT EXISTS revenue_attribution (
+    method TEXT NOT NULL,
+    month TEXT NOT NULL,
+    episode_id INTEGER NOT NULL,
+    listen_minutes INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (method, month, episode_id)
+) WITHOUT ROWID
+"""
+
+# {episode_filter} restricts both the sessions read and the episodes written.
+# Episodes nobody listened to keep their revenue under "listening" too, in
+# their publish month, so neither method drops revenue.
+_ATTRIBUTE_SQL = """
+INSERT INTO revenue_attribution (method, month, episode_id, listen_minutes, revenue)
+WITH episode_months AS (
+    SELECT
+        s.episode_id,
+        s.listen_month AS month,
+        SUM(s.listen_minutes) AS listen_minutes
+    FROM sessions s
+    WHERE {episode_filter}
+    GROUP BY s.episode_id, s.listen_month
+),
+shares AS (
+    SELECT
+        episode_id,
+        month,
+        listen_minutes,
+        SUM(listen_minutes) OVER (PARTITION BY episode_id) AS episode_minutes
+    FROM episode_months
+)
+SELECT
+    'listening',
+    sh.month,
+    r.episode_id,
+    sh.listen_minutes,
+    r.revenue_generated * sh.listen_minutes / sh.episode_minutes
+FROM revenue r
+JOIN shares sh ON sh.episode_id = r.episode_id
+WHERE sh.episode_minutes > 0
+UNION ALL
+SELECT
+    m.method,
+    COALESCE(substr(e.publish_date, 1, 7), '{unknown}'),
+    r.episode_id,
+    COALESCE((SELECT MAX(sh.episode_minutes) FROM shares sh WHERE sh.episode_id = r.episode_id), 0),
+    r.revenue_generated
+FROM revenue r
+LEFT JOIN episodes e ON e.episode_id = r.episode_id
+JOIN (SELECT 'publish' AS method UNION ALL SELECT 'listening') m
+WHERE {revenue_filter}
+  AND (
+    m.method = 'publish'
+    OR NOT EXISTS (
+        SELECT 1 FROM shares sh WHERE sh.episode_id = r.episode_id AND sh.episode_minutes > 0
+    )
+  )
+"""
+
+
+def _tables_exist(conn):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'revenue_attribution'"
+    ).fetchone()
+    return row is not None
+
+
+def _attribute(conn, episode_filter="1 = 1", revenue_filter="1 = 1"):
+    conn.execute(
+        _ATTRIBUTE_SQL.format(unknown=UNKNOWN, episode_filter=episode_filter, revenue_filter=revenue_filter)
+    )
+
+
+def rebuild(conn):
+    conn.execute(ATTRIBUTION_DDL)
+    conn.execute("DELETE FROM revenue_attribution")
+    _attribute(conn)
+
+
+def refresh(conn, delta):
+    if delta.full or not _tables_exist(conn) or delta.touched("revenue", "episodes"):
+        rebuild(conn)
+        return
+    if not delta.new_sessions:
+        return
+
+    # New sessions only shift the monthly split of the episodes they belong to.
+    predicate, params = delta.session_filter
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS attribution_episodes (episode_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.attribution_episodes")
+    conn.execute(
+        f"INSERT INTO temp.attribution_episodes SELECT DISTINCT s.episode_id FROM sessions s WHERE {predicate}",
+        params,
+    )
+    conn.execute(
+        "DELETE FROM revenue_attribution WHERE episode_id IN (SELECT episode_id FROM temp.attribution_episodes)"
+    )
+    _attribute(
+        conn,
+        episode_filter="s.episode_id IN (SELECT episode_id FROM temp.attribution_episodes)",
+        revenue_filter="r.episode_id IN (SELECT episode_id FROM temp.attribution_episodes)",
+    )
@@ -0,0 +1,349 @@
+"""Table and column statistics recorded at ingest time for the SQL Explorer.
+
+The data dictionary used to run COUNT(*) against every table on each page
+rerun. Ingest already knows which tables it touched, so it profiles those
+once (one scan per table) and the explorer reads the results from here.
+
+Partitioned sessions are profiled per partition. Sessions are append-only,
+so a partition that grew only has its new rows read, and their null counts,
+bounds and HyperLogLog registers are folded into the partition's stored
+profile. The view's row count and key and time bounds come from
+``session_partitions``, and its distinct counts are estimated from the merged
+registers. Large tables only have their row count updated between runs;
+their columns are profiled again once it has drifted far enough.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from warehouse import partitions, sketches
+
+# Tables at least this large keep their column statistics until the row count
+# drifts by PROFILE_DRIFT from the one they were measured at; smaller tables
+# are profiled in full whenever they change.
+LARGE_TABLE_ROWS = int(os.environ.get("PODCAST_BI_CATALOG_LARGE_ROWS", "10000"))
+PROFILE_DRIFT = 0.1
+# 4,096 registers per partition column: about 1.6% error, 4 KB each.
+PARTITION_SKETCH_PRECISION = 12
+
+CATALOG_DDL = {
+    "catalog_tables": """
+CREATE TABLE IF NOT EXISTS catalog_tables (
+    table_name TEXT PRIMARY KEY,
+    row_count INTEGER NOT NULL,
+    profiled_row_count INTEGER,
+    refreshed_at TEXT NOT NULL
+)
+""",
+    "catalog_columns": """
+CREATE TABLE IF NOT EXISTS catalog_columns (
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data_type TEXT,
+    key_type TEXT,
+    null_count INTEGER NOT NULL,
+    distinct_count INTEGER NOT NULL,
+    min_value,
+    max_value,
+    PRIMARY KEY (table_name, column_name)
+) WITHOUT ROWID
+""",
+    "catalog_partitions": """
+CREATE TABLE IF NOT EXISTS catalog_partitions (
+    table_name TEXT PRIMARY KEY,
+    row_count INTEGER NOT NULL,
+    max_session_id INTEGER
+)
+""",
+    "catalog_partition_columns": """
+CREATE TABLE IF NOT EXISTS catalog_partition_columns (
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    null_count INTEGER NOT NULL,
+    min_value,
+    max_value,
+    registers BLOB,
+    PRIMARY KEY (table_name, column_name)
+) WITHOUT ROWID
+""",
+}
+
+# Bookkeeping tables that are not part of the analytical model.
+_INTERNAL_TABLES = {"ingest_watermarks", "warehouse_meta", *CATALOG_DDL}
+
+
+def catalog_tables(conn):
+    # Partitioned sessions are catalogued once, as the view over all months.
+    hidden = _INTERNAL_TABLES | set(partitions.partition_tables(conn))
+    return [
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE (type = 'table' OR name = ?) AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY name",
+            (partitions.PARENT,),
+        )
+        if row[0] not in hidden
+    ]
+
+
+def _column_info(conn, table):
+    # A view reports no keys; the partitions carry the sessions keys.
+    source = table
+    if table == partitions.PARENT and partitions.partition_tables(conn):
+        source = partitions.partition_tables(conn)[0]
+    # table_xinfo also lists generated columns such as sessions.listen_month.
+    foreign_keys = {row[3] for row in conn.execute(f"PRAGMA foreign_key_list({source})")}
+    columns = []
+    for row in conn.execute(f"PRAGMA table_xinfo({source})"):
+        name, data_type, primary_key = row[1], row[2], row[5]
+        key_type = "primary" if primary_key else "foreign" if name in foreign_keys else None
+        columns.append((name, data_type, key_type))
+    return columns
+
+
+def _unique_column(columns):
+    """The single-column primary key, whose distinct count is its non-null count."""
+    primary = [name for name, _, key_type in columns if key_type == "primary"]
+    return primary[0] if len(primary) == 1 else None
+
+
+def _column_stats(conn, table, columns):
+    """Row count and (null, distinct, min, max) per column, in one scan."""
+    unique = _unique_column(columns)
+    measures = ["COUNT(*)"]
+    for name, _, _ in columns:
+        # A single-column key is distinct by definition; skip its sort.
+        counted = f"COUNT(DISTINCT {name})" if name != unique else "NULL"
+        measures += [f"COUNT({name})", counted, f"MIN({name})", f"MAX({name})"]
+    stats = conn.execute(f"SELECT {', '.join(measures)} FROM {table}").fetchone()
+    row_count = stats[0]
+    profiles = []
+    for position, (name, _, _) in enumerate(columns):
+        non_null, distinct, low, high = stats[1 + 4 * position : 5 + 4 * position]
+        profiles.append((row_count - non_null, non_null if name == unique else distinct, low, high))
+    return row_count, profiles
+
+
+def _write_profile(conn, table, columns, row_count, profiles, profiled_row_count):
+    conn.execute(
+        """
+INSERT INTO catalog_tables (table_name, row_count, profiled_row_count, refreshed_at)
+VALUES (?, ?, ?, datetime('now'))
+ON CONFLICT (table_name) DO UPDATE SET
+    row_count = excluded.row_count,
+    profiled_row_count = excluded.profiled_row_count,
+    refreshed_at = excluded.refreshed_at
+""",
+        (table, row_count, profiled_row_count),
+    )
+    rows = [
+        (table, name, position, data_type, key_type, *profile)
+        for position, ((name, data_type, key_type), profile) in enumerate(zip(columns, profiles))
+    ]
+    conn.execute("DELETE FROM catalog_columns WHERE table_name = ?", (table,))
+    conn.executemany(
+        """
+INSERT INTO catalog_columns (
+    table_name, column_name, position, data_type, key_type,
+    null_count, distinct_count, min_value, max_value
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+""",
+        rows,
+    )
+
+
+def profile_table(conn, table):
+    previous = conn.execute(
+        "SELECT profiled_row_count FROM catalog_tables WHERE table_name = ?", (table,)
+    ).fetchone()
+    if previous and previous[0] and previous[0] >= LARGE_TABLE_ROWS:
+        # COUNT(*) walks the narrowest b-tree without decoding any column.
+        row_count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if abs(row_count - previous[0]) <= PROFILE_DRIFT * previous[0]:
+            conn.execute(
+                "UPDATE catalog_tables SET row_count = ?, refreshed_at = datetime('now') WHERE table_name = ?",
+                (row_count, table),
+            )
+            return
+    columns = _column_info(conn, table)
+    row_count, profiles = _column_stats(conn, table, columns)
+    _write_profile(conn, table, columns, row_count, profiles, row_count)
+
+
+def _register_bytes(values):
+    ranks = np.zeros(2**PARTITION_SKETCH_PRECISION, dtype=np.uint8)
+    if len(values):
+        hashed = pd.util.hash_array(values.to_numpy())
+        positions, value_ranks = sketches.hash_ranks(hashed, PARTITION_SKETCH_PRECISION)
+        np.maximum.at(ranks, positions, value_ranks.astype(np.uint8))
+    return ranks.tobytes()
+
+
+def _bound(pick, *values):
+    values = [value for value in values if value is not None]
+    return pick(values) if values else None
+
+
+def _merge_registers(*blobs):
+    return np.maximum.reduce([np.frombuffer(blob, dtype=np.uint8) for blob in blobs])
+
+
+def _scan_partition(conn, table, columns, since=None):
+    """Row count and {column: (nulls, min, max, registers)} of a partition's
+    rows, or of only those past ``since`` when it is given."""
+    where, params = (f"WHERE {partitions.KEY} > ?", (since,)) if since is not None else ("", ())
+    unique = _unique_column(columns)
+    measures = ["COUNT(*)"]
+    for name, _, _ in columns:
+        measures += [f"COUNT({name})", f"MIN({name})", f"MAX({name})"]
+    stats = conn.execute(f"SELECT {', '.join(measures)} FROM {table} {where}", params).fetchone()
+    sketched = [(name, data_type) for name, data_type, _ in columns if name != unique]
+    frame = pd.read_sql(f"SELECT {', '.join(name for name, _ in sketched)} FROM {table} {where}", conn, params=params)
+
+    row_count = stats[0]
+    profile = {}
+    for position, (name, _, _) in enumerate(columns):
+        non_null, low, high = stats[1 + 3 * position : 4 + 3 * position]
+        profile[name] = [row_count - non_null, low, high, None]
+    for name, data_type in sketched:
+        values = frame[name].dropna()
+        if "INT" in data_type.upper():
+            # A column with NULLs reads back as float; hash every partition's
+            # integers alike.
+            values = values.astype(np.int64)
+        profile[name][3] = _register_bytes(values)
+    return row_count, profile
+
+
+def _profile_partition(conn, table, columns, row_count, max_session_id, profiled):
+    stored = None
+    if profiled is not None and None not in (profiled[1], max_session_id) and max_session_id > profiled[1]:
+        stored = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                "SELECT column_name, null_count, min_value, max_value, registers "
+                "FROM catalog_partition_columns WHERE table_name = ?",
+                (table,),
+            )
+        }
+        added, profile = _scan_partition(conn, table, columns, since=profiled[1])
+        # Only appends past the profiled key are folded in; anything else
+        # rescans the partition.
+        if profiled[0] + added != row_count or any(name not in stored for name, _, _ in columns):
+            stored = None
+    if stored is None:
+        _, profile = _scan_partition(conn, table, columns)
+    else:
+        for name, (nulls, low, high, registers) in profile.items():
+            old_nulls, old_low, old_high, old_registers = stored[name]
+            profile[name] = [
+                old_nulls + nulls,
+                _bound(min, old_low, low),
+                _bound(max, old_high, high),
+                _merge_registers(old_registers, registers).tobytes() if registers is not None else None,
+            ]
+
+    conn.execute("DELETE FROM catalog_partition_columns WHERE table_name = ?", (table,))
+    conn.executemany(
+        """
+INSERT INTO catalog_partition_columns (table_name, column_name, null_count, min_value, max_value, registers)
+VALUES (?, ?, ?, ?, ?, ?)
+""",
+        [(table, name, *values) for name, values in profile.items()],
+    )
+    conn.execute(
+        """
+INSERT INTO catalog_partitions (table_name, row_count, max_session_id) VALUES (?, ?, ?)
+ON CONFLICT (table_name) DO UPDATE SET
+    row_count = excluded.row_count,
+    max_session_id = excluded.max_session_id
+""",
+        (table, row_count, max_session_id),
+    )
+
+
+def profile_sessions(conn):
+    """Bring the changed partitions' profiles up to date and merge them into the view's entry."""
+    columns = _column_info(conn, partitions.PARENT)
+    for catalog_table in ("catalog_partitions", "catalog_partition_columns"):
+        conn.execute(
+            f"DELETE FROM {catalog_table} WHERE table_name NOT IN (SELECT table_name FROM session_partitions)"
+        )
+    profiled = {row[0]: tuple(row[1:]) for row in conn.execute("SELECT * FROM catalog_partitions")}
+    for table, row_count, max_session_id in conn.execute(
+        "SELECT table_name, row_count, max_session_id FROM session_partitions"
+    ).fetchall():
+        if profiled.get(table) != (row_count, max_session_id):
+            _profile_partition(conn, table, columns, row_count, max_session_id, profiled.get(table))
+
+    row_count, min_key, max_key, first_listen, last_listen = conn.execute(
+        """
+SELECT COALESCE(SUM(row_count), 0), MIN(min_session_id), MAX(max_session_id), MIN(first_listen_at), MAX(last_listen_at)
+FROM session_partitions
+"""
+    ).fetchone()
+    unique = _unique_column(columns)
+    profiles = []
+    for name, _, _ in columns:
+        nulls, low, high = conn.execute(
+            "SELECT COALESCE(SUM(null_count), 0), MIN(min_value), MAX(max_value) "
+            "FROM catalog_partition_columns WHERE column_name = ?",
+            (name,),
+        ).fetchone()
+        if name == unique:
+            distinct = row_count - nulls
+        else:
+            blobs = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT registers FROM catalog_partition_columns WHERE column_name = ?", (name,)
+                )
+            ]
+            distinct = min(sketches.dense_estimate(_merge_registers(*blobs)), row_count - nulls) if blobs else 0
+        if name == partitions.KEY:
+            low, high = min_key, max_key
+        elif name == partitions.TIME_COLUMN:
+            low, high = first_listen, last_listen
+        profiles.append((nulls, distinct, low, high))
+    _write_profile(conn, partitions.PARENT, columns, row_count, profiles, None)
+
+
+def ensure_tables(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(catalog_tables)")]
+    if columns and "profiled_row_count" not in columns:
+        # Catalogs written before large tables kept their column statistics.
+        conn.execute("DROP TABLE catalog_tables")
+    for ddl in CATALOG_DDL.values():
+        conn.execute(ddl)
+
+
+def refresh(conn, delta):
+    if delta.full:
+        # Rebuilt partitions can match the stored row counts and keys.
+        conn.execute("DROP TABLE IF EXISTS catalog_partitions")
+        conn.execute("DROP TABLE IF EXISTS catalog_partition_columns")
+    ensure_tables(conn)
+    profiled = {row[0] for row in conn.execute("SELECT table_name FROM catalog_tables")}
+    tables = catalog_tables(conn)
+    conn.execute(
+        f"DELETE FROM catalog_tables WHERE table_name NOT IN ({', '.join('?' for _ in tables)})", tables
+    )
+    conn.execute(
+        f"DELETE FROM catalog_columns WHERE table_name NOT IN ({', '.join('?' for _ in tables)})", tables
+    )
+
+    # Derived tables count as touched when their refresher wrote to them, and
+    # the partition catalog whenever sessions were loaded.
+    written = set(delta.written)
+    if delta.touched(partitions.PARENT):
+        written.add("session_partitions")
+    for table in tables:
+        if table == partitions.PARENT and partitions.partition_tables(conn):
+            if table not in profiled or delta.full or delta.touched(table):
+                profile_sessions(conn)
+        elif table not in profiled or delta.full or delta.touched(table) or table in written:
+            profile_table(conn, table)
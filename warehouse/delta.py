@@ -0,0 +1,69 @@
+"""Describes what one ingest run changed, for the derived-table refreshers."""
+
+
+class IngestDelta:
+    """What a single ingest run changed, as seen by the derived tables.
+
+    ``previous_max_session_id`` is the sessions high-water mark before the run,
+    so ``session_id > previous_max_session_id`` selects exactly the new rows.
+    """
+
+    def __init__(self, full, changed, previous_max_session_id=None):
+        self.full = full
+        self.changed = changed
+        self.previous_max_session_id = previous_max_session_id
+        # Derived tables written so far in this run, filled in by refresh_derived.
+        self.written = set()
+
+    @property
+    def new_sessions(self):
+        return self.changed.get("sessions", 0)
+
+    def touched(self, *tables):
+        return any(self.changed.get(table, 0) for table in tables)
+
+    @property
+    def session_filter(self):
+        if self.previous_max_session_id is None:
+            return "1 = 1", ()
+        return "s.session_id > ?", (self.previous_max_session_id,)
+
+
+def track_listener_changes(conn):
+    """Record the pre-update attributes of every listener rewritten by an upsert.
+
+    Derived tables keyed by listener attributes use ``temp.listener_changes``
+    to move the affected listeners' history from the old slice to the new one
+    instead of rebuilding from all sessions.
+    """
+    conn.execute(
+        """
+CREATE TEMP TABLE IF NOT EXISTS listener_changes (
+    listener_id INTEGER PRIMARY KEY,
+    country TEXT,
+    age_group TEXT,
+    gender TEXT,
+    subscription_type TEXT,
+    signup_date TEXT
+)
+"""
+    )
+    conn.execute(
+        """
+CREATE TEMP TRIGGER IF NOT EXISTS capture_listener_changes
+BEFORE UPDATE ON main.listeners
+BEGIN
+    INSERT OR IGNORE INTO listener_changes
+    VALUES (old.listener_id, old.country, old.age_group, old.gender, old.subscription_type, old.signup_date);
+END
+"""
+    )
+
+
+def changed_listener_count(conn):
+    row = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_temp_master WHERE type = 'table' AND name = 'listener_changes'"
+    ).fetchone()
+    if not row[0]:
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM temp.listener_changes").fetchone()[0]
@@ -0,0 +1,463 @@
+"""Top-K episode and podcast leaderboards that the pages read instead of sorting.
+
+``leaderboard_stats`` keeps one row per episode or podcast per month, plus an
+"all" period, with its sessions, minutes, completion, distinct premium
+listeners and attributed revenue. ``leaderboards`` keeps, per entity, metric,
+category (and "All") and period, the ``PODCAST_BI_LEADERBOARD_SIZE`` best
+entries in rank order, so a top-10 view is a primary-key range read.
+
+Incremental runs only read the new sessions. Their sessions, minutes and
+completion are added to the episodes' rows, and podcasts are re-summed from
+their episodes. Premium reach is kept exact by
+``leaderboard_premium_listeners``, which holds every (entity, period,
+premium listener) counted so far: a new session only adds a listener it does
+not hold yet, and only a subscription change adds or removes that listener's
+entries. The new values are then merged into each affected board with a
+bounded heap. A merge is exact as long as its last entry still ranks at or
+above the board's old last entry, since every entity left off the old board
+ranked below that; otherwise the board is re-read from the stats.
+"""
+
+import heapq
+import os
+from collections import defaultdict
+
+from warehouse import delta as ingest_delta
+from warehouse.rollups import UNKNOWN
+
+LEADERBOARD_SIZE = int(os.environ.get("PODCAST_BI_LEADERBOARD_SIZE", "50"))
+ALL_CATEGORIES = "All"
+ALL_TIME = "all"
+
+# Entity -> its key in the sessions joins below. Sessions of episodes
+# without a podcast have no podcast to rank.
+ENTITIES = {"episode": "s.episode_id", "podcast": "e.podcast_id"}
+PERIODS = ("s.listen_month", f"'{ALL_TIME}'")
+
+# Average completion over a handful of sessions says little, so entities
+# need this many sessions in the period to be ranked by it.
+MIN_COMPLETION_SESSIONS = 10
+
+METRICS = {
+    "premium_listeners": "premium_listeners",
+    "listen_minutes": "listen_minutes",
+    "revenue": "revenue",
+    "completion": f"CASE WHEN sessions >= {MIN_COMPLETION_SESSIONS} THEN 1.0 * completion_sum / sessions END",
+}
+
+LEADERBOARD_DDL = {
+    "leaderboard_stats": """
+CREATE TABLE IF NOT EXISTS leaderboard_stats (
+    entity TEXT NOT NULL,
+    period TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    listen_minutes INTEGER NOT NULL,
+    completion_sum INTEGER NOT NULL,
+    premium_listeners INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (entity, period, entity_id)
+) WITHOUT ROWID
+""",
+    "leaderboards": """
+CREATE TABLE IF NOT EXISTS leaderboards (
+    entity TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    category TEXT NOT NULL,
+    period TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    entity_id INTEGER NOT NULL,
+    value REAL NOT NULL,
+    listen_minutes INTEGER NOT NULL,
+    PRIMARY KEY (entity, metric, category, period, position)
+) WITHOUT ROWID
+""",
+    "leaderboard_premium_listeners": """
+CREATE TABLE IF NOT EXISTS leaderboard_premium_listeners (
+    entity TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    listener_id INTEGER NOT NULL,
+    PRIMARY KEY (entity, entity_id, period, listener_id)
+) WITHOUT ROWID
+""",
+}
+
+# Episode sessions, minutes and completion per month and over all time for
+# the sessions matching {predicate}, added to the rows already counted.
+_LISTENING_SQL = """
+INSERT INTO leaderboard_stats (
+    entity, period, entity_id, category, sessions, listen_minutes, completion_sum, premium_listeners, revenue
+)
+SELECT
+    'episode',
+    {period},
+    s.episode_id,
+    COALESCE(p.category, '{unknown}'),
+    COUNT(*),
+    SUM(s.listen_minutes),
+    SUM(s.completion_percent),
+    0,
+    0
+FROM sessions s
+LEFT JOIN episodes e ON s.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE {predicate}
+GROUP BY {group_by}
+ON CONFLICT (entity, period, entity_id) DO UPDATE SET
+    sessions = sessions + excluded.sessions,
+    listen_minutes = listen_minutes + excluded.listen_minutes,
+    completion_sum = completion_sum + excluded.completion_sum
+"""
+
+# Listening-attributed episode revenue per month and in total. Episodes
+# nobody listened to get revenue-only rows; their publish month stands in
+# for the listening month, and revenue without a known month only counts in
+# total.
+_REVENUE_SQL = """
+INSERT INTO leaderboard_stats (
+    entity, period, entity_id, category, sessions, listen_minutes, completion_sum, premium_listeners, revenue
+)
+SELECT
+    'episode',
+    {period},
+    a.episode_id,
+    COALESCE(p.category, '{unknown}'),
+    0, 0, 0, 0,
+    SUM(a.revenue)
+FROM revenue_attribution a
+JOIN episodes e ON a.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE a.method = 'listening' AND {predicate}
+GROUP BY {group_by}
+ON CONFLICT (entity, period, entity_id) DO UPDATE SET revenue = excluded.revenue
+"""
+
+# A podcast's rows are the sums of its episodes' rows; premium listeners are
+# distinct across episodes and are counted separately.
+_PODCAST_SQL = """
+INSERT INTO leaderboard_stats (
+    entity, period, entity_id, category, sessions, listen_minutes, completion_sum, premium_listeners, revenue
+)
+SELECT
+    'podcast',
+    s.period,
+    e.podcast_id,
+    MAX(s.category),
+    SUM(s.sessions),
+    SUM(s.listen_minutes),
+    SUM(s.completion_sum),
+    0,
+    SUM(s.revenue)
+FROM leaderboard_stats s
+JOIN episodes e ON s.entity_id = e.episode_id
+WHERE s.entity = 'episode' AND e.podcast_id IS NOT NULL AND {predicate}
+GROUP BY e.podcast_id, s.period
+ON CONFLICT (entity, period, entity_id) DO UPDATE SET
+    sessions = excluded.sessions,
+    listen_minutes = excluded.listen_minutes,
+    completion_sum = excluded.completion_sum,
+    revenue = excluded.revenue
+"""
+
+# (entity, period, listener) of the sessions matching {predicate} whose
+# listener is, or is not, premium now.
+_PREMIUM_SQL = """
+INSERT OR IGNORE INTO {target} (entity, entity_id, period, listener_id)
+SELECT DISTINCT '{entity}', {key}, {period}, s.listener_id
+FROM sessions s
+LEFT JOIN listeners l ON s.listener_id = l.listener_id
+LEFT JOIN episodes e ON s.episode_id = e.episode_id
+WHERE {predicate} AND {key} IS NOT NULL AND l.subscription_type {premium}
+"""
+
+# Rank rows by metric value, then minutes, then id; K rows per board.
+_RANK_SQL = """
+INSERT INTO leaderboards (entity, metric, category, period, position, entity_id, value, listen_minutes)
+SELECT entity, '{metric}', category, period, position, entity_id, value, listen_minutes
+FROM (
+    SELECT
+        entity,
+        category,
+        period,
+        entity_id,
+        value,
+        listen_minutes,
+        ROW_NUMBER() OVER (
+            PARTITION BY entity, category, period ORDER BY value DESC, listen_minutes DESC, entity_id
+        ) AS position
+    FROM (
+        SELECT entity, category, period, entity_id, {value} AS value, listen_minutes FROM leaderboard_stats
+        UNION ALL
+        SELECT entity, '{all_categories}', period, entity_id, {value}, listen_minutes FROM leaderboard_stats
+    )
+    WHERE value IS NOT NULL
+)
+WHERE position <= {size}
+"""
+
+
+def _tables_exist(conn):
+    names = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'leaderboard%'")
+    }
+    return set(LEADERBOARD_DDL) <= names
+
+
+def _add_listening(conn, predicate, params=()):
+    for period, group_by in (("s.listen_month", "s.episode_id, s.listen_month"), (f"'{ALL_TIME}'", "s.episode_id")):
+        conn.execute(
+            _LISTENING_SQL.format(period=period, unknown=UNKNOWN, predicate=predicate, group_by=group_by), params
+        )
+
+
+def _count_revenue(conn, predicate):
+    for period, group_by in (("a.month", "a.episode_id, a.month"), (f"'{ALL_TIME}'", "a.episode_id")):
+        conn.execute(
+            _REVENUE_SQL.format(
+                period=period,
+                unknown=UNKNOWN,
+                predicate=f"{predicate} AND {period} != '{UNKNOWN}'",
+                group_by=group_by,
+            )
+        )
+
+
+def _fill_premium(conn, target, predicate, params=(), premium=True):
+    for entity, key in ENTITIES.items():
+        for period in PERIODS:
+            conn.execute(
+                _PREMIUM_SQL.format(
+                    target=target,
+                    entity=entity,
+                    key=key,
+                    period=period,
+                    predicate=predicate,
+                    premium="= 'premium'" if premium else "IS NOT 'premium'",
+                ),
+                params,
+            )
+
+
+def _count_premium(conn, source, sign):
+    """Add ``sign`` x the (entity, period) listeners in ``source`` to the stats.
+
+    Returns the {entity: ids} whose premium listeners changed.
+    """
+    counts = conn.execute(
+        f"SELECT ? * COUNT(*), entity, period, entity_id FROM {source} GROUP BY entity, entity_id, period", (sign,)
+    ).fetchall()
+    conn.executemany(
+        "UPDATE leaderboard_stats SET premium_listeners = premium_listeners + ? "
+        "WHERE entity = ? AND period = ? AND entity_id = ?",
+        counts,
+    )
+    changed = defaultdict(set)
+    for _, entity, _, entity_id in counts:
+        changed[entity].add(entity_id)
+    return changed
+
+
+def _apply_premium(conn, sign):
+    """Count (+1) the listeners in temp.leaderboard_premium not held yet, or
+    uncount (-1) those that are held, and update the held set to match."""
+    conn.execute(
+        f"""
+DELETE FROM temp.leaderboard_premium WHERE {"" if sign > 0 else "NOT "}EXISTS (
+    SELECT 1 FROM leaderboard_premium_listeners m
+    WHERE m.entity = leaderboard_premium.entity AND m.entity_id = leaderboard_premium.entity_id
+      AND m.period = leaderboard_premium.period AND m.listener_id = leaderboard_premium.listener_id
+)
+"""
+    )
+    changed = _count_premium(conn, "temp.leaderboard_premium", sign)
+    if sign > 0:
+        conn.execute("INSERT INTO leaderboard_premium_listeners SELECT * FROM temp.leaderboard_premium")
+    else:
+        conn.executemany(
+            "DELETE FROM leaderboard_premium_listeners "
+            "WHERE entity = ? AND entity_id = ? AND period = ? AND listener_id = ?",
+            conn.execute("SELECT entity, entity_id, period, listener_id FROM temp.leaderboard_premium").fetchall(),
+        )
+    conn.execute("DELETE FROM temp.leaderboard_premium")
+    return changed
+
+
+def _rank_all(conn):
+    conn.execute("DELETE FROM leaderboards")
+    for metric, value in METRICS.items():
+        conn.execute(
+            _RANK_SQL.format(metric=metric, value=value, all_categories=ALL_CATEGORIES, size=LEADERBOARD_SIZE)
+        )
+
+
+def rebuild(conn):
+    for ddl in LEADERBOARD_DDL.values():
+        conn.execute(ddl)
+    conn.execute("DELETE FROM leaderboard_stats")
+    conn.execute("DELETE FROM leaderboard_premium_listeners")
+    _add_listening(conn, "1 = 1")
+    _count_revenue(conn, "1 = 1")
+    conn.execute(_PODCAST_SQL.format(predicate="1 = 1"))
+    _fill_premium(conn, "leaderboard_premium_listeners", "1 = 1")
+    _count_premium(conn, "leaderboard_premium_listeners", 1)
+    _rank_all(conn)
+
+
+def _rank_key(entry):
+    # entry is (entity_id, value, listen_minutes); the order of _RANK_SQL.
+    entity_id, value, listen_minutes = entry
+    return (value, listen_minutes, -entity_id)
+
+
+def _rescan(conn, board):
+    entity, metric, category, period = board
+    scope = "" if category == ALL_CATEGORIES else "AND category = ?"
+    params = (entity, period) if category == ALL_CATEGORIES else (entity, period, category)
+    rows = conn.execute(
+        f"""
+SELECT entity_id, value, listen_minutes
+FROM (SELECT entity_id, {METRICS[metric]} AS value, listen_minutes FROM leaderboard_stats
+      WHERE entity = ? AND period = ? {scope})
+WHERE value IS NOT NULL
+ORDER BY value DESC, listen_minutes DESC, entity_id
+LIMIT {LEADERBOARD_SIZE}
+""",
+        params,
+    ).fetchall()
+    return [tuple(row) for row in rows]
+
+
+def _merge_boards(conn, touched):
+    """Merge the recounted stats of ``touched`` {entity: ids} into the boards."""
+    candidates = defaultdict(list)
+    for entity, ids in touched.items():
+        if not ids:
+            continue
+        marks = ", ".join("?" * len(ids))
+        for metric, value in METRICS.items():
+            rows = conn.execute(
+                f"""
+SELECT category, period, entity_id, {value}, listen_minutes FROM leaderboard_stats
+WHERE entity = ? AND entity_id IN ({marks}) AND {value} IS NOT NULL
+""",
+                (entity, *ids),
+            )
+            for category, period, entity_id, metric_value, listen_minutes in rows:
+                entry = (entity_id, metric_value, listen_minutes)
+                candidates[(entity, metric, category, period)].append(entry)
+                candidates[(entity, metric, ALL_CATEGORIES, period)].append(entry)
+
+    boards = defaultdict(list)
+    for row in conn.execute(
+        "SELECT entity, metric, category, period, entity_id, value, listen_minutes FROM leaderboards ORDER BY position"
+    ):
+        boards[row[:4]].append(tuple(row[4:]))
+
+    # Boards that gained a candidate or listed a touched entity can change.
+    changed = set(candidates)
+    changed.update(
+        board for board, entries in boards.items() if any(entry[0] in touched[board[0]] for entry in entries)
+    )
+    for board in changed:
+        old = boards.get(board, [])
+        kept = [entry for entry in old if entry[0] not in touched[board[0]]]
+        merged = heapq.nlargest(LEADERBOARD_SIZE, kept + candidates.get(board, []), key=_rank_key)
+        if len(old) == LEADERBOARD_SIZE and (
+            len(merged) < LEADERBOARD_SIZE or _rank_key(merged[-1]) < _rank_key(old[-1])
+        ):
+            merged = _rescan(conn, board)
+        conn.execute(
+            "DELETE FROM leaderboards WHERE entity = ? AND metric = ? AND category = ? AND period = ?", board
+        )
+        conn.executemany(
+            "INSERT INTO leaderboards (entity, metric, category, period, position, entity_id, value, listen_minutes) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(*board, position, *entry) for position, entry in enumerate(merged, start=1)],
+        )
+
+
+def refresh(conn, delta):
+    if (
+        delta.full
+        or not _tables_exist(conn)
+        or delta.touched("revenue", "episodes", "podcasts")
+    ):
+        rebuild(conn)
+        return
+
+    conn.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS leaderboard_premium ("
+        "entity TEXT, entity_id INTEGER, period TEXT, listener_id INTEGER, "
+        "PRIMARY KEY (entity, entity_id, period, listener_id))"
+    )
+    for table in ("leaderboard_episodes", "leaderboard_podcasts", "leaderboard_flipped"):
+        conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY)")
+        conn.execute(f"DELETE FROM temp.{table}")
+    conn.execute("DELETE FROM temp.leaderboard_premium")
+
+    touched = {"episode": set(), "podcast": set()}
+    if delta.new_sessions:
+        # New sessions add to their episodes' listening and, through the
+        # attribution split, change their revenue in every month.
+        predicate, params = delta.session_filter
+        conn.execute(
+            f"INSERT OR IGNORE INTO temp.leaderboard_episodes SELECT DISTINCT s.episode_id FROM sessions s WHERE {predicate}",
+            params,
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO temp.leaderboard_podcasts SELECT DISTINCT podcast_id FROM episodes "
+            "WHERE episode_id IN (SELECT id FROM temp.leaderboard_episodes) AND podcast_id IS NOT NULL"
+        )
+        _add_listening(conn, predicate, params)
+        episodes = "a.episode_id IN (SELECT id FROM temp.leaderboard_episodes)"
+        conn.execute(
+            "UPDATE leaderboard_stats SET revenue = 0 "
+            "WHERE entity = 'episode' AND entity_id IN (SELECT id FROM temp.leaderboard_episodes)"
+        )
+        _count_revenue(conn, episodes)
+        # Revenue that sat in the publish month of a first-time listened
+        # episode has moved to its listening months.
+        conn.execute(
+            "DELETE FROM leaderboard_stats WHERE entity = 'episode' AND sessions = 0 "
+            "AND entity_id IN (SELECT id FROM temp.leaderboard_episodes)"
+        )
+        conn.execute(_PODCAST_SQL.format(predicate="e.podcast_id IN (SELECT id FROM temp.leaderboard_podcasts)"))
+        conn.execute(
+            """
+DELETE FROM leaderboard_stats
+WHERE entity = 'podcast' AND entity_id IN (SELECT id FROM temp.leaderboard_podcasts) AND NOT EXISTS (
+    SELECT 1 FROM leaderboard_stats s JOIN episodes e ON s.entity_id = e.episode_id
+    WHERE s.entity = 'episode' AND s.period = leaderboard_stats.period AND e.podcast_id = leaderboard_stats.entity_id
+)
+"""
+        )
+        touched["episode"].update(row[0] for row in conn.execute("SELECT id FROM temp.leaderboard_episodes"))
+        touched["podcast"].update(row[0] for row in conn.execute("SELECT id FROM temp.leaderboard_podcasts"))
+
+    if ingest_delta.changed_listener_count(conn):
+        # Only a subscription change moves a listener in or out of premium;
+        # their held entries are swapped, nothing else is recounted.
+        conn.execute(
+            """
+INSERT INTO temp.leaderboard_flipped
+SELECT c.listener_id FROM temp.listener_changes c
+JOIN listeners l ON c.listener_id = l.listener_id
+WHERE c.subscription_type IS NOT l.subscription_type
+"""
+        )
+        flipped = "s.listener_id IN (SELECT id FROM temp.leaderboard_flipped)"
+        for premium, sign in ((False, -1), (True, 1)):
+            _fill_premium(conn, "temp.leaderboard_premium", flipped, premium=premium)
+            for entity, ids in _apply_premium(conn, sign).items():
+                touched[entity].update(ids)
+
+    if delta.new_sessions:
+        _fill_premium(conn, "temp.leaderboard_premium", predicate, params)
+        for entity, ids in _apply_premium(conn, 1).items():
+            touched[entity].update(ids)
+
+    if touched["episode"] or touched["podcast"]:
+        _merge_boards(conn, touched)
@@ -0,0 +1,126 @@
+"""Per-listener behaviour features, merged from each ingest delta.
+
+Every column is a running count, sum, min or max, so the contribution of new
+sessions is added without revisiting a listener's history; means and rates
+are derived at read time (avg_completion = completion_sum / sessions). Each
+row also records the highest session_id folded into it, which lets
+downstream jobs pick out the listeners that changed since they last ran.
+A full rebuild can reuse the same session ids, so it also bumps
+``listener_features_generation`` in ``warehouse_meta`` for those jobs to
+start over.
+"""
+
+from warehouse import schema
+
+GENERATION_KEY = "listener_features_generation"
+
+DEVICES = ("Mobile", "Tablet", "Desktop")
+PLATFORMS = ("Web", "iOS", "Android")
+
+
+def _mix_column(value):
+    return f"{value.lower()}_sessions"
+
+
+_MIX = [("device", value) for value in DEVICES] + [("platform", value) for value in PLATFORMS]
+_MIX_COLUMNS = [_mix_column(value) for _, value in _MIX]
+
+FEATURES_DDL = """
+CREATE TABLE IF NOT EXISTS listener_features (
+    listener_id INTEGER PRIMARY KEY,
+    sessions INTEGER NOT NULL,
+    listen_minutes INTEGER NOT NULL,
+    completion_sum INTEGER NOT NULL,
+    {mix_columns},
+    first_listen_at TEXT,
+    last_listen_at TEXT,
+    last_session_id INTEGER NOT NULL
+)
+""".format(mix_columns=",\n    ".join(f"{column} INTEGER NOT NULL" for column in _MIX_COLUMNS))
+
+# Means, recency and frequency derived from the running totals. Recency is
+# measured against the latest listen in the warehouse, not the wall clock.
+STATS_VIEW_DDL = """
+CREATE VIEW IF NOT EXISTS listener_feature_stats AS
+SELECT
+    f.*,
+    1.0 * f.completion_sum / f.sessions AS avg_completion,
+    1.0 * f.listen_minutes / f.sessions AS avg_minutes,
+    julianday(latest.listen_at) - julianday(f.last_listen_at) AS recency_days,
+    julianday(f.last_listen_at) - julianday(f.first_listen_at) AS active_span_days,
+    7.0 * f.sessions / MAX(julianday(f.last_listen_at) - julianday(f.first_listen_at), 7.0) AS sessions_per_week
+FROM listener_features f
+CROSS JOIN (SELECT MAX(last_listen_at) AS listen_at FROM listener_features) latest
+"""
+
+INDEX_DDL = (
+    "CREATE INDEX IF NOT EXISTS idx_listener_features_session ON listener_features (last_session_id)",
+)
+
+_MIX_SELECT = ",\n    ".join(
+    f"SUM(CASE WHEN s.{column} = '{value}' THEN 1 ELSE 0 END)" for column, value in _MIX
+)
+_MIX_MERGE = ",\n    ".join(f"{column} = {column} + excluded.{column}" for column in _MIX_COLUMNS)
+
+_MERGE_SQL = f"""
+INSERT INTO listener_features (
+    listener_id, sessions, listen_minutes, completion_sum,
+    {", ".join(_MIX_COLUMNS)},
+    first_listen_at, last_listen_at, last_session_id
+)
+SELECT
+    s.listener_id,
+    COUNT(*),
+    SUM(s.listen_minutes),
+    SUM(s.completion_percent),
+    {_MIX_SELECT},
+    MIN(s.listen_start_time),
+    MAX(s.listen_start_time),
+    MAX(s.session_id)
+FROM sessions s
+WHERE {{predicate}}
+GROUP BY s.listener_id
+ON CONFLICT (listener_id) DO UPDATE SET
+    sessions = sessions + excluded.sessions,
+    listen_minutes = listen_minutes + excluded.listen_minutes,
+    completion_sum = completion_sum + excluded.completion_sum,
+    {_MIX_MERGE},
+    first_listen_at = MIN(first_listen_at, excluded.first_listen_at),
+    last_listen_at = MAX(last_listen_at, excluded.last_listen_at),
+    last_session_id = MAX(last_session_id, excluded.last_session_id)
+"""
+
+
+def _table_exists(conn):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listener_features'"
+    ).fetchone()
+    return row is not None
+
+
+def _merge(conn, predicate, params=()):
+    conn.execute(_MERGE_SQL.format(predicate=predicate), params)
+
+
+def rebuild(conn):
+    conn.execute("DROP TABLE IF EXISTS listener_features")
+    conn.execute(FEATURES_DDL)
+    for ddl in INDEX_DDL:
+        conn.execute(ddl)
+    conn.execute(STATS_VIEW_DDL)
+    _merge(conn, "1 = 1")
+    conn.execute(schema.META_DDL)
+    conn.execute(
+        "INSERT INTO warehouse_meta (key, value) VALUES (?, '1') "
+        "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        (GENERATION_KEY,),
+    )
+
+
+def refresh(conn, delta):
+    if delta.full or not _table_exists(conn):
+        rebuild(conn)
+        return
+    conn.execute(STATS_VIEW_DDL)
+    if delta.new_sessions:
+        _merge(conn, *delta.session_filter)
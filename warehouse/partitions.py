@@ -0,0 +1,219 @@
+"""Monthly partitions of the sessions fact table.
+
+Sessions are stored in one table per listening month (``sessions_2024_01``,
+...) with the columns and indexes of ``schema.TABLE_DDL["sessions"]``, and a
+``sessions`` view unions them so every query written against the single table
+keeps working. Ingest only writes to, and only grows the indexes of, the
+months it receives. ``session_partitions`` records each partition's row count
+and key and time bounds: it answers high-water-mark questions without a scan
+and lets readers route a date range to the partitions it overlaps.
+"""
+
+import re
+
+from warehouse import schema
+
+PARENT = "sessions"
+KEY = "session_id"
+TIME_COLUMN = "listen_start_time"
+
+# Column names of the sessions DDL, generated columns included.
+COLUMNS = re.findall(r"^    (\w+) ", schema.TABLE_DDL[PARENT], re.MULTILINE)
+
+CATALOG_DDL = """
+CREATE TABLE IF NOT EXISTS session_partitions (
+    month TEXT PRIMARY KEY,
+    table_name TEXT NOT NULL UNIQUE,
+    row_count INTEGER NOT NULL,
+    min_session_id INTEGER,
+    max_session_id INTEGER,
+    first_listen_at TEXT,
+    last_listen_at TEXT,
+    compacted_at TEXT,
+    updated_at TEXT NOT NULL
+)
+"""
+
+_PARTITION_GLOB = "sessions_[0-9][0-9][0-9][0-9]_[0-9][0-9]"
+
+
+def partition_table(month):
+    return f"{PARENT}_{month.replace('-', '_')}"
+
+
+def catalog_exists(conn):
+    return schema.table_exists(conn, "session_partitions")
+
+
+def is_partitioned(conn):
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (PARENT,)).fetchone()
+    return row is not None and row[0] == "view"
+
+
+def partition_tables(conn):
+    if not catalog_exists(conn):
+        return []
+    return [row[0] for row in conn.execute("SELECT table_name FROM session_partitions ORDER BY month")]
+
+
+def _create_partition(conn, table):
+    conn.execute(schema.TABLE_DDL[PARENT].replace(f"CREATE TABLE {PARENT} ", f"CREATE TABLE {table} ", 1))
+
+
+def create_indexes(conn, table):
+    for ddl in schema.INDEX_DDL[PARENT]:
+        conn.execute(ddl.replace(f"idx_{PARENT}_", f"idx_{table}_").replace(f" ON {PARENT} ", f" ON {table} "))
+
+
+def rebuild_view(conn):
+    tables = partition_tables(conn)
+    if tables:
+        body = "\nUNION ALL\n".join(f"SELECT * FROM {table}" for table in tables)
+    else:
+        body = "SELECT " + ", ".join(f"NULL AS {column}" for column in COLUMNS) + " LIMIT 0"
+    conn.execute(f"DROP VIEW IF EXISTS {PARENT}")
+    conn.execute(f"CREATE VIEW {PARENT} AS\n{body}")
+
+
+def ensure_parent(conn):
+    conn.execute(CATALOG_DDL)
+    if not is_partitioned(conn):
+        rebuild_view(conn)
+
+
+def ensure_partition(conn, month, indexed=True):
+    """Create the partition for ``month`` if needed; returns (table, created).
+
+    The caller rebuilds the view once it has created all the partitions it
+    needs. Bulk loads pass ``indexed=False`` and index after inserting.
+    """
+    table = partition_table(month)
+    if schema.table_exists(conn, table):
+        return table, False
+    _create_partition(conn, table)
+    if indexed:
+        create_indexes(conn, table)
+    conn.execute(
+        "INSERT INTO session_partitions (month, table_name, row_count, updated_at) VALUES (?, ?, 0, datetime('now'))",
+        (month, table),
+    )
+    return table, True
+
+
+def record_rows(conn, month, rows, min_key, max_key, first_listen_at, last_listen_at):
+    """Fold the bounds of rows just inserted into a partition's catalog entry."""
+    conn.execute(
+        """
+UPDATE session_partitions SET
+    row_count = row_count + ?,
+    min_session_id = MIN(COALESCE(min_session_id, ?), ?),
+    max_session_id = MAX(COALESCE(max_session_id, ?), ?),
+    first_listen_at = MIN(COALESCE(first_listen_at, ?), ?),
+    last_listen_at = MAX(COALESCE(last_listen_at, ?), ?),
+    compacted_at = NULL,
+    updated_at = datetime('now')
+WHERE month = ?
+""",
+        (rows, min_key, min_key, max_key, max_key, first_listen_at, first_listen_at, last_listen_at, last_listen_at, month),
+    )
+
+
+def _record_table(conn, month):
+    table = partition_table(month)
+    stats = conn.execute(
+        f"SELECT COUNT(*), MIN({KEY}), MAX({KEY}), MIN({TIME_COLUMN}), MAX({TIME_COLUMN}) FROM {table}"
+    ).fetchone()
+    conn.execute(
+        """
+UPDATE session_partitions SET
+    row_count = ?, min_session_id = ?, max_session_id = ?,
+    first_listen_at = ?, last_listen_at = ?, updated_at = datetime('now')
+WHERE month = ?
+""",
+        (*stats, month),
+    )
+
+
+def max_session_id(conn):
+    if not catalog_exists(conn):
+        return None
+    return conn.execute("SELECT MAX(max_session_id) FROM session_partitions").fetchone()[0]
+
+
+def last_listen_at(conn):
+    if not catalog_exists(conn):
+        return None
+    return conn.execute("SELECT MAX(last_listen_at) FROM session_partitions").fetchone()[0]
+
+
+def drop_all(conn):
+    """Remove the view, every partition and the catalog (or a pre-partitioning table)."""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (PARENT,)).fetchone()
+    if row is not None:
+        conn.execute(f"DROP {row[0].upper()} {PARENT}")
+    tables = [
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?", (_PARTITION_GLOB,))
+    ]
+    for table in tables:
+        conn.execute(f"DROP TABLE {table}")
+    conn.execute("DROP TABLE IF EXISTS session_partitions")
+    conn.execute(CATALOG_DDL)
+
+
+def partition_existing(conn):
+    """Split an unpartitioned sessions table into monthly partitions in place."""
+    legacy = f"{PARENT}__unpartitioned"
+    conn.execute(f"ALTER TABLE {PARENT} RENAME TO {legacy}")
+    conn.execute(CATALOG_DDL)
+    columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA table_info({legacy})"))
+    months = [
+        row[0]
+        for row in conn.execute(f"SELECT DISTINCT substr({TIME_COLUMN}, 1, 7) FROM {legacy} ORDER BY 1")
+    ]
+    for month in months:
+        table, _ = ensure_partition(conn, month, indexed=False)
+        conn.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy} "
+            f"WHERE substr({TIME_COLUMN}, 1, 7) = ? ORDER BY {KEY}",
+            (month,),
+        )
+        create_indexes(conn, table)
+        _record_table(conn, month)
+    conn.execute(f"DROP TABLE {legacy}")
+    rebuild_view(conn)
+    return months
+
+
+def compact(conn, before_month):
+    """Rewrite partitions older than ``before_month`` into freshly packed pages.
+
+    Each partition is copied in key order, re-indexed and swapped in, so its
+    table and index b-trees are dense again after incremental appends. Recent
+    partitions are not read or written; already compacted ones are skipped.
+    """
+    months = [
+        row[0]
+        for row in conn.execute(
+            "SELECT month FROM session_partitions WHERE month < ? AND compacted_at IS NULL ORDER BY month",
+            (before_month,),
+        )
+    ]
+    # The view keeps naming the partition while it is swapped; legacy mode
+    # stops the rename from re-checking the view against a dropped table.
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    for month in months:
+        table = partition_table(month)
+        staging = f"{table}__compact"
+        conn.execute(f"DROP TABLE IF EXISTS {staging}")
+        _create_partition(conn, staging)
+        columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA table_info({table})"))
+        conn.execute(f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM {table} ORDER BY {KEY}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+        create_indexes(conn, table)
+        conn.execute(f"ANALYZE {table}")
+        _record_table(conn, month)
+        conn.execute("UPDATE session_partitions SET compacted_at = datetime('now') WHERE month = ?", (month,))
+    conn.execute("PRAGMA legacy_alter_table = OFF")
+    return months
@@ -0,0 +1,25 @@
+"""Keeps the derived warehouse tables in step with each ingest run."""
+
+from warehouse import attribution, catalog, leaderboards, listener_features, retention, rollups, sketches
+
+# Each refresher with the tables it maintains, in dependency order.
+REFRESHERS = (
+    (rollups, tuple(rollups.ROLLUP_DDL)),
+    (attribution, ("revenue_attribution",)),
+    (listener_features, ("listener_features",)),
+    (sketches, tuple(sketches.SKETCH_DDL)),
+    (retention, tuple(retention.RETENTION_DDL)),
+    (leaderboards, tuple(leaderboards.LEADERBOARD_DDL)),
+)
+
+
+def refresh_derived(conn, delta):
+    """Bring every derived table up to date; runs inside the ingest transaction."""
+    for module, tables in REFRESHERS:
+        changes = conn.total_changes
+        module.refresh(conn, delta)
+        if conn.total_changes != changes:
+            delta.written.update(tables)
+    # Last, so the statistics describe the refreshed derived tables too; it
+    # only re-profiles the derived tables recorded in delta.written.
+    catalog.refresh(conn, delta)
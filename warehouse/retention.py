@@ -0,0 +1,147 @@
+"""Signup-cohort retention counts that the Retention page reads.
+
+``retention_cohorts`` counts the distinct listeners of each signup month who
+listened in each activity month, split by country and subscription_type.
+Every listener lands in exactly one cell per month they were active, so the
+cells add up across countries, subscriptions and cohorts, and a retention
+matrix for any slice is a small GROUP BY. ``retention_cohort_sizes`` holds
+the matching cohort sizes. Incremental runs recount only the activity months
+that received sessions; listeners whose cohort, country or subscription
+changed have their earlier months moved to the new cell.
+"""
+
+from warehouse import delta as ingest_delta
+
+UNKNOWN = "Unknown"
+
+RETENTION_DDL = {
+    "retention_cohorts": """
+CREATE TABLE IF NOT EXISTS retention_cohorts (
+    cohort_month TEXT NOT NULL,
+    activity_month TEXT NOT NULL,
+    country TEXT NOT NULL,
+    subscription_type TEXT NOT NULL,
+    listeners INTEGER NOT NULL,
+    PRIMARY KEY (cohort_month, activity_month, country, subscription_type)
+) WITHOUT ROWID
+""",
+    "retention_cohort_sizes": """
+CREATE TABLE IF NOT EXISTS retention_cohort_sizes (
+    cohort_month TEXT NOT NULL,
+    country TEXT NOT NULL,
+    subscription_type TEXT NOT NULL,
+    listeners INTEGER NOT NULL,
+    PRIMARY KEY (cohort_month, country, subscription_type)
+) WITHOUT ROWID
+""",
+}
+
+# Listeners without a signup date belong to no cohort and are left out.
+_COUNT_MONTHS_SQL = """
+INSERT INTO retention_cohorts (cohort_month, activity_month, country, subscription_type, listeners)
+SELECT
+    substr(l.signup_date, 1, 7),
+    s.listen_month,
+    COALESCE(l.country, '{unknown}'),
+    COALESCE(l.subscription_type, '{unknown}'),
+    COUNT(DISTINCT s.listener_id)
+FROM sessions s
+JOIN listeners l ON s.listener_id = l.listener_id
+WHERE l.signup_date IS NOT NULL AND {predicate}
+GROUP BY 1, 2, 3, 4
+"""
+
+# Adds (sign=1) or removes (sign=-1) one listener-month per distinct month
+# the selected listeners were active in, under the attributes in {listeners}.
+_MOVE_SQL = """
+INSERT INTO retention_cohorts (cohort_month, activity_month, country, subscription_type, listeners)
+SELECT
+    substr(l.signup_date, 1, 7),
+    a.listen_month,
+    COALESCE(l.country, '{unknown}'),
+    COALESCE(l.subscription_type, '{unknown}'),
+    {sign} * COUNT(*)
+FROM (SELECT DISTINCT s.listener_id, s.listen_month FROM sessions s WHERE {predicate}) a
+JOIN {listeners} l ON a.listener_id = l.listener_id
+WHERE l.signup_date IS NOT NULL
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (cohort_month, activity_month, country, subscription_type) DO UPDATE SET
+    listeners = listeners + excluded.listeners
+"""
+
+_SIZES_SQL = """
+INSERT INTO retention_cohort_sizes (cohort_month, country, subscription_type, listeners)
+SELECT
+    substr(signup_date, 1, 7),
+    COALESCE(country, '{unknown}'),
+    COALESCE(subscription_type, '{unknown}'),
+    COUNT(*)
+FROM listeners
+WHERE signup_date IS NOT NULL
+GROUP BY 1, 2, 3
+"""
+
+
+def _tables_exist(conn):
+    names = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'retention_%'")
+    }
+    return set(RETENTION_DDL) <= names
+
+
+def _count_months(conn, touched_only=False):
+    if not touched_only:
+        conn.execute("DELETE FROM retention_cohorts")
+        predicate = "1 = 1"
+    else:
+        conn.execute("DELETE FROM retention_cohorts WHERE activity_month IN (SELECT month FROM temp.retention_months)")
+        predicate = "s.listen_month IN (SELECT month FROM temp.retention_months)"
+    conn.execute(_COUNT_MONTHS_SQL.format(unknown=UNKNOWN, predicate=predicate))
+
+
+def _count_sizes(conn):
+    conn.execute("DELETE FROM retention_cohort_sizes")
+    conn.execute(_SIZES_SQL.format(unknown=UNKNOWN))
+
+
+def rebuild(conn):
+    for ddl in RETENTION_DDL.values():
+        conn.execute(ddl)
+    _count_months(conn)
+    _count_sizes(conn)
+
+
+def refresh(conn, delta):
+    if delta.full or not _tables_exist(conn):
+        rebuild(conn)
+        return
+
+    moved_listeners = ingest_delta.changed_listener_count(conn)
+    if delta.touched("listeners"):
+        _count_sizes(conn)
+
+    if moved_listeners:
+        # Months active before this run: each moves from the listener's old
+        # cell to the new one. Months with new sessions are recounted below.
+        old_history = "s.listener_id IN (SELECT listener_id FROM temp.listener_changes)"
+        params = ()
+        if delta.previous_max_session_id is not None:
+            old_history += " AND s.session_id <= ?"
+            params = (delta.previous_max_session_id,)
+        for sign, listeners in ((-1, "temp.listener_changes"), (1, "listeners")):
+            sql = _MOVE_SQL.format(unknown=UNKNOWN, sign=sign, listeners=listeners, predicate=old_history)
+            conn.execute(sql, params)
+        conn.execute("DELETE FROM retention_cohorts WHERE listeners = 0")
+
+    if delta.new_sessions:
+        # A new session may or may not be a listener's first in its month, so
+        # the months it falls in are recounted rather than incremented.
+        predicate, params = delta.session_filter
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS retention_months (month TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.retention_months")
+        conn.execute(
+            f"INSERT OR IGNORE INTO temp.retention_months SELECT DISTINCT s.listen_month FROM sessions s WHERE {predicate}",
+            params,
+        )
+        _count_months(conn, touched_only=True)
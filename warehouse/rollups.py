@@ -0,0 +1,161 @@
+"""Daily and monthly listening aggregates that the dashboards read.
+
+Both tables are keyed by category x country x platform x subscription_type,
+so every page breakdown is a small GROUP BY over the rollup instead of a scan
+of the raw sessions. The daily table is maintained additively from each
+ingest delta; the monthly table is re-derived from it for touched months.
+"""
+
+from warehouse import delta as ingest_delta
+
+UNKNOWN = "Unknown"
+DIMENSIONS = ("category", "country", "platform", "subscription_type")
+
+ROLLUP_DDL = {
+    "rollup_daily_listening": """
+CREATE TABLE IF NOT EXISTS rollup_daily_listening (
+    day TEXT NOT NULL,
+    category TEXT NOT NULL,
+    country TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    subscription_type TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    listen_minutes INTEGER NOT NULL,
+    completion_sum INTEGER NOT NULL,
+    PRIMARY KEY (day, category, country, platform, subscription_type)
+) WITHOUT ROWID
+""",
+    "rollup_monthly_listening": """
+CREATE TABLE IF NOT EXISTS rollup_monthly_listening (
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    country TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    subscription_type TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    listen_minutes INTEGER NOT NULL,
+    completion_sum INTEGER NOT NULL,
+    PRIMARY KEY (month, category, country, platform, subscription_type)
+) WITHOUT ROWID
+""",
+}
+
+# Adds (sign=1) or removes (sign=-1) the contribution of the selected sessions.
+# {listeners} is either the live table or temp.listener_changes, which holds
+# the attributes listeners had before this run's upsert.
+_MERGE_DAILY_SQL = """
+INSERT INTO rollup_daily_listening (
+    day, category, country, platform, subscription_type, sessions, listen_minutes, completion_sum
+)
+SELECT
+    substr(s.listen_start_time, 1, 10) AS day,
+    COALESCE(p.category, '{unknown}'),
+    COALESCE(l.country, '{unknown}'),
+    COALESCE(s.platform, '{unknown}'),
+    COALESCE(l.subscription_type, '{unknown}'),
+    {sign} * COUNT(*),
+    {sign} * SUM(s.listen_minutes),
+    {sign} * SUM(s.completion_percent)
+FROM sessions s
+LEFT JOIN {listeners} l ON s.listener_id = l.listener_id
+LEFT JOIN episodes e ON s.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE {predicate}
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (day, category, country, platform, subscription_type) DO UPDATE SET
+    sessions = sessions + excluded.sessions,
+    listen_minutes = listen_minutes + excluded.listen_minutes,
+    completion_sum = completion_sum + excluded.completion_sum
+"""
+
+
+def _tables_exist(conn):
+    names = {
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'rollup_%'"
+        )
+    }
+    return set(ROLLUP_DDL) <= names
+
+
+def _merge_daily(conn, predicate, params=(), sign=1, listeners="listeners"):
+    sql = _MERGE_DAILY_SQL.format(
+        unknown=UNKNOWN, sign=sign, listeners=listeners, predicate=predicate
+    )
+    conn.execute(sql, params)
+
+
+def _rebuild_monthly(conn, touched_only=False):
+    if not touched_only:
+        conn.execute("DELETE FROM rollup_monthly_listening")
+        month_filter = ""
+    else:
+        conn.execute("DELETE FROM rollup_monthly_listening WHERE month IN (SELECT month FROM temp.rollup_months)")
+        month_filter = "WHERE substr(day, 1, 7) IN (SELECT month FROM temp.rollup_months)"
+    conn.execute(
+        f"""
+INSERT INTO rollup_monthly_listening (
+    month, category, country, platform, subscription_type, sessions, listen_minutes, completion_sum
+)
+SELECT
+    substr(day, 1, 7), category, country, platform, subscription_type,
+    SUM(sessions), SUM(listen_minutes), SUM(completion_sum)
+FROM rollup_daily_listening
+{month_filter}
+GROUP BY 1, 2, 3, 4, 5
+"""
+    )
+
+
+def rebuild(conn):
+    for ddl in ROLLUP_DDL.values():
+        conn.execute(ddl)
+    conn.execute("DELETE FROM rollup_daily_listening")
+    _merge_daily(conn, "1 = 1")
+    _rebuild_monthly(conn)
+
+
+def refresh(conn, delta):
+    # Category changes re-slice large parts of history; they are rare enough
+    # that a rebuild from sessions is the simpler correct answer.
+    if delta.full or not _tables_exist(conn) or delta.touched("podcasts", "episodes"):
+        rebuild(conn)
+        return
+
+    moved_listeners = ingest_delta.changed_listener_count(conn)
+    if not delta.new_sessions and not moved_listeners:
+        return
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS rollup_months (month TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.rollup_months")
+
+    if delta.new_sessions:
+        predicate, params = delta.session_filter
+        conn.execute(
+            f"INSERT OR IGNORE INTO temp.rollup_months SELECT DISTINCT s.listen_month FROM sessions s WHERE {predicate}",
+            params,
+        )
+
+    if moved_listeners:
+        # Move the pre-existing history of re-attributed listeners from their
+        # old country/subscription slice to the new one. New sessions are
+        # merged below with the current attributes.
+        old_history = "s.listener_id IN (SELECT listener_id FROM temp.listener_changes)"
+        old_params = ()
+        if delta.previous_max_session_id is not None:
+            old_history += " AND s.session_id <= ?"
+            old_params = (delta.previous_max_session_id,)
+        conn.execute(
+            f"INSERT OR IGNORE INTO temp.rollup_months SELECT DISTINCT s.listen_month FROM sessions s WHERE {old_history}",
+            old_params,
+        )
+        _merge_daily(conn, old_history, old_params, sign=-1, listeners="temp.listener_changes")
+        _merge_daily(conn, old_history, old_params)
+
+    if delta.new_sessions:
+        predicate, params = delta.session_filter
+        _merge_daily(conn, predicate, params)
+
+    conn.execute("DELETE FROM rollup_daily_listening WHERE sessions = 0")
+    _rebuild_monthly(conn, touched_only=True)
@@ -0,0 +1,200 @@
+"""Warehouse DDL, indexes and in-place migration of older databases."""
+
+# Bumped whenever the DDL below changes; stored in PRAGMA user_version.
+SCHEMA_VERSION = 3
+
+# SQLite has no timestamp type: listen_start_time keeps the canonical ISO-8601
+# text form that its date functions understand and that sorts chronologically,
+# and the CHECK rejects anything else. The month used by every trend query is
+# a generated column so it can be indexed instead of recomputed per row.
+TABLE_DDL = {
+    "podcasts": """
+CREATE TABLE podcasts (
+    podcast_id INTEGER PRIMARY KEY,
+    podcast_name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    language TEXT,
+    launch_date TEXT
+)
+""",
+    "episodes": """
+CREATE TABLE episodes (
+    episode_id INTEGER PRIMARY KEY,
+    podcast_id INTEGER NOT NULL REFERENCES podcasts (podcast_id),
+    episode_title TEXT NOT NULL,
+    publish_date TEXT,
+    duration_minutes INTEGER,
+    guest_type TEXT
+)
+""",
+    "listeners": """
+CREATE TABLE listeners (
+    listener_id INTEGER PRIMARY KEY,
+    country TEXT,
+    age_group TEXT,
+    gender TEXT,
+    subscription_type TEXT NOT NULL,
+    signup_date TEXT
+)
+""",
+    "sessions": """
+CREATE TABLE sessions (
+    session_id INTEGER PRIMARY KEY,
+    listener_id INTEGER NOT NULL REFERENCES listeners (listener_id),
+    episode_id INTEGER NOT NULL REFERENCES episodes (episode_id),
+    listen_start_time TEXT NOT NULL CHECK (
+        listen_start_time GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'
+    ),
+    listen_month TEXT GENERATED ALWAYS AS (substr(listen_start_time, 1, 7)) VIRTUAL,
+    listen_minutes INTEGER NOT NULL,
+    completion_percent INTEGER NOT NULL CHECK (completion_percent BETWEEN 0 AND 100),
+    device TEXT,
+    platform TEXT
+)
+""",
+    "revenue": """
+CREATE TABLE revenue (
+    episode_id INTEGER PRIMARY KEY REFERENCES episodes (episode_id),
+    ads_shown INTEGER,
+    ads_clicked INTEGER,
+    revenue_generated REAL NOT NULL
+)
+""",
+}
+
+# Indexes for the dashboard joins and GROUP BYs. The listener and episode
+# indexes carry every sessions column their queries read, so those aggregates
+# walk the narrower index instead of the table. Sessions are stored in monthly
+# partitions (warehouse/partitions.py); each partition gets its own copy of
+# the sessions indexes.
+INDEX_DDL = {
+    "sessions": (
+        # monthly listening trends: rows arrive grouped, no temp B-tree sort
+        "CREATE INDEX IF NOT EXISTS idx_sessions_month "
+        "ON sessions (listen_month, listen_minutes, completion_percent)",
+        # date range predicates
+        "CREATE INDEX IF NOT EXISTS idx_sessions_start ON sessions (listen_start_time)",
+        # KPI, country and platform breakdowns joined to listeners
+        "CREATE INDEX IF NOT EXISTS idx_sessions_listener "
+        "ON sessions (listener_id, platform, listen_minutes, completion_percent)",
+        # category and episode breakdowns joined to episodes/podcasts; also
+        # streams the listener x episode x platform grain of the executive
+        # grouping sets already in GROUP BY order
+        "CREATE INDEX IF NOT EXISTS idx_sessions_episode_listener "
+        "ON sessions (episode_id, listener_id, platform, listen_minutes, completion_percent)",
+    ),
+    "episodes": ("CREATE INDEX IF NOT EXISTS idx_episodes_podcast ON episodes (podcast_id)",),
+    "podcasts": ("CREATE INDEX IF NOT EXISTS idx_podcasts_category ON podcasts (category)",),
+    "listeners": (
+        "CREATE INDEX IF NOT EXISTS idx_listeners_country ON listeners (country, subscription_type)",
+        "CREATE INDEX IF NOT EXISTS idx_listeners_subscription "
+        "ON listeners (subscription_type, signup_date)",
+    ),
+    "revenue": (),
+}
+
+
+# Key/value metadata shared by ingest and the app. data_version is bumped by
+# every ingest run so the dashboards' result cache never serves stale frames.
+META_DDL = """
+CREATE TABLE IF NOT EXISTS warehouse_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+"""
+
+
+# Indexes superseded by a later schema version; dropped when migrating.
+RETIRED_INDEXES = ("idx_sessions_episode",)
+
+
+def table_exists(conn, table):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def create_table(conn, table):
+    conn.execute(TABLE_DDL[table])
+
+
+def create_indexes(conn, tables=None):
+    for table in tables or TABLE_DDL:
+        for ddl in INDEX_DDL[table]:
+            conn.execute(ddl)
+
+
+def _columns(conn, table):
+    # table_info leaves out generated columns, which cannot be inserted into.
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _rebuild_tables(conn):
+    # Keep REFERENCES clauses in other tables pointing at the real table name
+    # while the old copy is renamed out of the way.
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    rebuilt = []
+    for table in TABLE_DDL:
+        if not table_exists(conn, table):
+            continue
+        legacy = f"{table}__legacy"
+        conn.execute(f"DROP TABLE IF EXISTS {legacy}")
+        conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        create_table(conn, table)
+        legacy_columns = set(_columns(conn, legacy))
+        columns = ", ".join(c for c in _columns(conn, table) if c in legacy_columns)
+        conn.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy}")
+        conn.execute(f"DROP TABLE {legacy}")
+        rebuilt.append(table)
+    conn.execute("PRAGMA legacy_alter_table = OFF")
+    return rebuilt
+
+
+def migrate(conn):
+    """Upgrade a database written by an older loader in place.
+
+    Version 0 (tables created by DataFrame.to_sql) has every table moved
+    aside, recreated from TABLE_DDL and refilled, so existing rows survive.
+    Version 2 swaps indexes, and version 3 splits sessions into monthly
+    partitions. Planner statistics are refreshed and the schema version is
+    stamped. Must run inside the caller's transaction.
+    """
+    # partitions builds on this module's DDL.
+    from warehouse import partitions
+
+    version = schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return []
+
+    if version < 1:
+        _rebuild_tables(conn)
+    for index in RETIRED_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {index}")
+    partitioned = []
+    if version < 3 and table_exists(conn, partitions.PARENT):
+        partitions.partition_existing(conn)
+        partitioned = [partitions.PARENT]
+
+    # Partitioned sessions are a view by now and are indexed per partition.
+    existing = [table for table in TABLE_DDL if table_exists(conn, table)]
+    if existing:
+        create_indexes(conn, existing)
+    if existing or partitioned:
+        conn.execute("ANALYZE")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return existing + partitioned
+
+
+def bump_data_version(conn):
+    conn.execute(META_DDL)
+    conn.execute(
+        """
+INSERT INTO warehouse_meta (key, value) VALUES ('data_version', '1')
+ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+"""
+    )
@@ -0,0 +1,338 @@
+"""HyperLogLog sketches of the listeners behind every slice of sessions.
+
+``reach_sketches`` holds one sparse HyperLogLog per day x category x episode
+x country x platform x subscription_type cell: a row per non-empty register
+with the highest rank any of the cell's listeners reached there. Sketches
+merge by taking the per-register maximum, so the distinct listeners of any
+combination of cells is a ``GROUP BY register`` away and never needs the raw
+sessions. The merge is idempotent, which lets incremental runs re-fold
+overlapping sessions freely.
+
+Coarser grains (``SKETCH_GRAINS``) hold the same registers pre-merged for
+all time, per category, per platform, or per country and subscription only.
+They are a deliberate storage-for-latency trade-off: together about a third
+of the finest grain's size, for unfiltered reach reads several times faster.
+Each is merged from a finer grain, so a re-attributed listener's cells are
+rebuilt from registers rather than from sessions.
+
+Each listener's register and rank are hashed once into
+``reach_sketch_hashes``. The precision is picked from the target relative
+error (``PODCAST_BI_SKETCH_ERROR``, default 1%) and recorded in
+``warehouse_meta``; changing it rebuilds the sketches.
+"""
+
+import math
+import os
+
+import numpy as np
+
+from warehouse import delta as ingest_delta
+from warehouse import schema
+
+UNKNOWN = "Unknown"
+
+SKETCH_ERROR = float(os.environ.get("PODCAST_BI_SKETCH_ERROR", "0.01"))
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+# Every grain keeps one sparse sketch per cell. reach_sketches is the finest;
+# the others are pre-merged from the grain named next to them. A listener
+# has a single country and subscription, so those never split a listener's
+# registers: only dropping the day, episode, platform or category makes a
+# grain smaller. Each extra grain trades storage for latency, so only the
+# all-time grains the unfiltered dashboard reads are kept. Date-filtered
+# reads seek the finest grain by day, which a monthly grain barely beat, and
+# per-episode cells without the day are nearly as many as with it.
+SKETCH_GRAINS = {
+    "reach_sketches": (("day", "category", "episode_id", "country", "platform", "subscription_type"), None),
+    "reach_sketches_category": (("country", "subscription_type", "category"), "reach_sketches"),
+    "reach_sketches_platform": (("country", "subscription_type", "platform"), "reach_sketches"),
+    "reach_sketches_audience": (("country", "subscription_type"), "reach_sketches_platform"),
+}
+
+# Grains that were measured and dropped; removed from databases that have them.
+RETIRED_GRAINS = ("reach_sketches_monthly", "reach_sketches_episode", "reach_sketches_category_platform")
+
+# Each cell column as computed from sessions joined to listeners, episodes
+# and podcasts.
+CELL_COLUMNS = {
+    "day": "substr(s.listen_start_time, 1, 10)",
+    "category": f"COALESCE(p.category, '{UNKNOWN}')",
+    "episode_id": "s.episode_id",
+    "country": f"COALESCE(l.country, '{UNKNOWN}')",
+    "platform": f"COALESCE(s.platform, '{UNKNOWN}')",
+    "subscription_type": f"COALESCE(l.subscription_type, '{UNKNOWN}')",
+}
+
+
+def _grain_ddl(table, cells):
+    columns = "".join(
+        f"    {column} {'INTEGER' if column == 'episode_id' else 'TEXT'} NOT NULL,\n" for column in cells
+    )
+    return f"""
+CREATE TABLE IF NOT EXISTS {table} (
+{columns}    register INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    PRIMARY KEY ({', '.join(cells)}, register)
+) WITHOUT ROWID
+"""
+
+
+SKETCH_DDL = {
+    "reach_sketch_hashes": """
+CREATE TABLE IF NOT EXISTS reach_sketch_hashes (
+    listener_id INTEGER PRIMARY KEY,
+    register INTEGER NOT NULL,
+    rank INTEGER NOT NULL
+)
+""",
+    **{table: _grain_ddl(table, cells) for table, (cells, _) in SKETCH_GRAINS.items()},
+}
+
+# Folds the selected sessions into one grain.
+_MERGE_SQL = """
+INSERT INTO {table} ({cells}, register, rank)
+SELECT {columns}, h.register, MAX(h.rank)
+FROM sessions s
+JOIN reach_sketch_hashes h ON s.listener_id = h.listener_id
+LEFT JOIN listeners l ON s.listener_id = l.listener_id
+LEFT JOIN episodes e ON s.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE {predicate}
+GROUP BY {positions}
+ON CONFLICT ({cells}, register) DO UPDATE SET
+    rank = MAX(rank, excluded.rank)
+"""
+
+# Merges the finer grain's registers into the selected cells of a coarser one.
+_ROLL_UP_SQL = """
+INSERT INTO {table} ({cells}, register, rank)
+SELECT {columns}, register, MAX(rank)
+FROM {parent}
+WHERE {predicate}
+GROUP BY {positions}
+ON CONFLICT ({cells}, register) DO UPDATE SET
+    rank = MAX(rank, excluded.rank)
+"""
+
+# The cells of a coarser grain that re-attributed listeners appear in, under
+# both their old and their current country and subscription.
+_MOVED_CELLS_SQL = """
+CREATE TEMP TABLE reach_moved_cells AS
+SELECT DISTINCT {columns}
+FROM sessions s
+JOIN (
+    SELECT listener_id, country, subscription_type FROM temp.reach_moved
+    UNION ALL
+    SELECT listener_id, country, subscription_type FROM listeners
+    WHERE listener_id IN (SELECT listener_id FROM temp.reach_moved)
+) l ON s.listener_id = l.listener_id
+LEFT JOIN episodes e ON s.episode_id = e.episode_id
+LEFT JOIN podcasts p ON e.podcast_id = p.podcast_id
+WHERE s.listener_id IN (SELECT listener_id FROM temp.reach_moved)
+"""
+
+
+def precision_for_error(error):
+    # HyperLogLog's relative standard error is 1.04 / sqrt(2 ** precision).
+    precision = math.ceil(math.log2((1.04 / error) ** 2))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+
+def stored_precision(conn):
+    if not schema.table_exists(conn, "warehouse_meta"):
+        return None
+    row = conn.execute("SELECT value FROM warehouse_meta WHERE key = 'sketch_precision'").fetchone()
+    return int(row[0]) if row else None
+
+
+def _mix64(values):
+    # splitmix64 finalizer: listener ids are dense integers, so they need a
+    # well-mixed 64-bit hash before their bits can pick registers.
+    z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def register_ranks(listener_ids, precision):
+    """Register (top ``precision`` bits) and rank (leading zeros + 1 of the rest)."""
+    return hash_ranks(_mix64(np.asarray(listener_ids, dtype=np.int64)), precision)
+
+
+def hash_ranks(hashed, precision):
+    """register_ranks for values already hashed to well-mixed uint64."""
+    hashed = np.asarray(hashed, dtype=np.uint64)
+    registers = hashed >> np.uint64(64 - precision)
+    rest = hashed << np.uint64(precision)
+    bit_length = np.zeros(len(rest), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = (rest >> np.uint64(shift)) > 0
+        rest[wide] >>= np.uint64(shift)
+        bit_length[wide] += shift
+    bit_length += rest > 0
+    ranks = np.minimum(64 - bit_length + 1, 64 - precision + 1)
+    return registers.astype(np.int64), ranks
+
+
+def dense_estimate(ranks):
+    """Distinct count from a dense array holding every register's rank (0 if empty).
+
+    Small cardinalities, where empty registers remain, use linear counting.
+    """
+    m = len(ranks)
+    empty = int(np.count_nonzero(ranks == 0))
+    raw = 0.7213 / (1 + 1.079 / m) * m * m / float(np.sum(2.0 ** -np.asarray(ranks, dtype=float)))
+    if raw <= 2.5 * m and empty:
+        return int(round(m * math.log(m / empty)))
+    return int(round(raw))
+
+
+def _hash_listeners(conn, predicate, params, precision):
+    listener_ids = [
+        row[0]
+        for row in conn.execute(
+            f"""
+SELECT DISTINCT s.listener_id FROM sessions s
+WHERE {predicate} AND s.listener_id NOT IN (SELECT listener_id FROM reach_sketch_hashes)
+""",
+            params,
+        )
+    ]
+    if not listener_ids:
+        return
+    registers, ranks = register_ranks(listener_ids, precision)
+    conn.executemany(
+        "INSERT INTO reach_sketch_hashes (listener_id, register, rank) VALUES (?, ?, ?)",
+        zip(listener_ids, registers.tolist(), ranks.tolist()),
+    )
+
+
+def _positions(cells):
+    return ", ".join(str(position) for position in range(1, len(cells) + 2))
+
+
+def _merge(conn, table, predicate, params=()):
+    cells, _ = SKETCH_GRAINS[table]
+    columns = ", ".join(CELL_COLUMNS[cell] for cell in cells)
+    conn.execute(
+        _MERGE_SQL.format(
+            table=table, cells=", ".join(cells), columns=columns, positions=_positions(cells), predicate=predicate
+        ),
+        params,
+    )
+
+
+def _roll_up(conn, table, cells_table=None):
+    cells, parent = SKETCH_GRAINS[table]
+    columns = ", ".join(cells)
+    predicate = f"({columns}) IN (SELECT {columns} FROM {cells_table})" if cells_table else "1 = 1"
+    conn.execute(
+        _ROLL_UP_SQL.format(
+            table=table,
+            cells=", ".join(cells),
+            columns=columns,
+            positions=_positions(cells),
+            parent=parent,
+            predicate=predicate,
+        )
+    )
+
+
+def _move_listeners(conn):
+    # A listener cannot be taken back out of a register, so every cell a
+    # re-attributed listener appeared in is dropped and re-sketched: the
+    # finest grain from sessions under the listeners' current attributes,
+    # each coarser grain from its already corrected parent.
+    conn.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS reach_cells (day TEXT, episode_id INTEGER, PRIMARY KEY (day, episode_id))"
+    )
+    conn.execute("DELETE FROM temp.reach_cells")
+    conn.execute(
+        """
+INSERT OR IGNORE INTO temp.reach_cells
+SELECT DISTINCT substr(s.listen_start_time, 1, 10), s.episode_id FROM sessions s
+WHERE s.listener_id IN (SELECT listener_id FROM temp.reach_moved)
+"""
+    )
+    conn.execute(
+        "DELETE FROM reach_sketches WHERE (day, episode_id) IN (SELECT day, episode_id FROM temp.reach_cells)"
+    )
+    _merge(
+        conn,
+        "reach_sketches",
+        "s.episode_id IN (SELECT episode_id FROM temp.reach_cells) "
+        "AND (substr(s.listen_start_time, 1, 10), s.episode_id) IN (SELECT day, episode_id FROM temp.reach_cells)",
+    )
+    for table, (cells, parent) in SKETCH_GRAINS.items():
+        if parent is None:
+            continue
+        conn.execute("DROP TABLE IF EXISTS temp.reach_moved_cells")
+        conn.execute(_MOVED_CELLS_SQL.format(columns=", ".join(f"{CELL_COLUMNS[cell]} AS {cell}" for cell in cells)))
+        conn.execute(
+            f"DELETE FROM {table} WHERE ({', '.join(cells)}) IN (SELECT {', '.join(cells)} FROM temp.reach_moved_cells)"
+        )
+        _roll_up(conn, table, "temp.reach_moved_cells")
+    conn.execute("DROP TABLE temp.reach_moved_cells")
+
+
+def rebuild(conn, precision=None):
+    precision = precision or precision_for_error(SKETCH_ERROR)
+    for ddl in SKETCH_DDL.values():
+        conn.execute(ddl)
+    for table in SKETCH_DDL:
+        conn.execute(f"DELETE FROM {table}")
+    _hash_listeners(conn, "1 = 1", (), precision)
+    _merge(conn, "reach_sketches", "1 = 1")
+    for table, (_, parent) in SKETCH_GRAINS.items():
+        if parent is not None:
+            _roll_up(conn, table)
+    conn.execute(schema.META_DDL)
+    conn.execute(
+        "INSERT INTO warehouse_meta (key, value) VALUES ('sketch_precision', ?) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        (str(precision),),
+    )
+
+
+def refresh(conn, delta):
+    for table in RETIRED_GRAINS:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    precision = precision_for_error(SKETCH_ERROR)
+    if (
+        delta.full
+        or stored_precision(conn) != precision
+        or not all(schema.table_exists(conn, table) for table in SKETCH_DDL)
+        or delta.touched("podcasts", "episodes")
+    ):
+        rebuild(conn, precision)
+        return
+
+    moved_listeners = 0
+    if ingest_delta.changed_listener_count(conn):
+        # Only a new country or subscription moves a listener between cells.
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS reach_moved "
+            "(listener_id INTEGER PRIMARY KEY, country TEXT, subscription_type TEXT)"
+        )
+        conn.execute("DELETE FROM temp.reach_moved")
+        moved_listeners = conn.execute(
+            """
+INSERT INTO temp.reach_moved
+SELECT c.listener_id, c.country, c.subscription_type
+FROM temp.listener_changes c
+JOIN listeners l ON c.listener_id = l.listener_id
+WHERE c.country IS NOT l.country OR c.subscription_type IS NOT l.subscription_type
+"""
+        ).rowcount
+    if not delta.new_sessions and not moved_listeners:
+        return
+
+    if delta.new_sessions:
+        predicate, params = delta.session_filter
+        _hash_listeners(conn, predicate, params, precision)
+        for table in SKETCH_GRAINS:
+            _merge(conn, table, predicate, params)
+
+    if moved_listeners:
+        _move_listeners(conn)